@@ -1,81 +1,116 @@
+import os
+import sys
+import numpy as np
 import geopandas as gpd
-import xarray as xr
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
 
-sm = gpd.read_file("BGS_soildata/SoilParentMateriall_V1_portal1km.shp")
-centre_points = sm.centroid
-centre_points.name = "geometry"
-centre_points = gpd.GeoDataFrame(centre_points)
-centre_points.crs = sm.crs
-smc = gpd.sjoin(sm, centre_points, how="right")
-smc = smc.drop("index_left", axis=1)
-
-smc = smc.drop(
-    [
-        "ESB_DESC",
-        "CARB_CNTNT",
-        "PMM_GRAIN",
-        "SOIL_TEX",
-        "SOIL_DEPTH",
-        "PMM1K_UID",
-        "VERSION",
-    ],
-    axis=1,
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ecocrop_utils import SOIL_TEXTURE_BITS, make_soil_texture_bitfield
+from EU_STM_soildata.soil_texture_mask_creation import (
+    ENCODING,
+    stm_texture_masks,
+    target_grid,
 )
 
-smc["HEAVY"] = 1
-smc["MEDIUM"] = 1
-smc["LIGHT"] = 1
+"""
+Build the soil texture bit-field raster used for masking by
+ecocrop_utils.soil_type_mask_all directly from the BGS Soil Parent Material
+polygons (SoilParentMateriall_V1_portal1km.shp) on any target grid, with no
+intermediate files or GIS steps. The polygons are rasterised in one pass,
+burning the texture bits of each polygon's SOIL_GROUP into the gridpoints
+whose centres fall inside it. Gridpoints outside the BGS polygons (e.g.
+Northern Ireland) take their textures from the EU_STM texture grid,
+SoilTexture_UK_BGSESDB.tif, as in EU_STM_soildata/soil_texture_mask_creation.py.
+
+Inputs (optional):
+
+template: ----- string
+                Path to a netcdf file on the target grid, e.g. a previous
+                ecocrop output. Must be a regular grid in OSGB (EPSG:27700)
+                coordinates. Defaults to the full 1km CHESS grid.
+outfile: ------ string
+                Path to write the bit-field raster to. Defaults to
+                soil_texture_mask.nc in this folder.
+"""
+
+bgsloc = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+bgsfile = os.path.join(bgsloc, "SoilParentMateriall_V1_portal1km.shp")
+
+# Soil textures that are named in the BGS SOIL_GROUP descriptions
+BGS_TEXTURES = ["heavy", "medium", "light"]
+# Burnt into every polygon alongside its texture bits, to mark the gridpoints
+# covered by the BGS data
+BGS_COVERED = 256
 
-smc["LIGHT"] = smc["LIGHT"].where(
-    ["LIGHT" in sg for sg in list(smc["SOIL_GROUP"])], other=0
-)
-smc["MEDIUM"] = smc["MEDIUM"].where(
-    ["MEDIUM" in sg for sg in list(smc["SOIL_GROUP"])], other=0
-)
-smc["HEAVY"] = smc["HEAVY"].where(
-    ["HEAVY" in sg for sg in list(smc["SOIL_GROUP"])], other=0
-)
 
-smc_l = smc.drop(["SOIL_GROUP", "HEAVY", "MEDIUM"], axis=1)
-smc_m = smc.drop(["SOIL_GROUP", "HEAVY", "LIGHT"], axis=1)
-smc_h = smc.drop(["SOIL_GROUP", "MEDIUM", "LIGHT"], axis=1)
+def grid_transform(template):
+    """
+    Affine transform of the regular grid of template, with gridpoints at the
+    cell centres. Returns the transform and whether the grid's y coordinates
+    are ascending (rasterio rasters run north to south).
+    """
+    x = template["x"].values
+    y = template["y"].values
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+    if not np.allclose(np.diff(x), dx) or not np.allclose(np.diff(y), dy):
+        raise ValueError("The template grid must be regularly spaced in x and y")
+    transform = from_origin(x[0] - dx / 2, y.max() + abs(dy) / 2, dx, abs(dy))
+    return transform, dy > 0
 
-smc_l.to_file(driver="ESRI Shapefile", filename="BGS_soildata/light_soils.shp")
-smc_m.to_file(driver="ESRI Shapefile", filename="BGS_soildata/medium_soils.shp")
-smc_h.to_file(driver="ESRI Shapefile", filename="BGS_soildata/heavy_soils.shp")
 
-# Then use 'gdal_rasterize' from bash to conver these to raster:
-# e.g.: gdal_rasterize -tr 1000 1000 -te 0 0 700000 1250000 -a LIGHT -a_nodata 0 light_soils.shp test.tif
+def bgs_texture_bits(template, shpfile=bgsfile):
+    """
+    Rasterise the BGS soil groups onto the grid of template.
 
-template = xr.open_dataset("scores/onions.nc")["crop_suitability_score"]
-template = template[0, :, :]
-template
+    Returns a uint16 numpy array with shape (y, x) of the texture bits of the
+    polygon containing each gridpoint, or'd with BGS_COVERED, and 0 where no
+    polygon contains the gridpoint.
+    """
+    sm = gpd.read_file(shpfile).to_crs("EPSG:27700")
+    groups = sm["SOIL_GROUP"].fillna("").str.upper()
+    bits = np.full(len(sm), BGS_COVERED, dtype="uint16")
+    for texture in BGS_TEXTURES:
+        bits |= np.where(
+            groups.str.contains(texture.upper(), regex=False),
+            SOIL_TEXTURE_BITS[texture],
+            0,
+        ).astype("uint16")
 
-x1 = template["x"].values[0]
-x2 = template["x"].values[-1]
-y1 = template["y"].values[0]
-y2 = template["y"].values[-1]
+    transform, ascending = grid_transform(template)
+    burnt = rasterize(
+        zip(sm.geometry, bits),
+        out_shape=(template.sizes["y"], template.sizes["x"]),
+        transform=transform,
+        fill=0,
+        dtype="uint16",
+    )
+    if ascending:
+        burnt = burnt[::-1, :]
+    return burnt
 
-l_mask = xr.open_rasterio("BGS_soildata/light_soils.tif")
-l_mask = l_mask.drop("band").squeeze()
-l_mask.name = "light_soil_mask"
-l_mask = l_mask[::-1, :]
-l_mask.sel(x=slice(x1, x2), y=slice(y1, y2))
-l_mask = l_mask.astype("uint8")
-l_mask.to_netcdf("BGS_soildata/light_soil_mask.nc")
 
-m_mask = xr.open_rasterio("BGS_soildata/medium_soils.tif")
-m_mask = m_mask.drop("band").squeeze()
-m_mask.name = "medium_soil_mask"
-m_mask = m_mask[::-1, :]
-m_mask.sel(x=slice(x1, x2), y=slice(y1, y2))
-m_mask = m_mask.astype("uint8")
-m_mask.to_netcdf("BGS_soildata/medium_soil_mask.nc")
+if __name__ == "__main__":
+    template = target_grid(sys.argv[1] if len(sys.argv) > 1 else None)
+    if len(sys.argv) > 2:
+        outfile = sys.argv[2]
+    else:
+        outfile = os.path.join(bgsloc, "soil_texture_mask.nc")
 
-h_mask = xr.open_rasterio("BGS_soildata/heavy_soils.tif")
-h_mask = h_mask.drop("band").squeeze()
-h_mask.name = "heavy_soil_mask"
-h_mask = h_mask[::-1, :]
-h_mask.sel(x=slice(x1, x2), y=slice(y1, y2))
-h_mask = h_mask.astype("uint8")
-h_mask.to_netcdf("BGS_soildata/heavy_soil_mask.nc")
+    burnt = bgs_texture_bits(template)
+    covered = (burnt & BGS_COVERED) > 0
+    bitfield = make_soil_texture_bitfield(stm_texture_masks(template))
+    bitfield.values[covered] = burnt[covered] & 0xFF
+    bitfield.attrs["source"] = (
+        os.path.basename(bgsfile) + ", SoilTexture_UK_BGSESDB.tif elsewhere"
+    )
+    bitfield.to_netcdf(outfile, encoding=ENCODING)
+    print(
+        "BGS polygons cover "
+        + str(covered.sum())
+        + " of "
+        + str(covered.size)
+        + " gridpoints"
+    )
+    print("Written " + outfile)
@@ -0,0 +1,93 @@
+import os
+import sys
+import numpy as np
+import xarray as xr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ecocrop_utils import make_soil_texture_bitfield, grid_values
+
+"""
+Build the soil texture bit-field raster (soil_texture_mask.nc) used for
+masking by ecocrop_utils.soil_type_mask_all from the combined BGS/ESDB soil
+texture map SoilTexture_UK_BGSESDB.tif, on the 1km CHESS grid.
+
+Inputs (optional):
+
+template: ----- string
+                Path to a netcdf file on the target grid, e.g. a previous
+                ecocrop output. Defaults to the full 1km CHESS grid.
+outfile: ------ string
+                Path to write the bit-field raster to. Defaults to
+                soil_texture_mask.nc in this folder.
+"""
+
+# The texture classes in SoilTexture_UK_BGSESDB.tif, from 1 (finest) to
+# 5 (coarsest), that count as each of the soil textures used in the ecocrop
+# database. Neighbouring textures share the boundary classes.
+# Class 6 (organic) is not included as masking on it has not been verified.
+TEXTURE_CLASSES = {
+    "heavy": [1, 2],
+    "medium": [2, 3, 4],
+    "light": [4, 5],
+}
+
+stmloc = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+stmfile = os.path.join(stmloc, "SoilTexture_UK_BGSESDB.tif")
+
+# Encoding for writing the bit-field raster
+ENCODING = {
+    "soil_texture": {
+        "zlib": True,
+        "complevel": 4,
+        "dtype": np.dtype("uint8"),
+        "_FillValue": None,
+    }
+}
+
+
+def target_grid(templatefile=None):
+    """
+    The grid to build the masks on: the y and x coordinates of templatefile,
+    or the full 1km CHESS grid if templatefile is None.
+    """
+    if templatefile:
+        template = xr.open_dataset(templatefile)
+        return xr.Dataset(coords={"y": template["y"], "x": template["x"]})
+    return xr.Dataset(
+        coords={
+            "y": np.arange(500.0, 1250000.0, 1000.0),
+            "x": np.arange(500.0, 700000.0, 1000.0),
+        }
+    )
+
+
+def stm_texture_masks(template):
+    """
+    Single-texture masks on the grid of template from the nearest
+    SoilTexture_UK_BGSESDB.tif gridpoints, as {texture: xarray dataarray}.
+    """
+    stm = xr.open_dataset(stmfile, engine="rasterio")["band_data"]
+    stm = stm.drop_vars("band").squeeze("band").fillna(0)
+    classes = grid_values(stm, template)
+
+    texture_masks = {}
+    for texture, texclasses in TEXTURE_CLASSES.items():
+        texture_masks[texture] = xr.DataArray(
+            np.isin(classes, texclasses),
+            coords=[template["y"], template["x"]],
+            dims=("y", "x"),
+        )
+    return texture_masks
+
+
+if __name__ == "__main__":
+    template = target_grid(sys.argv[1] if len(sys.argv) > 1 else None)
+    if len(sys.argv) > 2:
+        outfile = sys.argv[2]
+    else:
+        outfile = os.path.join(stmloc, "soil_texture_mask.nc")
+
+    bitfield = make_soil_texture_bitfield(stm_texture_masks(template))
+    bitfield.attrs["source"] = os.path.basename(stmfile)
+    bitfield.to_netcdf(outfile, encoding=ENCODING)
+    print("Written " + outfile)
@@ -0,0 +1,621 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import datetime as dt
+import numpy as np
+import xarray as xr
+import ecocrop_utils
+import ecocrop_lotus_himem
+from ecocrop_utils import (
+    crop_params,
+    dtype_policy,
+    frs3D,
+    frs3Dwcs,
+    running_total,
+    window_sums,
+    score_temp,
+    score_temp2,
+    score_temp3,
+    score_temp4,
+    score_prec1,
+    score_prec2,
+    score_prec3,
+    score_prec_pieces,
+    gtime_arena,
+    score_gtime,
+    lcm_mask,
+    soil_type_mask_all,
+    calc_yearly_scores_only,
+    calculate_max_doy,
+    circular_avg,
+)
+from ecocrop_synthetic_data import synthetic_paths, write_synthetic_data
+from ecocrop_lotus_himem import (
+    load_met,
+    run_crop,
+    score_crop,
+    save_scores,
+    testdata_paths,
+    yearaggmethod,
+)
+
+#######################################################
+# Setup
+#######################################################
+"""
+Time the scoring kernels, rolling sums, masking and aggregation
+functions and whole runs of a crop, on the test data and on
+larger synthetic grids made by tiling it, and store the results
+so they can be compared between commits.
+
+Each microbenchmark times one call of a function on the inputs
+it is given in a run of wheat (crop 117) on the test data, with
+growing season length GMIN. After one untimed call, to warm up,
+it is repeated --repeat times and
+the fastest and median times are kept, then run once more under
+tracemalloc for its peak memory (numpy allocations included).
+The end-to-end benchmarks time scoring wheat and calculating
+its outputs as ecocrop_testdata_run.py does, on the test data
+and on grids of 2x2 and 4x4 copies of it, and a whole
+run_crop (without the plot), including reading in the driving
+data, on synthetic data from ecocrop_synthetic_data.py; they
+are run once, then once more for the peak memory. The inputs
+of the benchmarks aren't included in their times or memory.
+What the benchmarks print is hidden.
+
+The results are written to <resultsdir>/<commit>.json (with
+-dirty appended to the commit if the working tree has
+uncommitted changes), along with the versions of python, numpy
+and xarray and the machine they were run on. Running a subset
+of the benchmarks updates their results in the file for the
+commit, keeping the others.
+
+Inputs:
+
+--bench: ------ Names of the benchmarks to run, or the start
+                of their names. Defaults to all of them
+--list: ------- Only list the benchmarks
+--repeat: ----- Number of timed calls of each microbenchmark.
+                Default 5
+--compare: ---- Commit (or results file) to compare the
+                results with
+--resultsdir: - Folder of the results. Default
+                ./benchmark_results
+--testdata: --- Folder of the test driving data.
+                Default ./testdata
+--ecocroploc: - Path to the EcoCrop csv database or crop store.
+                Default ./EcoCrop_DB_secondtrim.csv
+--lcmloc: ----- Path to the land cover mask.
+                Default ./Mask_arable_LCM2015_UK.tif
+--bgsloc: ----- Path to the soil texture masks.
+                Default ./EU_STM_soildata
+--synthetic: -- Folder to keep the synthetic driving data in.
+                It is written there the first time it is
+                needed. Default ./benchmark_data
+--synthetic-size: Size of the synthetic driving data, as
+                <ny>x<nx>x<years>. At least two decades are
+                needed for the decadal outputs. Default 50x50x21
+"""
+
+# Coordinates (m) of the first gridpoint of the synthetic data, in the
+# English midlands
+SYNTHETIC_ORIGIN = {"x": 400500.0, "y": 200500.0}
+
+# Offsets (m) between the copies of the test data in the tiled grids, which
+# are placed north and west of it so they stay within the UK masks
+TILE_STEP = {"y": 50000.0, "x": -102000.0}
+
+
+def tile_met(met, ny, nx):
+    """
+    Driving data of ny x nx copies of met, each variable's grid repeated
+    TILE_STEP apart in y and x.
+    """
+    tiled = []
+    for var in met:
+        rows = []
+        for i in range(ny):
+            row = [
+                var.assign_coords(
+                    y=var["y"] + i * TILE_STEP["y"], x=var["x"] + j * TILE_STEP["x"]
+                )
+                for j in range(nx)
+            ]
+            rows.append(xr.concat(row[::-1], "x"))
+        tiled.append(xr.concat(rows, "y"))
+    return tuple(tiled)
+
+
+def clear_mask_caches():
+    """
+    Forget the masks ecocrop_utils has read and aligned, so the masking
+    benchmarks include reading them.
+    """
+    ecocrop_utils._MASK_RASTERS.clear()
+    ecocrop_utils._GRID_VALUES.clear()
+    ecocrop_utils._GRID_MASKS.clear()
+
+
+def crop_gtime(inputs):
+    return int(need(inputs, "crop")["GMIN"])
+
+
+def pre_total(inputs):
+    return frs3D(need(inputs, "met")[3].values, crop_gtime(inputs), "float32")
+
+
+def tas_avg(inputs):
+    gtime = crop_gtime(inputs)
+    return frs3D(need(inputs, "met")[0].values, gtime, "float32") / gtime
+
+
+def gtime_inputs(inputs):
+    crop = need(inputs, "crop")
+    tas, tmn, tmx, pre = need(inputs, "met")
+    dtypes = dtype_policy()
+    totals = {
+        "temp": running_total(
+            tas,
+            dtypes["totals"],
+            func=lambda block: score_temp2(
+                block, crop["TMIN"], crop["TMAX"], crop["TOPMIN"], crop["TOPMAX"]
+            ),
+        ),
+        "ktmp": running_total(
+            tmn, dtypes["counts"], func=lambda block: block < crop["KTMP"]
+        ),
+        "kmax": running_total(
+            tmx, dtypes["counts"], func=lambda block: block > crop["KMAX"]
+        ),
+        "pre": running_total(pre.values, dtypes["totals"]),
+    }
+    ndays = tas.shape[0]
+    gtime = crop_gtime(inputs)
+    pieces = score_prec_pieces(
+        ecocrop_lotus_himem.precmethod,
+        crop["PMIN"],
+        crop["PMAX"],
+        crop["POPMIN"],
+        crop["POPMAX"],
+    )
+    arena = gtime_arena((ndays - gtime + 1,) + tas.shape[1:], dtypes)
+    props = [
+        np.zeros((ndays - crop["GMAX"] + 1,) + tas.shape[1:], dtype="float32")
+        for prop in range(2)
+    ]
+    return gtime, totals, pieces, arena, props
+
+
+def scored_crop(inputs):
+    crop = need(inputs, "crop")
+    scores = score_crop(crop, *need(inputs, "met"), "annual")
+    # which also names them, as calc_yearly_scores_only needs
+    save_scores(need(inputs, "outdir"), crop["cropname"], *scores)
+    return scores
+
+
+def yearly_tempscore(inputs):
+    return need(inputs, "scores")[1].groupby("time.year").quantile(0.95)
+
+
+def e2e(inputs, ny, nx):
+    met = need(inputs, "met")
+    if ny * nx > 1:
+        met = tile_met(met, ny, nx)
+    crop = need(inputs, "crop")
+    outdir = need(inputs, "outdir")
+
+    def run():
+        # the stages of run_crop that ecocrop_testdata_run.py runs, as the
+        # test data is too short for the decadal ones
+        scores = score_crop(crop, *met, "annual")
+        save_scores(outdir, crop["cropname"], *scores)
+        calculate_max_doy(*scores[:3])
+        calc_yearly_scores_only(
+            scores[1],
+            scores[2],
+            str(crop["SOIL"]),
+            need(inputs, "lcmloc"),
+            need(inputs, "bgsloc"),
+            crop["cropname"],
+            outdir,
+            yearaggmethod,
+        )
+
+    return run
+
+
+def synthetic_data(inputs):
+    """
+    Paths of the synthetic driving data of the size given in inputs, written
+    by ecocrop_synthetic_data.py to a subfolder of the synthetic folder the
+    first time it is needed and reused after that.
+    """
+    ny, nx, years = need(inputs, "synthetic_size")
+    datadir = os.path.join(
+        need(inputs, "synthetic"),
+        "synthetic_" + str(ny) + "x" + str(nx) + "_" + str(years) + "y",
+    )
+    paths = synthetic_paths(datadir)
+    donefile = os.path.join(datadir, "complete")
+    if not os.path.exists(donefile):
+        write_synthetic_data(
+            datadir, nx, ny, SYNTHETIC_ORIGIN["x"], SYNTHETIC_ORIGIN["y"], years=years
+        )
+        open(donefile, "w").close()
+    return paths
+
+
+def e2e_synthetic(inputs):
+    paths = need(inputs, "synthetic_paths")
+    crop = need(inputs, "crop")
+    outdir = need(inputs, "outdir")
+
+    def run():
+        # the whole of run_crop, apart from the plot, as for the real data
+        met = load_met("85", "01", "", paths=paths)
+        run_crop(crop, *met, "annual", outdir, outdir, plot=False)
+
+    return run
+
+
+# Functions that return each input of the benchmarks, from the other inputs
+INPUTS = {
+    "met": lambda inputs: load_met("85", "01", "", paths=need(inputs, "paths")),
+    "scores": scored_crop,
+    "pre_total": pre_total,
+    "tas_avg": tas_avg,
+    "pre_prefix": lambda inputs: running_total(
+        need(inputs, "met")[3].values, "float32"
+    ),
+    "gtime": gtime_inputs,
+    "tempscore_years": yearly_tempscore,
+    "synthetic_paths": synthetic_data,
+    "maxdoys": lambda inputs: calculate_max_doy(*need(inputs, "scores")[:3])[0],
+}
+
+
+def need(inputs, name):
+    """
+    Input name of the benchmarks, calculated by its function in INPUTS the
+    first time it is asked for and kept in the dict inputs.
+    """
+    if name not in inputs:
+        inputs[name] = INPUTS[name](inputs)
+    return inputs[name]
+
+
+def temp_params(crop):
+    return crop["TMIN"], crop["TMAX"], crop["TOPMIN"], crop["TOPMAX"]
+
+
+def prec_params(crop):
+    return crop["PMIN"], crop["PMAX"], crop["POPMIN"], crop["POPMAX"]
+
+
+def bench_score_gtime(inputs):
+    gtime, totals, pieces, arena, props = need(inputs, "gtime")
+    crop = need(inputs, "crop")
+    return lambda: score_gtime(
+        gtime, crop["GMIN"], crop["GMAX"], totals, None, pieces, arena, *props
+    )
+
+
+def bench_yearly(inputs):
+    crop = need(inputs, "crop")
+    return lambda: calc_yearly_scores_only(
+        need(inputs, "scores")[1],
+        need(inputs, "scores")[2],
+        str(crop["SOIL"]),
+        need(inputs, "lcmloc"),
+        need(inputs, "bgsloc"),
+        crop["cropname"],
+        need(inputs, "outdir"),
+        "percentile",
+    )
+
+
+def bench_lcm_mask(inputs):
+    def run():
+        clear_mask_caches()
+        lcm_mask(need(inputs, "lcmloc"), need(inputs, "tempscore_years").copy())
+
+    return run
+
+
+def bench_soil_mask(inputs):
+    def run():
+        clear_mask_caches()
+        soil_type_mask_all(
+            need(inputs, "tempscore_years").copy(),
+            str(need(inputs, "crop")["SOIL"]),
+            need(inputs, "bgsloc"),
+        )
+
+    return run
+
+
+# Microbenchmarks: name -> function of the inputs returning the call to time
+MICRO = {
+    "load_met": lambda inputs: lambda: load_met(
+        "85", "01", "", paths=need(inputs, "paths")
+    ),
+    "frs3D": lambda inputs: lambda: frs3D(
+        need(inputs, "met")[3].values, crop_gtime(inputs), "float32"
+    ),
+    "frs3Dwcs": lambda inputs: lambda: frs3Dwcs(
+        need(inputs, "pre_prefix")[1:], crop_gtime(inputs)
+    ),
+    "running_total": lambda inputs: lambda: running_total(
+        need(inputs, "met")[3].values, "float32"
+    ),
+    "window_sums": lambda inputs: lambda: window_sums(
+        need(inputs, "pre_prefix"), crop_gtime(inputs)
+    ),
+    "score_temp": lambda inputs: lambda: score_temp(
+        crop_gtime(inputs), need(inputs, "crop")["GMIN"], need(inputs, "crop")["GMAX"]
+    ),
+    "score_temp2": lambda inputs: lambda: score_temp2(
+        need(inputs, "met")[0], *temp_params(need(inputs, "crop"))
+    ),
+    "score_temp3": lambda inputs: lambda: score_temp3(
+        need(inputs, "tas_avg"), *temp_params(need(inputs, "crop"))
+    ),
+    "score_temp4": lambda inputs: lambda: score_temp4(
+        need(inputs, "tas_avg"), *temp_params(need(inputs, "crop"))
+    ),
+    "score_prec1": lambda inputs: lambda: score_prec1(
+        need(inputs, "pre_total"), *prec_params(need(inputs, "crop"))
+    ),
+    "score_prec2": lambda inputs: lambda: score_prec2(
+        need(inputs, "pre_total"), *prec_params(need(inputs, "crop"))
+    ),
+    "score_prec3": lambda inputs: lambda: score_prec3(
+        need(inputs, "pre_total"), *prec_params(need(inputs, "crop"))
+    ),
+    "score_gtime": bench_score_gtime,
+    "score_crop": lambda inputs: lambda: score_crop(
+        need(inputs, "crop"), *need(inputs, "met"), "annual"
+    ),
+    "lcm_mask": bench_lcm_mask,
+    "soil_type_mask_all": bench_soil_mask,
+    "calc_yearly_scores_only": bench_yearly,
+    "calculate_max_doy": lambda inputs: lambda: calculate_max_doy(
+        *need(inputs, "scores")[:3]
+    ),
+    "circular_avg": lambda inputs: lambda: circular_avg(
+        need(inputs, "maxdoys"), "year"
+    ),
+}
+
+# End-to-end benchmarks, run once
+E2E = {
+    "e2e_testdata": lambda inputs: e2e(inputs, 1, 1),
+    "e2e_tiled_2x2": lambda inputs: e2e(inputs, 2, 2),
+    "e2e_tiled_4x4": lambda inputs: e2e(inputs, 4, 4),
+    "e2e_synthetic": e2e_synthetic,
+}
+
+
+def measure(call, repeat):
+    """
+    Fastest and median times of repeat calls of call, and the peak memory
+    traced by tracemalloc over one more.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": min(times),
+        "median_seconds": float(np.median(times)),
+        "repeat": repeat,
+        "peak_bytes": peak,
+    }
+
+
+def git_commit():
+    """
+    Short hash of the commit checked out, with -dirty appended if the
+    working tree has uncommitted changes, or "unknown" outside git.
+    """
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        )
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit.decode().strip() + ("-dirty" if status.strip() else "")
+
+
+def results_file(resultsdir, commit):
+    if os.path.exists(commit):
+        return commit
+    return os.path.join(resultsdir, commit + ".json")
+
+
+def load_results(resultsfile):
+    with open(resultsfile) as f:
+        return json.load(f)
+
+
+def select(names, patterns):
+    """
+    The names that are, or start with, one of patterns (all if None).
+    """
+    if not patterns:
+        return list(names)
+    selected = [name for name in names if any(name.startswith(p) for p in patterns)]
+    if not selected:
+        raise ValueError("No benchmarks match " + ", ".join(patterns))
+    return selected
+
+
+def run_benchmarks(names, inputs, repeat, log=sys.stdout):
+    """
+    Run the named benchmarks, returning {name: results}, see measure.
+    """
+    results = {}
+    for name in names:
+        log.write("Running " + name + "\n")
+        log.flush()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if name in MICRO:
+                call = MICRO[name](inputs)
+                # untimed, to calculate the inputs it needs and warm up
+                call()
+                results[name] = measure(call, repeat)
+            else:
+                results[name] = measure(E2E[name](inputs), 1)
+        log.write(
+            "    "
+            + "%.4g" % results[name]["seconds"]
+            + "s, peak "
+            + "%.4g" % (results[name]["peak_bytes"] / 1.0e6)
+            + "MB\n"
+        )
+    return results
+
+
+def add_data_args(parser):
+    """
+    Add the options for the data the benchmarks are run on to parser
+    """
+    parser.add_argument("--testdata", default="./testdata")
+    parser.add_argument("--ecocroploc", default="./EcoCrop_DB_secondtrim.csv")
+    parser.add_argument("--lcmloc", default="./Mask_arable_LCM2015_UK.tif")
+    parser.add_argument("--bgsloc", default="./EU_STM_soildata")
+    parser.add_argument("--synthetic", default="./benchmark_data")
+
+
+def run_with_inputs(names, args, synthetic_size, repeat, log=sys.stdout):
+    """
+    Run the named benchmarks on the data given by the options from
+    add_data_args, with synthetic data of synthetic_size (<ny>x<nx>x<years>).
+    Their outputs are written to a temporary folder, removed afterwards.
+    """
+    # run_crop reads the masks from the module's settings
+    ecocrop_lotus_himem.lcmloc = args.lcmloc
+    ecocrop_lotus_himem.bgsloc = args.bgsloc
+    outdir = tempfile.mkdtemp(prefix="ecocrop_benchmark_")
+    inputs = dict(
+        paths=testdata_paths(args.testdata),
+        crop=crop_params(args.ecocroploc, 117),
+        lcmloc=args.lcmloc,
+        bgsloc=args.bgsloc,
+        outdir=outdir,
+        synthetic=args.synthetic,
+        synthetic_size=tuple(int(n) for n in synthetic_size.split("x")),
+    )
+    try:
+        return run_benchmarks(names, inputs, repeat, log)
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def run_info(commit):
+    """
+    The commit, date, machine and versions the benchmarks were run with
+    """
+    return {
+        "commit": commit,
+        "date": str(dt.datetime.now()),
+        "machine": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "xarray": xr.__version__,
+    }
+
+
+def compare(results, reference):
+    """
+    Lines comparing the time and peak memory of each benchmark in results
+    with those in reference.
+    """
+    lines = [
+        "%-26s %10s %10s %7s %10s %10s %7s"
+        % ("benchmark", "ref s", "s", "ratio", "ref MB", "MB", "ratio")
+    ]
+    for name, result in results.items():
+        ref = reference.get(name)
+        if ref is None:
+            lines.append("%-26s %10s %10.4g" % (name, "-", result["seconds"]))
+            continue
+        lines.append(
+            "%-26s %10.4g %10.4g %7.2f %10.4g %10.4g %7.2f"
+            % (
+                name,
+                ref["seconds"],
+                result["seconds"],
+                result["seconds"] / ref["seconds"],
+                ref["peak_bytes"] / 1.0e6,
+                result["peak_bytes"] / 1.0e6,
+                result["peak_bytes"] / max(ref["peak_bytes"], 1),
+            )
+        )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the EcoCrop scoring on the test data and on "
+        "larger synthetic grids"
+    )
+    parser.add_argument("--bench", nargs="+")
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare")
+    parser.add_argument("--resultsdir", default="./benchmark_results")
+    add_data_args(parser)
+    parser.add_argument("--synthetic-size", default="50x50x21")
+    args = parser.parse_args(argv)
+
+    names = select(list(MICRO) + list(E2E), args.bench)
+    if args.list:
+        print("\n".join(names))
+        return
+
+    # read before this run's results might overwrite them
+    reference = None
+    if args.compare:
+        reference = load_results(results_file(args.resultsdir, args.compare))
+    results = run_with_inputs(names, args, args.synthetic_size, args.repeat)
+
+    commit = git_commit()
+    resultsfile = results_file(args.resultsdir, commit)
+    stored = {"benchmarks": {}}
+    if os.path.exists(resultsfile):
+        stored = load_results(resultsfile)
+    stored.update(run_info(commit))
+    stored["benchmarks"].update(results)
+    if not os.path.exists(args.resultsdir):
+        os.makedirs(args.resultsdir)
+    with open(resultsfile, "w") as f:
+        json.dump(stored, f, indent=1)
+    print("Written results to " + resultsfile)
+
+    if reference is not None:
+        print("Compared with " + reference["commit"] + ":")
+        print("\n".join(compare(results, reference["benchmarks"])))
+
+
+if __name__ == "__main__":
+    main()
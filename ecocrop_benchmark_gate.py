@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import argparse
+from ecocrop_benchmark import (
+    add_data_args,
+    git_commit,
+    load_results,
+    run_info,
+    run_with_inputs,
+)
+
+#######################################################
+# Setup
+#######################################################
+"""
+Check a fixed set of the benchmarks of ecocrop_benchmark.py
+for performance regressions: run them on the test data and
+on a small grid of synthetic data, compare their times and
+peak memory with those stored in a baseline file committed
+to the repository, print a table of the differences and exit
+with status 1 if any is slower or needs more memory than the
+tolerances allow, e.g. before merging a change to
+ecocrop_utils.py.
+
+A benchmark only fails on time if its fastest time is more
+than --time-tolerance times the baseline's and at least
+--time-slack seconds longer, so very short benchmarks don't
+fail on timer noise. Benchmarks that fail on time are run
+again up to --retries times, keeping their fastest time, in
+case another process slowed them down. Likewise a benchmark
+only fails on memory if its peak is more than
+--memory-tolerance times the baseline's and at least
+--memory-slack MB more. Benchmarks missing from the baseline
+fail too.
+
+Times are only comparable on the same kind of machine, so
+the baseline should be remade with --update on the machine
+the gate is run on whenever that changes, or when a change
+is meant to be slower. The synthetic data size and number of
+repeats are taken from the baseline, so the gate always runs
+the benchmarks as the baseline did.
+
+Inputs:
+
+--baseline: --- Baseline file. Default ./benchmark_baseline.json
+--update: ----- Run the benchmarks and write their results to
+                the baseline, instead of checking them
+--bench: ------ Names of the gate's benchmarks to run, or the
+                start of their names. Defaults to all of them
+--time-tolerance: Largest ratio of the time to the baseline's.
+                Default 1.5
+--time-slack: - Smallest increase in time (seconds) that fails.
+                Default 0.01
+--memory-tolerance: Largest ratio of the peak memory to the
+                baseline's. Default 1.1
+--memory-slack: Smallest increase in peak memory (MB) that
+                fails. Default 1
+--retries: ---- Times to rerun a benchmark that fails on time.
+                Default 2
+--repeat: ----- With --update, number of timed calls of each
+                microbenchmark. Default 5
+--synthetic-size: With --update, size of the synthetic data.
+                Default 24x24x21
+--testdata, --ecocroploc, --lcmloc, --bgsloc, --synthetic:
+                As for ecocrop_benchmark.py
+"""
+
+# The benchmarks the gate runs: the rolling sums, the scoring of a growing
+# season length and of a whole crop, the masks and the aggregations on the
+# test data, and whole runs on the test data and synthetic data
+GATE_BENCHMARKS = [
+    "running_total",
+    "window_sums",
+    "score_gtime",
+    "score_crop",
+    "lcm_mask",
+    "soil_type_mask_all",
+    "calc_yearly_scores_only",
+    "calculate_max_doy",
+    "circular_avg",
+    "e2e_testdata",
+    "e2e_synthetic",
+]
+
+
+def regressions(result, base, args):
+    """
+    Which of time and memory of result have regressed from those of base,
+    beyond the tolerances in args
+    """
+    failed = []
+    if (
+        result["seconds"] > base["seconds"] * args.time_tolerance
+        and result["seconds"] - base["seconds"] >= args.time_slack
+    ):
+        failed.append("time")
+    if (
+        result["peak_bytes"] > base["peak_bytes"] * args.memory_tolerance
+        and result["peak_bytes"] - base["peak_bytes"] >= args.memory_slack * 1.0e6
+    ):
+        failed.append("memory")
+    return failed
+
+
+def gate_report(results, baseline, args):
+    """
+    Lines of a table comparing each benchmark in results with baseline, and
+    the names of those that regressed
+    """
+    lines = [
+        "%-24s %10s %10s %7s %10s %10s %7s  %s"
+        % ("benchmark", "base s", "s", "ratio", "base MB", "MB", "ratio", "status")
+    ]
+    failed = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            failed.append(name)
+            lines.append(
+                "%-24s %10s %10.4g %7s %10s %10.4g %7s  %s"
+                % (
+                    name,
+                    "-",
+                    result["seconds"],
+                    "",
+                    "-",
+                    result["peak_bytes"] / 1.0e6,
+                    "",
+                    "FAIL (not in baseline)",
+                )
+            )
+            continue
+        regressed = regressions(result, base, args)
+        if regressed:
+            failed.append(name)
+        lines.append(
+            "%-24s %10.4g %10.4g %7.2f %10.4g %10.4g %7.2f  %s"
+            % (
+                name,
+                base["seconds"],
+                result["seconds"],
+                result["seconds"] / base["seconds"],
+                base["peak_bytes"] / 1.0e6,
+                result["peak_bytes"] / 1.0e6,
+                result["peak_bytes"] / max(base["peak_bytes"], 1),
+                "FAIL (" + ", ".join(regressed) + ")" if regressed else "ok",
+            )
+        )
+    return lines, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the benchmarks for regressions in time and memory "
+        "against a stored baseline"
+    )
+    parser.add_argument("--baseline", default="./benchmark_baseline.json")
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--bench", nargs="+")
+    parser.add_argument("--time-tolerance", type=float, default=1.5)
+    parser.add_argument("--time-slack", type=float, default=0.01)
+    parser.add_argument("--memory-tolerance", type=float, default=1.1)
+    parser.add_argument("--memory-slack", type=float, default=1.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--synthetic-size", default="24x24x21")
+    add_data_args(parser)
+    args = parser.parse_args(argv)
+
+    names = GATE_BENCHMARKS
+    if args.bench:
+        names = [n for n in names if any(n.startswith(p) for p in args.bench)]
+        if not names:
+            raise ValueError("No gate benchmarks match " + ", ".join(args.bench))
+
+    if args.update:
+        results = run_with_inputs(names, args, args.synthetic_size, args.repeat)
+        stored = {"benchmarks": {}}
+        if os.path.exists(args.baseline):
+            stored = load_results(args.baseline)
+        stored.update(run_info(git_commit()))
+        stored.update({"synthetic_size": args.synthetic_size, "repeat": args.repeat})
+        stored["benchmarks"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=1)
+        print("Written baseline to " + args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        raise ValueError("No baseline at " + args.baseline + ", make one with --update")
+    baseline = load_results(args.baseline)
+    results = run_with_inputs(
+        names, args, baseline["synthetic_size"], baseline["repeat"]
+    )
+    for attempt in range(args.retries):
+        retry = [
+            name
+            for name, result in results.items()
+            if name in baseline["benchmarks"]
+            and "time" in regressions(result, baseline["benchmarks"][name], args)
+        ]
+        if not retry:
+            break
+        print("Rerunning the benchmarks that were slower: " + ", ".join(retry))
+        rerun = run_with_inputs(
+            retry, args, baseline["synthetic_size"], baseline["repeat"]
+        )
+        for name, result in rerun.items():
+            if result["seconds"] < results[name]["seconds"]:
+                results[name]["seconds"] = result["seconds"]
+                results[name]["median_seconds"] = result["median_seconds"]
+
+    lines, failed = gate_report(results, baseline["benchmarks"], args)
+    print(
+        "Compared with the baseline from "
+        + baseline["commit"]
+        + " on "
+        + baseline["machine"]
+        + " ("
+        + baseline["date"]
+        + ")"
+    )
+    print("\n".join(lines))
+    if failed:
+        print(
+            str(len(failed))
+            + " of "
+            + str(len(results))
+            + " benchmarks regressed: "
+            + ", ".join(failed)
+        )
+        sys.stdout.flush()
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import argparse
+from ecocrop_utils import verify_checksum_manifest
+from ecocrop_lotus_himem import CHECKSUM_TILE, write_output_checksums
+
+#######################################################
+# Setup
+#######################################################
+"""
+Write or verify checksums of the outputs of a crop, to check
+that a run gives the same outputs as an earlier one without
+keeping or reading in the whole of the earlier outputs.
+
+Each variable of each output (the daily scores, ktmp/kmax
+proportions, yearly and decadal scores and the days of year
+of the maximum scores, from ecocrop_lotus_himem.py) is split
+into chunks of one year (or decade) and one tile of --tile x
+--tile gridpoints, and the SHA-256 hash of each chunk, as
+stored in the file, is written to a json manifest. Verifying
+reads each output one year at a time, hashes its chunks and
+prints which outputs, years and tiles differ from the
+manifest, exiting with status 1 if any do.
+
+Inputs:
+
+action: ------- 'write' or 'verify'
+outdir: ------- Folder of the outputs (savedir)
+cropname: ----- Name of the crop, as in the outputs' filenames
+--manifest: --- Manifest file. Default
+                <outdir>/<cropname>_checksums.json
+--tile: ------- With write, size of the tiles (gridpoints).
+                Default 100
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write or verify checksums of the outputs of a crop"
+    )
+    parser.add_argument("action", choices=["write", "verify"])
+    parser.add_argument("outdir", help="folder of the outputs")
+    parser.add_argument("cropname", help="name of the crop")
+    parser.add_argument("--manifest")
+    parser.add_argument("--tile", type=int, default=CHECKSUM_TILE)
+    args = parser.parse_args(argv)
+
+    manifestfile = args.manifest or os.path.join(
+        args.outdir, args.cropname + "_checksums.json"
+    )
+    if args.action == "write":
+        write_output_checksums(args.outdir, args.cropname, manifestfile, args.tile)
+        return
+
+    print("Verifying the outputs in " + args.outdir + " against " + manifestfile)
+    sys.stdout.flush()
+    differences = verify_checksum_manifest(manifestfile, args.outdir)
+    if differences:
+        print("\n".join(differences))
+        sys.stdout.flush()
+        sys.exit(1)
+    print("All outputs are the same")
+
+
+if __name__ == "__main__":
+    main()
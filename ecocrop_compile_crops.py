@@ -0,0 +1,48 @@
+import sys
+from ecocrop_utils import compile_crop_store, load_crop_store
+
+#######################################################
+# Setup
+#######################################################
+"""
+Compile the EcoCrop database into a crop store: typed arrays
+of each crop's parameters, already converted to the units of
+the met data, with each crop's name, whether it can be run
+and why not (see ecocrop_validate_crops.py). Jobs given the
+crop store instead of the database look up their crop
+without parsing the csv.
+
+Inputs:
+
+ecocroploc: --- string
+                Path to EcoCrop csv database containing the crop
+                indices
+bgsloc: ------- string
+                Path to the soil texture mask for masking, or the
+                folder containing it
+storefile: ---- string (optional)
+                Path to write the crop store to.
+                Defaults to EcoCrop_DB_secondtrim.npz
+"""
+
+ecocroploc = sys.argv[1]
+bgsloc = sys.argv[2]
+if len(sys.argv) > 3:
+    storefile = sys.argv[3]
+else:
+    storefile = "EcoCrop_DB_secondtrim.npz"
+
+#######################################################
+# Main script
+#######################################################
+
+compile_crop_store(ecocroploc, storefile, bgsloc)
+store = load_crop_store(storefile)
+print(
+    "Compiled "
+    + str(len(store["cropind"]))
+    + " crops, "
+    + str(store["runnable"].sum())
+    + " runnable"
+)
+print("Written " + storefile)
@@ -0,0 +1,190 @@
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import xarray as xr
+from ecocrop_utils import DTYPE_POLICIES, crop_params, dtype_policy
+from ecocrop_lotus_himem import load_met, score_crop, testdata_paths, yearaggmethod
+
+#######################################################
+# Setup
+#######################################################
+"""
+Compare the dtype policies (see ecocrop_utils.DTYPE_POLICIES)
+on the test data, to pick the cheapest one whose scores stay
+within tolerance of those calculated in float64.
+
+Each crop is scored with each policy, as ecocrop_lotus_himem.py
+would, and the memory of the driving data, the peak memory of
+the scoring (measured with tracemalloc), the time it took and
+the largest and mean differences of the daily and yearly
+scores and of the average ktmp/kmax_days proportions from
+those of the "reference" policy are printed. The yearly scores
+are aggregated with the yearaggmethod of
+ecocrop_lotus_himem.py, without masking.
+
+Inputs:
+
+--crops: ------ Indices or names of the crops to score,
+                separated by commas. Default 117 (wheat)
+--method: ----- 'annual' or 'perennial'. Default annual
+--policies: --- dtype policies to compare. Defaults to all of
+                them. The reference policy is always run
+--tolerance: -- Largest difference of the daily and yearly
+                scores (0-100) a policy may have. Default 1
+--prop-tolerance: Largest difference of the average ktmp/kmax
+                proportions (0-1). Default 0.01
+--testdata: --- Folder of the test driving data.
+                Default ./testdata
+--ecocroploc: - Path to the EcoCrop csv database or crop store.
+                Default ./EcoCrop_DB_secondtrim.csv
+"""
+
+SCORES = ["final", "temp", "prec"]
+PROPS = ["ktmp_prop", "kmax_prop"]
+
+
+def yearly_scores(tempscore, precscore, dtype):
+    """
+    Yearly scores, as calculated by calc_yearly_scores_only but without
+    masking or saving them.
+    """
+    groups = [tempscore.groupby("time.year"), precscore.groupby("time.year")]
+    if yearaggmethod == "percentile":
+        years = [group.quantile(0.95) for group in groups]
+    else:
+        years = [getattr(group, yearaggmethod)() for group in groups]
+    tempyears, precyears = [year.astype(dtype) for year in years]
+    allyears = xr.where(precyears < tempyears, precyears, tempyears)
+    return {"final_years": allyears, "temp_years": tempyears, "prec_years": precyears}
+
+
+def run_policy(crops, method, policy, paths):
+    """
+    Score the crops with the dtype policy. Returns the outputs of each crop
+    and the memory of the driving data, the peak memory of the scoring
+    (bytes) and the time it took (seconds).
+    """
+    dtypes = dtype_policy(policy)
+    met = load_met("85", "01", "", dtypes, paths)
+    metbytes = sum(m.nbytes for m in met)
+    outputs = []
+    peak = 0
+    seconds = 0.0
+    for crop in crops:
+        tracemalloc.start()
+        start = time.time()
+        scores = score_crop(crop, *met, method, dtypes=dtypes)
+        seconds += time.time() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        output = dict(zip(SCORES + PROPS, [score.values for score in scores]))
+        years = yearly_scores(scores[1], scores[2], dtypes["years"])
+        output.update({name: year.values for name, year in years.items()})
+        outputs.append(output)
+    return outputs, metbytes, metbytes + peak, seconds
+
+
+def differences(outputs, reference):
+    """
+    Largest and mean absolute difference of each output from the
+    reference, over all the crops.
+    """
+    diffs = {}
+    for name in reference[0]:
+        absdiff = np.concatenate(
+            [
+                np.abs(
+                    output[name].astype("float64") - ref[name].astype("float64")
+                ).ravel()
+                for output, ref in zip(outputs, reference)
+            ]
+        )
+        diffs[name] = (np.nanmax(absdiff), np.nanmean(absdiff))
+    return diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the memory, time and accuracy of the dtype "
+        "policies on the test data"
+    )
+    parser.add_argument("--crops", default="117")
+    parser.add_argument("--method", default="annual")
+    parser.add_argument(
+        "--policies", nargs="+", choices=list(DTYPE_POLICIES), default=None
+    )
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--prop-tolerance", type=float, default=0.01)
+    parser.add_argument("--testdata", default="./testdata")
+    parser.add_argument("--ecocroploc", default="./EcoCrop_DB_secondtrim.csv")
+    args = parser.parse_args(argv)
+
+    policies = args.policies or list(DTYPE_POLICIES)
+    if "reference" not in policies:
+        policies = ["reference"] + policies
+    else:
+        policies = ["reference"] + [p for p in policies if p != "reference"]
+    crops = []
+    for cropind in args.crops.split(","):
+        if cropind.isdigit():
+            crops.append(crop_params(args.ecocroploc, int(cropind)))
+        else:
+            crops.append(crop_params(args.ecocroploc, cropname=cropind))
+    paths = testdata_paths(args.testdata)
+
+    results = {}
+    for policy in policies:
+        print("Scoring with the " + policy + " dtype policy")
+        sys.stdout.flush()
+        results[policy] = run_policy(crops, args.method, policy, paths)
+
+    reference = results["reference"][0]
+    lines = ["", "dtype policy report (" + args.method + " method)"]
+    within = []
+    for policy in policies:
+        outputs, metbytes, peak, seconds = results[policy]
+        diffs = differences(outputs, reference)
+        lines.append(
+            policy
+            + ": driving data "
+            + str(round(metbytes / 1.0e6, 1))
+            + "MB, peak "
+            + str(round(peak / 1.0e6, 1))
+            + "MB, "
+            + str(round(seconds, 2))
+            + "s"
+        )
+        ok = True
+        for name, (maxdiff, meandiff) in diffs.items():
+            if name in PROPS:
+                ok = ok and maxdiff <= args.prop_tolerance
+            else:
+                ok = ok and maxdiff <= args.tolerance
+            lines.append(
+                "    "
+                + name
+                + ": max difference "
+                + "%.4g" % maxdiff
+                + ", mean "
+                + "%.4g" % meandiff
+            )
+        if ok:
+            within.append((peak, policy))
+    if within:
+        lines.append(
+            "Cheapest policy within tolerance: "
+            + min(within)[1]
+            + " (within tolerance: "
+            + ", ".join(policy for peak, policy in sorted(within))
+            + ")"
+        )
+    else:
+        lines.append("No policy is within tolerance")
+    print("\n".join(lines))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import sys
+import argparse
+import itertools
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from ecocrop_utils import DTYPE_POLICIES, input_manifest
+from ecocrop_lotus_himem import (
+    add_checkpoint_args,
+    add_trace_args,
+    begin_trace,
+    finish_trace,
+    load_crop,
+    load_met,
+    open_prefix_sums,
+    run_crop,
+    scenario_paths,
+    write_output_checksums,
+)
+
+#######################################################
+# Setup
+#######################################################
+"""
+Run one crop for several RCPs and ensemble members of the
+CHESS-SCAPE data in a single job, instead of one job per
+combination. The crop parameters are looked up once, the
+land cover and soil masks are only read once (they are
+cached by ecocrop_utils), the work arrays are reused, and
+the driving data of the next combination is read in while
+the current one is scored.
+
+Reading ahead means the job holds the driving data of two
+combinations at once, so it needs roughly the memory of
+the met data more than a single ecocrop_lotus_himem.py
+job. Use --no-prefetch to turn it off.
+
+Inputs:
+
+cropind: ------ integer or string
+                Index or name of the crop, as for
+                ecocrop_lotus_himem.py
+pf: ----------- string
+                As for ecocrop_lotus_himem.py
+method: ------- string
+                As for ecocrop_lotus_himem.py
+--rcps: ------- strings
+                RCPs to run. Defaults to 85 26
+--ensmems: ---- strings
+                Ensemble members to run. Defaults to
+                01 04 06 15
+--no-prefetch:  Don't read the next combination's driving
+                data while scoring the current one
+--checkpoint-dir, --checkpoint-every, --resume:
+                As for ecocrop_lotus_himem.py. Each combination
+                has its own checkpoint, so a resumed job skips
+                the combinations that had finished
+--cache: ------ As for ecocrop_lotus_himem.py
+--prefix-dir: - As for ecocrop_lotus_himem.py
+--dtypes: ----- As for ecocrop_lotus_himem.py
+--checksums: -- As for ecocrop_lotus_himem.py
+--trace, --progress-every, --trace-memory:
+                As for ecocrop_lotus_himem.py. The driving data
+                read ahead is traced as a separate load_met span
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calculate the EcoCrop suitability scores of a crop for "
+        "several rcps and ensemble members of the CHESS-SCAPE data"
+    )
+    parser.add_argument("cropind", help="index or name of the crop")
+    parser.add_argument("pf", help="'past' or 'future'")
+    parser.add_argument("method", help="'annual' or 'perennial'")
+    parser.add_argument("--rcps", nargs="+", default=["85", "26"])
+    parser.add_argument("--ensmems", nargs="+", default=["01", "04", "06", "15"])
+    parser.add_argument("--no-prefetch", action="store_true")
+    add_checkpoint_args(parser)
+    add_trace_args(parser)
+    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--prefix-dir")
+    parser.add_argument("--dtypes", choices=list(DTYPE_POLICIES), default="balanced")
+    parser.add_argument("--checksums", action="store_true")
+    args = parser.parse_args(argv)
+
+    crop = load_crop(args.cropind)
+    begin_trace(args)
+    scenarios = list(itertools.product(args.rcps, args.ensmems))
+    buffers = {}
+
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        nextmet = reader.submit(load_met, *scenarios[0], args.pf, args.dtypes)
+        for i, (rcp, ensmem) in enumerate(scenarios):
+            print("Running rcp" + rcp + " ensemble member " + ensmem)
+            print("Start: " + str(dt.datetime.now()))
+            sys.stdout.flush()
+            tas, tmn, tmx, pre = nextmet.result()
+            last = i + 1 == len(scenarios)
+            if not last and not args.no_prefetch:
+                nextmet = reader.submit(
+                    load_met, *scenarios[i + 1], args.pf, args.dtypes
+                )
+
+            paths = scenario_paths(rcp, ensmem, args.pf)
+            savedir, plotdir = paths[4:]
+            manifest = input_manifest(paths[:4]) if args.cache else None
+            prefix = None
+            if args.prefix_dir:
+                prefix = open_prefix_sums(args.prefix_dir, rcp, ensmem, args.pf)
+            run_crop(
+                crop,
+                tas,
+                tmn,
+                tmx,
+                pre,
+                args.method,
+                savedir,
+                plotdir,
+                buffers,
+                args.checkpoint_dir,
+                args.resume,
+                args.checkpoint_every,
+                manifest=manifest,
+                prefix=prefix,
+                dtypes=args.dtypes,
+            )
+            if args.checksums:
+                write_output_checksums(savedir, crop["cropname"])
+            del tas, tmn, tmx, pre
+
+            if not last and args.no_prefetch:
+                nextmet = reader.submit(
+                    load_met, *scenarios[i + 1], args.pf, args.dtypes
+                )
+            print("Finished rcp" + rcp + " ensemble member " + ensmem)
+            print("End: " + str(dt.datetime.now()))
+    if args.trace:
+        finish_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,58 @@
 import sys
+import argparse
 from ecocrop_utils import (
+    crop_params,
+    growing_season_lengths,
+    work_buffer,
+    new_memo,
+    memoised,
+    memo_report,
+    save_checkpoint,
+    load_checkpoint,
+    input_manifest,
+    content_hash,
+    crop_mask,
+    apply_mask,
+    soil_texture_file,
     calc_yearly_scores_only,
-    frs3D,
+    dtype_policy,
+    DTYPE_POLICIES,
+    SCORE_PARAMS,
+    scoring_key,
+    estimate_crop_resources,
+    memory_plan,
+    recommend_blocks,
+    calc_decadal_changes,
+    calc_decadal_doy_changes,
+    calc_decadal_kprop_changes,
+    calculate_max_doy,
+    running_total,
+    window_sums,
+    gtime_arena,
+    add_days_prop,
+    piecewise_score,
+    score_gtime,
     score_temp,
     score_temp2,
-    score_temp4,
-    score_prec1,
-    score_prec2,
-    score_prec3,
-    plot_year,
+    score_temp4_pieces,
+    score_prec_pieces,
+    plot_decade,
+    write_checksum_manifest,
+    traced,
+    trace_span,
+    trace_note,
+    trace_progress,
+    start_trace,
+    stop_trace,
+    trace_summary,
+    trace_memory_summary,
 )
-import pandas as pd
 import xarray as xr
 import numpy as np
 import datetime as dt
+import json
 import os
+import netCDF4
 
 #######################################################
 # Setup
@@ -22,9 +60,93 @@ import os
 """
 Inputs:
 
-cropind: ------ integer
-                Index of ecocroploc to use. Determines the crop
-                that is run
+cropind: ------ integer or string
+                Index of ecocroploc to use, or the crop name
+                (as used in the output filenames). Determines
+                the crop that is run. Several crops can be given,
+                separated by commas, to run them one after the
+                other on the same driving data. Crops with the
+                same scoring parameters as one run before them
+                link to its daily scores (and, if they also have
+                the same TEXT, all its outputs) instead of
+                recalculating them
+--plan: ------- Only print the predicted peak memory of each
+                stage, the arrays that dominate it and the
+                predicted runtime, from the driving data's
+                metadata without reading it in
+--mem-limit: -- float (GB). With --plan, recommend the tile
+                size or time block length that fits within
+                this memory
+--checkpoint-dir: string
+                Folder to write checkpoints to, ideally on fast
+                local storage. Each crop's running maximum scores,
+                ktmp/kmax proportion totals and progress are
+                written there during the growing season length
+                loop and after each post-processing stage, and
+                removed once the crop is finished. Off by default
+--checkpoint-every: integer
+                Number of growing season lengths between
+                checkpoints. Default 1
+--resume: ----- Continue each crop from its checkpoint in
+                --checkpoint-dir, if there is one, instead of
+                starting from scratch. Checkpoints made with
+                different crop parameters, precmethod,
+                yearaggmethod or driving data are ignored
+--memo-mem: --- float (GB). When running several crops, keep up
+                to this much memory of the intermediates that
+                only depend on some of the crop parameters (the
+                running totals of the precipitation, and of the
+                days below KTMP, above KMAX and within the
+                temperature thresholds), so that each is only
+                calculated once. This memory
+                is on top of that predicted by --plan. Off by
+                default
+--prefix-dir: - string. Folder of running totals of the
+                precipitation and temperature written by
+                ecocrop_prefix_sums.py, to read their rolling
+                sums from instead of recalculating them for
+                each growing season length
+--dtypes: ----- string. dtype policy, the precision the driving
+                data is read in and each stage is calculated in:
+                "reference" (float64 throughout), "balanced" or
+                "low-memory". Default "balanced", which the scores
+                have always been calculated with. See
+                ecocrop_dtype_report.py to compare them
+--cache: ------ Skip each stage whose outputs are already in
+                savedir and were made from the same crop
+                parameters, driving data, masks and code, as
+                recorded in the <cropname>_cache.json file
+                written alongside them
+--append: ----- Extend each crop's existing outputs in savedir to
+                the end of the driving data, e.g. when new years
+                have been added to it. Only the driving data from
+                the last existing daily output onwards is read and
+                scored and only the new days are written to the
+                daily outputs; the yearly and decadal outputs are
+                then recalculated from them, read back a year at a
+                time. With --plan, the append is planned instead
+--trace: ------ string. File to append a JSON line to for each
+                stage run (reading the data, each growing season
+                length, saving, masking, the yearly and decadal
+                outputs and plotting), with its wall and CPU time,
+                the bytes read and written and the gridpoint-days
+                processed per second. A summary of the time spent
+                in each stage is printed at the end, and progress
+                lines with an estimate of the time left are
+                printed while each crop is scored. Off by default
+--checksums: -- After running each crop, write checksums of each
+                year and 100km tile of all its outputs to
+                <cropname>_checksums.json in savedir, to verify
+                other runs against with ecocrop_checksums.py
+--progress-every: float. Seconds between the progress lines
+                when tracing. Default 60
+--trace-memory: 'rss' or 'tracemalloc'. With --trace, also
+                record the peak resident memory of the job during
+                each stage and how much more is resident at its
+                end than at its start, and print a table of them.
+                'tracemalloc' also records the memory allocated by
+                python and numpy within each stage, which is exact
+                but slower. Off by default
 rcp: ---------- string
                 Relative Concentration Pathway version of the
                 driving meteorological data to use. Options are
@@ -43,7 +165,8 @@ pf: ----------- string
                 test script
 ecocroploc: --- string
                 Path to EcoCrop csv database containing the crop
-                indices
+                indices, or the crop store compiled from it by
+                ecocrop_compile_crops.py
 tasvname: ----- string
                 Variable name of the daily average temperature in
                 the meterological driving data
@@ -76,11 +199,6 @@ verify: ------- integer
                 precmethod 2.
 """
 
-cropind = int(sys.argv[1])
-rcp = sys.argv[2]  # '85' or '26'
-ensmem = sys.argv[3]  # '01', '04', '06' or '15
-pf = sys.argv[4]  # 'past' or 'future'
-method = sys.argv[5]  # 'annual' or 'perennial'
 ecocroploc = "/gws/nopw/j04/ceh_generic/matbro/ecocrop/EcoCrop_DB_secondtrim.csv"
 tasvname = "tas"
 prevname = "pr"
@@ -89,549 +207,1479 @@ tmxvname = "tasmax"
 lcmloc = "/gws/nopw/j04/ceh_generic/matbro/ecocrop/Mask_arable_LCM2015_UK.tif"
 bgsloc = "/gws/nopw/j04/ceh_generic/matbro/ecocrop/EU_STM_soildata"
 
-if pf == "past":
-    ab = "b2020"
-elif pf == "future":
-    ab = "a2020"
-else:
-    ab = ""
-
-if rcp in ["85", "26"]:
-    rcp2 = rcp + "/"
-else:
-    rcp = ""
-    rcp2 = ""
-
-if ensmem in ["01", "04", "06", "15"]:
-    ensmem2 = ensmem + "/"
-else:
-    ensmem = ""
-    ensmem2 = ""
-
-taspath = (
-    "/badc/deposited2021/chess-scape/data/rcp"
-    + rcp2
-    + ensmem2
-    + "daily/tas/chess-scape_rcp"
-    + rcp
-    + "_"
-    + ensmem
-    + "_tas_uk_1km_daily_????????-????????.nc"
-)
-prepath = (
-    "/badc/deposited2021/chess-scape/data/rcp"
-    + rcp2
-    + ensmem2
-    + "daily/pr/chess-scape_rcp"
-    + rcp
-    + "_"
-    + ensmem
-    + "_pr_uk_1km_daily_????????-????????.nc"
-)
-tmnpath = (
-    "/badc/deposited2021/chess-scape/data/rcp"
-    + rcp2
-    + ensmem
-    + "daily/tasmin/chess-scape_rcp"
-    + rcp
-    + "_"
-    + ensmem
-    + "_tasmin_uk_1km_daily_????????-????????.nc"
-)
-tmxpath = (
-    "/badc/deposited2021/chess-scape/data/rcp"
-    + rcp2
-    + ensmem2
-    + "daily/tasmax/chess-scape_rcp"
-    + rcp
-    + "_"
-    + ensmem
-    + "_tasmax_uk_1km_daily_????????-????????.nc"
-)
-savedir = (
-    "/gws/nopw/j04/ceh_generic/matbro/ecocrop/scores_rcp"
-    + rcp
-    + "_ens"
-    + ensmem
-    + "_"
-    + ab
-)
-plotdir = (
-    "/gws/nopw/j04/ceh_generic/matbro/ecocrop/plots_rcp"
-    + rcp
-    + "_ens"
-    + ensmem
-    + "_"
-    + ab
-)
-
 yearaggmethod = "percentile"
 precmethod = 2
 
 
-#######################################################
-# Main script
-#######################################################
+def scenario_paths(rcp, ensmem, pf):
+    """
+    Paths of the driving data for the rcp and ensemble member, and of the
+    output directories, as (taspath, prepath, tmnpath, tmxpath, savedir,
+    plotdir).
+    """
+    if pf == "past":
+        ab = "b2020"
+    elif pf == "future":
+        ab = "a2020"
+    else:
+        ab = ""
 
-# Read in ecocrop database and select out indices for
-# the crop, and convert the units
-ecocropall = pd.read_csv(ecocroploc, engine="python")
-ecocrop = ecocropall.drop(["level_0"], axis=1)
-print("Cropind: " + str(cropind))
-testcrop = ecocrop.iloc[
-    cropind, :
-]  # 19 onions, #117 wheat, #147 chickpea, #66 sweet potato
-TOPMIN = testcrop["TOPMN"] + 273.15  # C-->K
-TOPMAX = testcrop["TOPMX"] + 273.15  # C-->K
-TMIN = testcrop["TMIN"] + 273.15  # C-->K
-TMAX = testcrop["TMAX"] + 273.15  # C-->K
-PMIN = testcrop["RMIN"] / 86400.0  # mm-->kg/m^2/s
-PMAX = testcrop["RMAX"] / 86400.0  # mm-->kg/m^2/s
-POPMIN = testcrop["ROPMN"] / 86400.0  # mm-->kg/m^2/s
-POPMAX = testcrop["ROPMX"] / 86400.0  # mm-->kg/m^2/s
-KTMP = testcrop["KTMPR"] + 273.15  # C-->K
-KMAX = testcrop["TMAX"] + 273.15  # C-->K
-GMIN = int(testcrop["GMIN"])
-GMAX = int(testcrop["GMAX"])
-SOIL = testcrop["TEXT"]
-COMNAME = testcrop["COMNAME"]
-COMNAME = "_".join(COMNAME.split(",")[0].split(" "))
-if "(" in COMNAME:
-    COMNAME = "".join(COMNAME.split("("))
-    COMNAME = "".join(COMNAME.split(")"))
-if "'" in COMNAME:
-    COMNAME = "".join(COMNAME.split("'"))
-cropname = COMNAME
-
-# Check for missing data
-if np.isnan(testcrop["TOPMN"]):
-    raise ValueError("Missing TOPMN")
-if np.isnan(testcrop["TOPMX"]):
-    raise ValueError("Missing TOPMX")
-if np.isnan(testcrop["TMIN"]):
-    raise ValueError("Missing TMIN")
-if np.isnan(testcrop["TMAX"]):
-    raise ValueError("Missing TMAX (KMAX)")
-if np.isnan(testcrop["RMIN"]):
-    raise ValueError("Missing RMIN")
-if np.isnan(testcrop["RMAX"]):
-    raise ValueError("Missing RMAX")
-if np.isnan(testcrop["ROPMN"]):
-    raise ValueError("Missing ROPMN")
-if np.isnan(testcrop["ROPMX"]):
-    raise ValueError("Missing ROPMX")
-if np.isnan(testcrop["GMIN"]):
-    raise ValueError("Missing GMIN")
-if np.isnan(testcrop["GMAX"]):
-    raise ValueError("Missing GMAX")
-
-# exit if GMIN=GMAX, assume missing data
-if GMAX - GMIN <= 10:
-    raise ValueError(
-        "GMIN and GMAX too close, not enough info to calculate suitability"
-    )
-
-# assume killing temp of -1 if not specified
-if np.isnan(KTMP):
-    KTMP = -1
-
-GMIN = int(GMIN)
-GMAX = int(GMAX)
-print("TMN: " + str(testcrop["TMIN"]))
-print("TMX: " + str(testcrop["TMAX"]))
-print("TOPMN: " + str(testcrop["TOPMN"]))
-print("TOPMX: " + str(testcrop["TOPMX"]))
-print("KTMP: " + str(testcrop["KTMPR"]))
-print("KMAX: " + str(testcrop["TMAX"]))
-print("GMIN: " + str(testcrop["GMIN"]))
-print("GMAX: " + str(testcrop["GMAX"]))
-print("PMIN: " + str(testcrop["RMIN"]))
-print("PMAX: " + str(testcrop["RMAX"]))
-print("POPMN: " + str(testcrop["ROPMN"]))
-print("POPMX: " + str(testcrop["ROPMX"]))
-print("SOIL: " + str(SOIL))
-sys.stdout.flush()
-
-if not os.path.exists(savedir):
-    os.makedirs(savedir)
-if not os.path.exists(plotdir):
-    os.makedirs(plotdir)
-
-# open datafiles
-print("Reading in met data")
-print("Start: " + str(dt.datetime.now()))
-sys.stdout.flush()
-tas = xr.open_mfdataset(taspath).astype("float16")[tasvname]
-tmn = xr.open_mfdataset(tmnpath).astype("float16")[tmnvname]
-tmx = xr.open_mfdataset(tmxpath).astype("float16")[tmxvname]
-pre = xr.open_mfdataset(prepath)[prevname]
-if pf == "past":
-    tas = tas.sel(time=slice(tas["time"][0], "2021-01-01")).load()
-    tmn = tmn.sel(time=slice(tmn["time"][0], "2021-01-01")).load()
-    tmx = tmx.sel(time=slice(tmx["time"][0], "2021-01-01")).load()
-    pre = pre.sel(time=slice(pre["time"][0], "2021-01-01")).load()
-elif pf == "future":
-    tas = tas.sel(time=slice("2020-01-01", tas["time"][-1])).load()
-    tmn = tmn.sel(time=slice("2020-01-01", tmn["time"][-1])).load()
-    tmx = tmx.sel(time=slice("2020-01-01", tmx["time"][-1])).load()
-    pre = pre.sel(time=slice("2020-01-01", pre["time"][-1])).load()
-else:
-    print("Past or future not selected so loading entire dataset")
-    tas = tas.load()
-    tmn = tmn.load()
-    tmx = tmx.load()
-    pre = pre.load()
-
-tastime = tas["time"]
-tasy = tas["y"]
-tasx = tas["x"]
-
-if method == "perennial":
-    tas = tas.values
-print("End: " + str(dt.datetime.now()))
-
-# Calculate the days within the crop temperature range,
-# below the killing temperature and above the
-# maximum temperature
-print("Calculating topt_, ktmp_ and kmax_crop")
-print("Start: " + str(dt.datetime.now()))
-sys.stdout.flush()
-if method == "annual":
-    topt_crop = score_temp2(tas, TMIN, TMAX, TOPMIN, TOPMAX).values
-ktmp_crop = xr.where(tmn < KTMP, 1, 0).astype("uint16").values
-kmax_crop = xr.where(tmx > KMAX, 1, 0).astype("uint16").values
-print("End: " + str(dt.datetime.now()))
-sys.stdout.flush()
-
-# Determine growing season lengths to assess
-# Intervals of 10 days are used to reduce
-# computational cost
-if GMAX - GMIN <= 15:
-    gstart = np.int16(np.floor(GMIN / 10) * 10)
-else:
-    gstart = np.int16(np.ceil(GMIN / 10) * 10)
-gend = np.int16(np.ceil(GMAX / 10) * 10)
-allgtimes = list(np.arange(gstart, gend, 10, dtype="int16"))
-
-# create arrays to store the total proportion of ktmp/kmax days amassed over all the gtimes
-# for later calculating the average
-print("Creating ktmp_days_prop and kmax_days_prop arrays")
-print("Start: " + str(dt.datetime.now()))
-ktmp_days_prop_total = ktmp_crop.copy()[: -allgtimes[-1] + 1].astype("float32")
-kmax_days_prop_total = kmax_crop.copy()[: -allgtimes[-1] + 1].astype("float32")
-ktmp_days_prop_total[:] = 0
-kmax_days_prop_total[:] = 0
-kdptlen = ktmp_days_prop_total.shape[0]
-print("End: " + str(dt.datetime.now()))
-sys.stdout.flush()
-
-counter = 1
-GMIN = np.uint16(GMIN)
-GMAX = np.uint16(GMAX)
-# Loop over each growing season length
-for gtime in allgtimes:
-    print(
-        "Calculating suitability for "
-        + cropname
-        + " for a growing season of length "
-        + str(gtime)
-        + " out of a maximum of "
-        + str(int(GMAX))
+    if rcp in ["85", "26"]:
+        rcp2 = rcp + "/"
+    else:
+        rcp = ""
+        rcp2 = ""
+
+    if ensmem in ["01", "04", "06", "15"]:
+        ensmem2 = ensmem + "/"
+    else:
+        ensmem = ""
+        ensmem2 = ""
+
+    taspath = (
+        "/badc/deposited2021/chess-scape/data/rcp"
+        + rcp2
+        + ensmem2
+        + "daily/tas/chess-scape_rcp"
+        + rcp
+        + "_"
+        + ensmem
+        + "_tas_uk_1km_daily_????????-????????.nc"
     )
-    print("Start: " + str(dt.datetime.now()))
+    prepath = (
+        "/badc/deposited2021/chess-scape/data/rcp"
+        + rcp2
+        + ensmem2
+        + "daily/pr/chess-scape_rcp"
+        + rcp
+        + "_"
+        + ensmem
+        + "_pr_uk_1km_daily_????????-????????.nc"
+    )
+    tmnpath = (
+        "/badc/deposited2021/chess-scape/data/rcp"
+        + rcp2
+        + ensmem2
+        + "daily/tasmin/chess-scape_rcp"
+        + rcp
+        + "_"
+        + ensmem
+        + "_tasmin_uk_1km_daily_????????-????????.nc"
+    )
+    tmxpath = (
+        "/badc/deposited2021/chess-scape/data/rcp"
+        + rcp2
+        + ensmem2
+        + "daily/tasmax/chess-scape_rcp"
+        + rcp
+        + "_"
+        + ensmem
+        + "_tasmax_uk_1km_daily_????????-????????.nc"
+    )
+    savedir = (
+        "/gws/nopw/j04/ceh_generic/matbro/ecocrop/scores_rcp"
+        + rcp
+        + "_ens"
+        + ensmem
+        + "_"
+        + ab
+    )
+    plotdir = (
+        "/gws/nopw/j04/ceh_generic/matbro/ecocrop/plots_rcp"
+        + rcp
+        + "_ens"
+        + ensmem
+        + "_"
+        + ab
+    )
+
+    return taspath, prepath, tmnpath, tmxpath, savedir, plotdir
+
+
+def testdata_paths(testdata="./testdata"):
+    """
+    (taspath, prepath, tmnpath, tmxpath) of the test driving data in the
+    folder testdata, to pass to open_met or load_met as paths.
+    """
+    return tuple(
+        os.path.join(
+            testdata,
+            var,
+            "chess-scape_rcp85_01_" + var + "_uk_1km_daily_????????-????????.nc",
+        )
+        for var in ["tas", "pr", "tasmin", "tasmax"]
+    )
+
+
+def load_crop(cropind):
+    """
+    Look up the parameters of the crop, given its index or name, and check
+    that it can be run.
+    """
+    # Look up the parameters of the crop, already converted
+    # to the units of the met data, in the compiled crop store
+    # (or the ecocrop database, compiled in memory)
+    if cropind.isdigit():
+        crop = crop_params(
+            ecocroploc, int(cropind)
+        )  # 19 onions, #117 wheat, #147 chickpea, #66 sweet potato
+    else:
+        crop = crop_params(ecocroploc, cropname=cropind)
+    print("Cropind: " + str(crop["cropind"]))
+
+    # Exit if the crop can't be run, e.g. missing data
+    if not crop["runnable"]:
+        raise ValueError(crop["problems"])
+    if crop["warnings"]:
+        print(crop["warnings"])
 
-    # Calculate temperature suitability score
-    print("Calculating T suitability")
+    print("TMN: " + str(round(crop["TMIN"] - 273.15, 2)))
+    print("TMX: " + str(round(crop["TMAX"] - 273.15, 2)))
+    print("TOPMN: " + str(round(crop["TOPMIN"] - 273.15, 2)))
+    print("TOPMX: " + str(round(crop["TOPMAX"] - 273.15, 2)))
+    print("KTMP: " + str(round(crop["KTMP"] - 273.15, 2)))
+    print("KMAX: " + str(round(crop["KMAX"] - 273.15, 2)))
+    print("GMIN: " + str(crop["GMIN"]))
+    print("GMAX: " + str(crop["GMAX"]))
+    print("PMIN: " + str(round(crop["PMIN"] * 86400.0, 2)))
+    print("PMAX: " + str(round(crop["PMAX"] * 86400.0, 2)))
+    print("POPMN: " + str(round(crop["POPMIN"] * 86400.0, 2)))
+    print("POPMX: " + str(round(crop["POPMAX"] * 86400.0, 2)))
+    print("SOIL: " + str(crop["SOIL"]))
     sys.stdout.flush()
-    if method == "annual":
-        tscore1 = score_temp(gtime, GMIN, GMAX).astype("uint8")
-    # calculate ndays of T in optimal/suitable range within gtime
-    tcoords_tas = tastime[: -gtime + 1]
-    ycoords_tas = tasy
-    xcoords_tas = tasx
-    if method == "annual":
-        toptdays = (frs3D(topt_crop, gtime, "float32")).round().astype("uint16")
-    elif method == "perennial":
-        toptdays = (frs3D(tas, gtime, "float32") / gtime).round().astype("uint16")
-    toptdays = xr.DataArray(toptdays, coords=[tcoords_tas, ycoords_tas, xcoords_tas])
-    toptdays.name = "TOPT_days"
-    if method == "annual":
-        tscore = xr.where(toptdays >= GMIN, tscore1, np.uint8(0))
-    elif method == "perennial":
-        tscore = score_temp4(toptdays, TMIN, TMAX, TOPMIN, TOPMAX)
-    print("End: " + str(dt.datetime.now()))
+    return crop
+
+
+def open_met(rcp, ensmem, pf, dtypes=None, paths=None):
+    """
+    Open the driving data for the rcp and ensemble member without reading
+    it into memory, as (tas, tmn, tmx, pre), in the temperature and
+    precipitation dtypes of the dtype policy dtypes (see dtype_policy).
+    paths are the (taspath, prepath, tmnpath, tmxpath) to open instead of
+    those of the rcp and ensemble member, e.g. for the test data.
+    """
+    dtypes = dtype_policy(dtypes)
+    if paths is None:
+        paths = scenario_paths(rcp, ensmem, pf)[:4]
+    taspath, prepath, tmnpath, tmxpath = paths
+    tas = xr.open_mfdataset(taspath).astype(dtypes["temperature"])[tasvname]
+    tmn = xr.open_mfdataset(tmnpath).astype(dtypes["temperature"])[tmnvname]
+    tmx = xr.open_mfdataset(tmxpath).astype(dtypes["temperature"])[tmxvname]
+    pre = xr.open_mfdataset(prepath).astype(dtypes["precipitation"])[prevname]
+    if pf == "past":
+        tas = tas.sel(time=slice(tas["time"][0], "2021-01-01"))
+        tmn = tmn.sel(time=slice(tmn["time"][0], "2021-01-01"))
+        tmx = tmx.sel(time=slice(tmx["time"][0], "2021-01-01"))
+        pre = pre.sel(time=slice(pre["time"][0], "2021-01-01"))
+    elif pf == "future":
+        tas = tas.sel(time=slice("2020-01-01", tas["time"][-1]))
+        tmn = tmn.sel(time=slice("2020-01-01", tmn["time"][-1]))
+        tmx = tmx.sel(time=slice("2020-01-01", tmx["time"][-1]))
+        pre = pre.sel(time=slice("2020-01-01", pre["time"][-1]))
+    return tas, tmn, tmx, pre
 
-    # calculate whether any of the suitable days/locations identified above will have
-    # frost/killing temp within gtime
-    print("Calculating frost days and their proportions")
+
+@traced
+def load_met(rcp, ensmem, pf, dtypes=None, paths=None):
+    """
+    Read the driving data for the rcp and ensemble member into memory, as
+    (tas, tmn, tmx, pre). dtypes and paths as for open_met.
+    """
+    # open datafiles
+    print("Reading in met data")
     print("Start: " + str(dt.datetime.now()))
     sys.stdout.flush()
-    tcoords_tmn = tmn["time"][: -gtime + 1]
-    ycoords_tmn = tmn["y"]
-    xcoords_tmn = tmn["x"]
-    ktmp_days = frs3D(ktmp_crop, gtime, "uint16")
-    ktmp_days_prop_total += (ktmp_days / gtime)[:kdptlen]
-    ktmp_days = xr.DataArray(ktmp_days, coords=[tcoords_tmn, ycoords_tmn, xcoords_tmn])
-    ktmp_days.name = "KTMP_days"
-    print(ktmp_days_prop_total.dtype)
+    if pf not in ["past", "future"]:
+        print("Past or future not selected so loading entire dataset")
+    tas, tmn, tmx, pre = [
+        met.load() for met in open_met(rcp, ensmem, pf, dtypes, paths)
+    ]
+    trace_note(cells_days=int(tas.size))
     print("End: " + str(dt.datetime.now()))
+    return tas, tmn, tmx, pre
+
+
+def prefix_dir(storedir, rcp, ensmem, pf):
+    """
+    Folder of the running totals of the driving data for the rcp and
+    ensemble member in storedir, see ecocrop_prefix_sums.py
+    """
+    name = "rcp" + rcp + "_" + ensmem
+    if pf in ["past", "future"]:
+        name += "_" + pf
+    return os.path.join(storedir, name)
+
+
+def prefix_key(rcp, ensmem, pf):
+    """
+    The driving data the running totals are calculated from: the manifest
+    of the precipitation and temperature files and the times and shape of
+    the data used from them
+    """
+    taspath, prepath = scenario_paths(rcp, ensmem, pf)[:2]
+    tas = open_met(rcp, ensmem, pf)[0]
+    return {
+        "manifest": input_manifest([prepath, taspath]),
+        "start": str(tas["time"].values[0]),
+        "end": str(tas["time"].values[-1]),
+        "shape": list(tas.shape),
+    }
+
+
+def open_prefix_sums(storedir, rcp, ensmem, pf):
+    """
+    Memory-map the running totals of the precipitation and temperature
+    written by ecocrop_prefix_sums.py, as {"pre": array, "tas": array},
+    checking they were calculated from the current driving data.
+    """
+    outdir = prefix_dir(storedir, rcp, ensmem, pf)
+    keyfile = os.path.join(outdir, "prefix_sums.json")
+    if not os.path.exists(keyfile):
+        raise ValueError(
+            "No running totals in " + outdir + ", run ecocrop_prefix_sums.py first"
+        )
+    with open(keyfile) as f:
+        key = json.load(f)
+    if key != prefix_key(rcp, ensmem, pf):
+        raise ValueError(
+            "The running totals in "
+            + outdir
+            + " are out of date, rerun ecocrop_prefix_sums.py"
+        )
+    print("Reading rolling sums from the running totals in " + outdir)
+    return {
+        name: np.load(os.path.join(outdir, name + "_prefix.npy"), mmap_mode="r")
+        for name in ["pre", "tas"]
+    }
+
+
+@traced
+def score_crop(
+    crop,
+    tas,
+    tmn,
+    tmx,
+    pre,
+    method,
+    buffers=None,
+    checkpointfile=None,
+    checkpoint=None,
+    checkpoint_every=1,
+    precip_carry=None,
+    memo=None,
+    prefix=None,
+    dtypes=None,
+):
+    """
+    Calculate the daily crop, temperature and precipitation suitability
+    scores and the average ktmp_ and kmax_days proportions of the crop from
+    the driving data. buffers is an optional dict of work arrays to reuse
+    between runs on the same grid, see work_buffer. The scores of each
+    growing season length are calculated by score_gtime, on numpy arrays
+    only, in work arrays allocated once per crop (see gtime_arena), and the
+    coordinates are only attached to the final scores.
+
+    If checkpointfile is given, the running maximum scores and the ktmp_ and
+    kmax_days proportion totals are written to it every checkpoint_every
+    growing season lengths. checkpoint is the (state, arrays) of a
+    checkpoint read by load_checkpoint to continue from. precip_carry is
+    the running total of the precipitation before the start of pre, when
+    continuing an earlier run, see running_total. memo is an optional memo
+    (see memoised) of the running totals that depend on only some of the
+    crop parameters, shared between crops run on the same driving data. prefix
+    is an optional dict of the running totals of the precipitation ("pre")
+    and temperature ("tas") from open_prefix_sums, to read their rolling
+    sums from instead of recalculating them. They are only used with the
+    default dtype policy's temperature, precipitation and totals dtypes,
+    which they were calculated with. dtypes is the dtype policy, see
+    dtype_policy.
+    """
+    TOPMIN = crop["TOPMIN"]
+    TOPMAX = crop["TOPMAX"]
+    TMIN = crop["TMIN"]
+    TMAX = crop["TMAX"]
+    PMIN = crop["PMIN"]
+    PMAX = crop["PMAX"]
+    POPMIN = crop["POPMIN"]
+    POPMAX = crop["POPMAX"]
+    KTMP = crop["KTMP"]
+    KMAX = crop["KMAX"]
+    GMIN = crop["GMIN"]
+    GMAX = crop["GMAX"]
+    cropname = crop["cropname"]
+    state, arrays = checkpoint or ({}, {})
+    trace_note(cropname=cropname, cells_days=int(tas.size))
+    dtypes = dtype_policy(dtypes)
+    if prefix is not None and any(
+        dtypes[stage] != dtype_policy()[stage]
+        for stage in ["temperature", "precipitation", "totals"]
+    ):
+        print("Not using the stored running totals, which have different dtypes")
+        prefix = None
+
+    tastime = tas["time"]
+    tasy = tas["y"]
+    tasx = tas["x"]
 
-    # calculate whether any of the suitable days/locations identified above will have
-    # heat killing temp within gtime
-    print("Calculating heat-stress days and their proportions")
+    # Calculate the running totals of the days within the crop
+    # temperature range (or of the temperature), below the killing
+    # temperature and above the maximum temperature, and of the
+    # precipitation, from which their rolling sums over each growing
+    # season length are read off
+    print("Calculating running totals of topt_, ktmp_ and kmax_crop")
     print("Start: " + str(dt.datetime.now()))
     sys.stdout.flush()
-    tcoords_tmx = tmx["time"][: -gtime + 1]
-    ycoords_tmx = tmx["y"]
-    xcoords_tmx = tmx["x"]
-    kmax_days = frs3D(kmax_crop, gtime, "uint16")
-    kmax_days_prop_total += (kmax_days / gtime)[:kdptlen]
-    kmax_days = xr.DataArray(kmax_days, coords=[tcoords_tmx, ycoords_tmx, xcoords_tmx])
-    kmax_days.name = "KMAX_days"
+    totals = {}
+    if method == "annual":
+        totals["temp"] = memoised(
+            memo,
+            ("topt_total", TMIN, TMAX, TOPMIN, TOPMAX),
+            lambda: running_total(
+                tas,
+                dtypes["totals"],
+                func=lambda block: score_temp2(
+                    block, TMIN, TMAX, TOPMIN, TOPMAX, dtypes["topt"]
+                ),
+            ),
+        )
+    elif prefix is not None:
+        totals["temp"] = prefix["tas"]
+    else:
+        totals["temp"] = memoised(
+            memo,
+            ("tas_total",),
+            lambda: running_total(tas.values, dtypes["totals"]),
+        )
+    totals["ktmp"] = memoised(
+        memo,
+        ("ktmp_total", KTMP),
+        lambda: running_total(tmn, dtypes["counts"], func=lambda block: block < KTMP),
+    )
+    totals["kmax"] = memoised(
+        memo,
+        ("kmax_total", KMAX),
+        lambda: running_total(tmx, dtypes["counts"], func=lambda block: block > KMAX),
+    )
+    if prefix is not None:
+        totals["pre"] = prefix["pre"]
+    else:
+        totals["pre"] = memoised(
+            memo,
+            ("precip_total",),
+            lambda: running_total(pre.values, dtypes["totals"], carry=precip_carry),
+        )
     print("End: " + str(dt.datetime.now()))
+    sys.stdout.flush()
 
-    print("Calculating total precipitation")
+    # Determine growing season lengths to assess
+    # Intervals of 10 days are used to reduce
+    # computational cost
+    allgtimes = growing_season_lengths(GMIN, GMAX)
+
+    # create arrays to store the total proportion of ktmp/kmax days amassed over all the gtimes
+    # for later calculating the average, and the work arrays reused for each gtime
+    print("Creating ktmp_days_prop and kmax_days_prop arrays")
     print("Start: " + str(dt.datetime.now()))
-    sys.stdout.flush()
-    # calculate total precipitation in gtime
-    tcoords_pre = pre["time"][: -gtime + 1]
-    ycoords_pre = pre["y"]
-    xcoords_pre = pre["x"]
-    pre2 = pre.values
-    precip_crop = frs3D(pre2, gtime, "float32")
-    precip_crop = xr.DataArray(
-        precip_crop, coords=[tcoords_pre, ycoords_pre, xcoords_pre]
-    )
-    precip_crop.name = "precip_total"
+    ndays = tas.shape[0]
+    kshape = (ndays - allgtimes[-1] + 1,) + tas.shape[1:]
+    ktmp_days_prop_total = work_buffer(
+        buffers, "ktmp_days_prop_total", kshape, dtypes["proportions"]
+    )
+    kmax_days_prop_total = work_buffer(
+        buffers, "kmax_days_prop_total", kshape, dtypes["proportions"]
+    )
+    arena = gtime_arena((ndays - allgtimes[0] + 1,) + tas.shape[1:], dtypes)
+    if method == "annual":
+        temp_pieces = None
+    elif method == "perennial":
+        temp_pieces = score_temp4_pieces(TMIN, TMAX, TOPMIN, TOPMAX)
+    prec_pieces = score_prec_pieces(precmethod, PMIN, PMAX, POPMIN, POPMAX)
     print("End: " + str(dt.datetime.now()))
+    sys.stdout.flush()
+
+    ntime = 0
+    gtimes_done = state.get("gtimes_done", 0)
+    if gtimes_done:
+        print(
+            "Continuing from checkpoint after "
+            + str(gtimes_done)
+            + " of "
+            + str(len(allgtimes))
+            + " growing season lengths"
+        )
+        ktmp_days_prop_total[...] = arrays["ktmp_days_prop_total"]
+        kmax_days_prop_total[...] = arrays["kmax_days_prop_total"]
+        ntime = arrays["tempscore"].shape[0]
+        arena["tempscore"][:ntime] = arrays["tempscore"]
+        arena["precscore"][:ntime] = arrays["precscore"]
+    counter = gtimes_done + 1
+    GMIN = np.uint16(GMIN)
+    GMAX = np.uint16(GMAX)
+    # Loop over each growing season length, always taking the highest of
+    # the growing season scores as this is the growing season length the
+    # crop will likely grow in
+    for gtime in allgtimes[gtimes_done:]:
+        print(
+            "Calculating suitability for "
+            + cropname
+            + " for a growing season of length "
+            + str(gtime)
+            + " out of a maximum of "
+            + str(int(GMAX))
+        )
+        print("Start: " + str(dt.datetime.now()))
+        sys.stdout.flush()
+        ntime = score_gtime(
+            gtime,
+            GMIN,
+            GMAX,
+            totals,
+            temp_pieces,
+            prec_pieces,
+            arena,
+            ktmp_days_prop_total,
+            kmax_days_prop_total,
+        )
+        print("End: " + str(dt.datetime.now()))
+        trace_progress(cropname + " growing season lengths", counter, len(allgtimes))
+        sys.stdout.flush()
+
+        if (
+            checkpointfile
+            and counter % checkpoint_every == 0
+            and counter < len(allgtimes)
+        ):
+            print("Writing checkpoint after growing season length " + str(gtime))
+            sys.stdout.flush()
+            save_checkpoint(
+                checkpointfile,
+                dict(state, gtimes_done=counter),
+                {
+                    "ktmp_days_prop_total": ktmp_days_prop_total,
+                    "kmax_days_prop_total": kmax_days_prop_total,
+                    "tempscore": arena["tempscore"][:ntime],
+                    "precscore": arena["precscore"][:ntime],
+                },
+            )
+        counter += 1
+
+    # Combine the temperature and precipitation suitability scores
+    # by taking the minimum, as this will likely be the
+    # constraining factor on any crop growth
+    # The running maximum scores stay in the arena's arrays, the rest of the
+    # work arrays and the running totals aren't needed any more, so are
+    # freed before the scores are combined
+    tcoords = tastime[:ntime]
+    tempscore = xr.DataArray(arena["tempscore"][:ntime], coords=[tcoords, tasy, tasx])
+    precscore = xr.DataArray(arena["precscore"][:ntime], coords=[tcoords, tasy, tasx])
+    del arena, totals
+    with trace_span("combine_scores"):
+        print("Calculating final combined crop suitability score")
+        print("Start: " + str(dt.datetime.now()))
+        sys.stdout.flush()
+        final_score_crop = xr.where(precscore < tempscore, precscore, tempscore)
+        print("End: " + str(dt.datetime.now()))
+
+        print("Calculating average ktmp_ and kmax_days proportions")
+        print("Start: " + str(dt.datetime.now()))
+        sys.stdout.flush()
+        ktmp_days_avg_prop = ktmp_days_prop_total / len(allgtimes)
+        kmax_days_avg_prop = kmax_days_prop_total / len(allgtimes)
+        tcoords_k = tmn["time"][: -allgtimes[-1] + 1]
+        ktmp_days_avg_prop = xr.DataArray(
+            ktmp_days_avg_prop, coords=[tcoords_k, tmx["y"], tmx["x"]]
+        )
+        kmax_days_avg_prop = xr.DataArray(
+            kmax_days_avg_prop, coords=[tcoords_k, tmx["y"], tmx["x"]]
+        )
+        trace_note(
+            score_dtype=str(final_score_crop.dtype),
+            prop_dtype=str(ktmp_days_avg_prop.dtype),
+        )
+        print("End: " + str(dt.datetime.now()))
+
+    return (
+        final_score_crop,
+        tempscore,
+        precscore,
+        ktmp_days_avg_prop,
+        kmax_days_avg_prop,
+    )
+
 
-    print("Processing KTMP")
+# Size (bytes) of the netcdf chunks of the daily outputs aimed for. Each
+# chunk holds the whole grid and as many days as fit, up to a year
+CHUNK_BYTES = 4.0e6
+
+
+def daily_chunks(score, dtype):
+    """
+    Chunk sizes of a daily output of save_scores of dtype, see CHUNK_BYTES
+    """
+    ngrid = score.sizes["y"] * score.sizes["x"]
+    ndays = int(CHUNK_BYTES // (ngrid * np.dtype(dtype).itemsize))
+    return (min(max(ndays, 1), 360), score.sizes["y"], score.sizes["x"])
+
+
+@traced
+def save_scores(
+    savedir,
+    cropname,
+    final_score_crop,
+    tempscore,
+    precscore,
+    ktmp_days_avg_prop,
+    kmax_days_avg_prop,
+):
+    """
+    Write the outputs of score_crop to netcdf files in savedir, with an
+    unlimited time dimension so that append_scores can add days to them
+    """
+    # Save outputs to file
+    print("Saving to netcdf")
     print("Start: " + str(dt.datetime.now()))
     sys.stdout.flush()
-    tempscore = xr.where(ktmp_days > np.uint8(0), np.uint8(0), tscore)
+    # save to netcdf
+    final_score_crop.name = "crop_suitability_score"
+    final_score_crop.encoding["zlib"] = True
+    final_score_crop.encoding["complevel"] = 1
+    final_score_crop.encoding["shuffle"] = False
+    final_score_crop.encoding["contiguous"] = False
+    final_score_crop.encoding["dtype"] = np.dtype("uint8")
+    final_score_crop.encoding["chunksizes"] = daily_chunks(final_score_crop, "uint8")
+    encoding = {}
+    encoding["crop_suitability_score"] = final_score_crop.encoding
+    final_score_crop.to_netcdf(
+        os.path.join(savedir, cropname + ".nc"),
+        encoding=encoding,
+        unlimited_dims=["time"],
+    )
+
+    tempscore.name = "temperature_suitability_score"
+    tempscore.encoding["zlib"] = True
+    tempscore.encoding["complevel"] = 1
+    tempscore.encoding["shuffle"] = False
+    tempscore.encoding["contiguous"] = False
+    tempscore.encoding["dtype"] = np.dtype("uint8")
+    tempscore.encoding["chunksizes"] = daily_chunks(tempscore, "uint8")
+    encoding = {}
+    encoding["temperature_suitability_score"] = tempscore.encoding
+    tempscore.to_netcdf(
+        os.path.join(savedir, cropname + "_temp.nc"),
+        encoding=encoding,
+        unlimited_dims=["time"],
+    )
+
+    precscore.name = "precip_suitability_score"
+    precscore.encoding["zlib"] = True
+    precscore.encoding["complevel"] = 1
+    precscore.encoding["shuffle"] = False
+    precscore.encoding["contiguous"] = False
+    precscore.encoding["dtype"] = np.dtype("uint8")
+    precscore.encoding["chunksizes"] = daily_chunks(precscore, "uint8")
+    encoding = {}
+    encoding["precip_suitability_score"] = precscore.encoding
+    precscore.to_netcdf(
+        os.path.join(savedir, cropname + "_prec.nc"),
+        encoding=encoding,
+        unlimited_dims=["time"],
+    )
+
+    ktmp_days_avg_prop.name = "average_proportion_of_ktmp_days_in_gtime"
+    ktmp_days_avg_prop.encoding["zlib"] = True
+    ktmp_days_avg_prop.encoding["complevel"] = 1
+    ktmp_days_avg_prop.encoding["shuffle"] = False
+    ktmp_days_avg_prop.encoding["contiguous"] = False
+    ktmp_days_avg_prop.encoding["dtype"] = np.dtype("float32")
+    ktmp_days_avg_prop.encoding["chunksizes"] = daily_chunks(
+        ktmp_days_avg_prop, "float32"
+    )
+    encoding = {}
+    encoding["average_proportion_of_ktmp_days_in_gtime"] = ktmp_days_avg_prop.encoding
+    ktmp_days_avg_prop.to_netcdf(
+        os.path.join(savedir, cropname + "_ktmp_days_avg_prop.nc"),
+        encoding=encoding,
+        unlimited_dims=["time"],
+    )
+
+    kmax_days_avg_prop.name = "average_proportion_of_kmax_days_in_gtime"
+    kmax_days_avg_prop.encoding["zlib"] = True
+    kmax_days_avg_prop.encoding["complevel"] = 1
+    kmax_days_avg_prop.encoding["shuffle"] = False
+    kmax_days_avg_prop.encoding["contiguous"] = False
+    kmax_days_avg_prop.encoding["dtype"] = np.dtype("float32")
+    kmax_days_avg_prop.encoding["chunksizes"] = daily_chunks(
+        kmax_days_avg_prop, "float32"
+    )
+    encoding = {}
+    encoding["average_proportion_of_kmax_days_in_gtime"] = kmax_days_avg_prop.encoding
+    kmax_days_avg_prop.to_netcdf(
+        os.path.join(savedir, cropname + "_kmax_days_avg_prop.nc"),
+        encoding=encoding,
+        unlimited_dims=["time"],
+    )
     print("End: " + str(dt.datetime.now()))
 
-    print("Processing KMAX days penalty")
+
+def met_after(met, last):
+    """
+    The driving data from the day after last, which must be within met
+    """
+    nold = int((met["time"] <= last).sum())
+    if nold == 0:
+        raise ValueError(
+            "Driving data starts at "
+            + str(met["time"].values[0])
+            + ", after the existing outputs end at "
+            + str(last)
+        )
+    return met.isel(time=slice(nold, None))
+
+
+@traced
+def precip_carry(pre, last, chunk=360, dtype="float32"):
+    """
+    Running total of the precipitation up to and including last, accumulated
+    in dtype in the same order as running_total does, so that the
+    precipitation totals of the days after last continued from it are
+    identical to those calculated over the whole record. pre is read chunk
+    days at a time.
+    """
+    pre = pre.sel(time=slice(None, last))
+    carry = np.zeros(pre.shape[1:], dtype=dtype)
+    for start in range(0, pre.sizes["time"], chunk):
+        block = pre.isel(time=slice(start, start + chunk)).values
+        carry = np.cumsum(
+            np.concatenate([carry[None, ...], block]), axis=0, dtype=dtype
+        )[-1]
+    return carry
+
+
+def last_output_day(savedir, cropname):
+    """
+    The last day of the existing daily outputs of the crop in savedir
+    """
+    with xr.open_dataarray(os.path.join(savedir, cropname + ".nc")) as score:
+        return score["time"].values[-1]
+
+
+@traced
+def append_scores(savedir, cropname, *scores):
+    """
+    Append the outputs of score_crop for the days after those already written
+    by save_scores in savedir to their files. Only the new days are written,
+    along the files' unlimited time dimension. Files written before the time
+    dimension was unlimited are rewritten once instead, with the new days
+    concatenated to the existing ones on disk, a year at a time.
+    """
+    print("Appending to netcdf")
     print("Start: " + str(dt.datetime.now()))
     sys.stdout.flush()
-    tempscore = tempscore - np.int8(kmax_days)
-    tempscore = xr.where(tempscore < 0, 0, tempscore).astype("uint8")
+    for suffix, score in zip(STAGE_OUTPUTS["scores"], scores):
+        filename = os.path.join(savedir, cropname + suffix + ".nc")
+        with xr.open_dataarray(filename) as old:
+            name = old.name
+            encoding = old.encoding
+            tencoding = old["time"].encoding
+            last = old["time"].values[-1]
+        if score["time"].values[0] <= last:
+            raise ValueError(
+                "The days to append to "
+                + filename
+                + " start at "
+                + str(score["time"].values[0])
+                + ", before it ends at "
+                + str(last)
+            )
+        with netCDF4.Dataset(filename) as nc:
+            unlimited = nc.dimensions["time"].isunlimited()
+        if unlimited:
+            # encode the new days as to_netcdf would have, then write them
+            # after the existing ones
+            data = xr.Variable(
+                score.dims,
+                score.values,
+                encoding={
+                    key: encoding[key]
+                    for key in ["dtype", "_FillValue"]
+                    if key in encoding
+                },
+            )
+            data = xr.conventions.encode_cf_variable(data).values
+            times = xr.Variable(
+                "time",
+                score["time"].values,
+                encoding={
+                    key: tencoding[key] for key in ["units", "calendar", "dtype"]
+                },
+            )
+            times = xr.conventions.encode_cf_variable(times).values
+            with netCDF4.Dataset(filename, "a") as nc:
+                nc.set_auto_maskandscale(False)
+                ntime = nc.dimensions["time"].size
+                nc["time"][ntime : ntime + len(times)] = times
+                nc[name][ntime : ntime + len(times)] = data
+        else:
+            print("Rewriting " + filename + " with an unlimited time dimension")
+            sys.stdout.flush()
+            with xr.open_dataarray(filename, chunks={"time": 360}) as old:
+                score = xr.concat([old, score], "time")
+                score.name = name
+                score.encoding = {
+                    key: encoding[key]
+                    for key in [
+                        "zlib",
+                        "complevel",
+                        "shuffle",
+                        "contiguous",
+                        "chunksizes",
+                        "dtype",
+                    ]
+                    if key in encoding
+                }
+                score["time"].encoding = {
+                    key: tencoding[key] for key in ["units", "calendar", "dtype"]
+                }
+                score.to_netcdf(
+                    filename + ".tmp",
+                    encoding={name: score.encoding},
+                    unlimited_dims=["time"],
+                )
+            os.replace(filename + ".tmp", filename)
     print("End: " + str(dt.datetime.now()))
 
-    # Calculate precipitation suitability score
-    print("Calculating precip suitability score using method " + str(precmethod))
-    print("Start: " + str(dt.datetime.now()))
+
+@traced
+def read_scores(savedir, cropname):
+    """
+    Open the outputs of score_crop written by save_scores. They are opened
+    lazily, so the post-processing only reads them in a year at a time
+    """
+    scores = []
+    for suffix in STAGE_OUTPUTS["scores"]:
+        filename = os.path.join(savedir, cropname + suffix + ".nc")
+        scores.append(xr.open_dataarray(filename))
+    return tuple(scores)
+
+
+# Suffixes of the netcdf outputs of each stage of run_crop
+STAGE_OUTPUTS = {
+    "scores": [
+        "",
+        "_temp",
+        "_prec",
+        "_ktmp_days_avg_prop",
+        "_kmax_days_avg_prop",
+    ],
+    "kprop": [
+        "_ktmpdaysavgprop_decades",
+        "_kmaxdaysavgprop_decades",
+        "_ktmpdaysavgprop_decadal_changes",
+        "_kmaxdaysavgprop_decadal_changes",
+    ],
+    "doy": [
+        "_max_score_doys",
+        "_max_tempscore_doys",
+        "_max_precscore_doys",
+        "_max_score_doys_decades",
+        "_max_tempscore_doys_decades",
+        "_max_precscore_doys_decades",
+        "_max_score_doys_decades_rlength",
+        "_max_tempscore_doys_decades_rlength",
+        "_max_precscore_doys_decades_rlength",
+        "_max_score_doys_decadal_changes",
+        "_max_tempscore_doys_decadal_changes",
+        "_max_precscore_doys_decadal_changes",
+    ],
+    "decadal": [
+        "_years",
+        "_tempscore_years",
+        "_precscore_years",
+        "_decades",
+        "_tempscore_decades",
+        "_precscore_decades",
+        "_decadal_changes",
+        "_tempscore_decadal_changes",
+        "_precscore_decadal_changes",
+    ],
+}
+
+# Size (gridpoints) of the tiles the outputs are checksummed in
+CHECKSUM_TILE = 100
+
+
+def output_files(outdir, cropname):
+    """
+    Paths of the netcdf outputs of the crop in outdir, of all the stages
+    """
+    return [
+        os.path.join(outdir, cropname + suffix + ".nc")
+        for stage in STAGE_OUTPUTS
+        for suffix in STAGE_OUTPUTS[stage]
+    ]
+
+
+def write_output_checksums(outdir, cropname, manifestfile=None, tile=CHECKSUM_TILE):
+    """
+    Write the chunk checksums of those outputs of the crop in outdir that
+    exist to manifestfile, by default <cropname>_checksums.json in outdir,
+    for ecocrop_checksums.py to verify other runs against
+    """
+    if manifestfile is None:
+        manifestfile = os.path.join(outdir, cropname + "_checksums.json")
+    outputs = [
+        output for output in output_files(outdir, cropname) if os.path.exists(output)
+    ]
+    print("Writing checksums of " + str(len(outputs)) + " outputs to " + manifestfile)
     sys.stdout.flush()
-    if precmethod == 1:
-        precscore = score_prec1(precip_crop, PMIN, PMAX, POPMIN, POPMAX)
-    elif precmethod == 2:
-        precscore = score_prec2(precip_crop, PMIN, PMAX, POPMIN, POPMAX)
-    elif precmethod == 3:
-        precscore = score_prec3(precip_crop, PMIN, PMAX, POPMIN, POPMAX)
-    else:
-        raise ValueError(
-            "precmethod must be 1, 2 or 3. Currently set as " + str(precmethod)
+    write_checksum_manifest(manifestfile, outputs, tile)
+    return manifestfile
+
+
+def link_outputs(outdir, source, cropname, suffixes):
+    """
+    Link the outputs of the crop in outdir to those of the source crop, if
+    all of them exist. Returns whether they were linked. Suffixes without
+    an extension are netcdf files.
+    """
+    names = [suffix if "." in suffix else suffix + ".nc" for suffix in suffixes]
+    if not all(os.path.exists(os.path.join(outdir, source + name)) for name in names):
+        return False
+    for name in names:
+        output = os.path.join(outdir, cropname + name)
+        if os.path.lexists(output):
+            os.remove(output)
+        os.symlink(source + name, output)
+    return True
+
+
+def unlink_outputs(outdir, cropname, suffixes):
+    """
+    Remove any of the outputs of the crop in outdir that are links
+    """
+    for suffix in suffixes:
+        name = suffix if "." in suffix else suffix + ".nc"
+        output = os.path.join(outdir, cropname + name)
+        if os.path.islink(output):
+            os.remove(output)
+
+
+def stage_hashes(crop, method, tas, manifest, dtypes=None):
+    """
+    Hash of everything the outputs of each stage of run_crop depend on: the
+    crop parameters, method, precmethod, yearaggmethod and dtypes used, the
+    driving data (manifest, see input_manifest, and its extent) and masks,
+    the outputs of the stages before it and the code of the functions that
+    calculate them.
+    """
+    params = {name: crop[name] for name in SCORE_PARAMS}
+    extent = [str(tas["time"].values[0]), str(tas["time"].values[-1])]
+    extent += list(tas.shape)
+    masks = input_manifest([lcmloc, soil_texture_file(bgsloc)])
+    masking = [crop["SOIL"], masks, crop_mask, apply_mask]
+    hashes = {}
+    hashes["scores"] = content_hash(
+        params,
+        method,
+        precmethod,
+        dtype_policy(dtypes),
+        manifest,
+        extent,
+        score_crop,
+        running_total,
+        window_sums,
+        score_gtime,
+        add_days_prop,
+        piecewise_score,
+        score_temp,
+        score_temp2,
+        score_temp4_pieces,
+        score_prec_pieces,
+        growing_season_lengths,
+    )
+    hashes["kprop"] = content_hash(
+        hashes["scores"], masking, calc_decadal_kprop_changes
+    )
+    hashes["doy"] = content_hash(
+        hashes["scores"], masking, calculate_max_doy, calc_decadal_doy_changes
+    )
+    hashes["decadal"] = content_hash(
+        hashes["scores"],
+        masking,
+        yearaggmethod,
+        calc_decadal_changes,
+        calc_yearly_scores_only,
+    )
+    return hashes
+
+
+@traced
+def run_crop(
+    crop,
+    tas,
+    tmn,
+    tmx,
+    pre,
+    method,
+    savedir,
+    plotdir,
+    buffers=None,
+    checkpointdir=None,
+    resume=False,
+    checkpoint_every=1,
+    append=False,
+    manifest=None,
+    alias_of=None,
+    memo=None,
+    prefix=None,
+    dtypes=None,
+    plot=True,
+):
+    """
+    Calculate the suitability scores of the crop from the driving data and
+    write out all the outputs. buffers is an optional dict of work arrays
+    to reuse between runs on the same grid, see work_buffer.
+
+    With append, the daily outputs already in savedir are extended to the
+    end of the driving data, which can be opened lazily with open_met,
+    instead of being recalculated. Only the days after the last existing
+    output are scored, so only the driving data from that day on (the last
+    GMAX - 1 days of the existing driving data and the new data) is read
+    in, along with the earlier precipitation needed to continue its running
+    total. The new days are written onto the end of the existing daily
+    outputs (see append_scores), and the yearly and decadal outputs are then
+    recalculated from the daily outputs, read back a year at a time, as
+    they are whenever the daily scores are already up to date.
+
+    If checkpointdir is given, a checkpoint is written there every
+    checkpoint_every growing season lengths and after each stage of the
+    post-processing, and removed once the crop is finished. With resume,
+    the run continues from the last checkpoint, if there is one for this
+    crop, savedir and driving data, giving the same outputs as a run that
+    wasn't interrupted.
+
+    If manifest, the input_manifest of the driving data, is given, each
+    stage is skipped if its outputs are already in savedir and were made
+    from the same crop parameters, inputs and code, see stage_hashes.
+
+    alias_of is a crop already run on the same driving data into savedir
+    with the same scoring_key. Its daily scores are linked to instead of
+    being recalculated, and if it also has the same SOIL, so are all its
+    other outputs.
+
+    memo is an optional memo (see memoised) shared between crops run on the
+    same driving data, to reuse the intermediates that only depend on some
+    of the crop parameters. It isn't used with append, as then each crop
+    only reads in the part of the driving data it needs. Neither is prefix,
+    the running totals from open_prefix_sums, which score_crop reads the
+    rolling precipitation and temperature sums from.
+
+    dtypes is the dtype policy (see dtype_policy) of the scoring and the
+    yearly scores. The driving data must already be in its dtypes, see
+    load_met.
+
+    Without plot, the plot of the first decade's scores isn't made, e.g.
+    when benchmarking.
+    """
+    dtypes = dtype_policy(dtypes)
+    SOIL = crop["SOIL"]
+    cropname = crop["cropname"]
+    trace_note(cropname=cropname)
+    allgtimes = growing_season_lengths(crop["GMIN"], crop["GMAX"])
+
+    if not os.path.exists(savedir):
+        os.makedirs(savedir)
+    if not os.path.exists(plotdir):
+        os.makedirs(plotdir)
+
+    checkpointfile = None
+    state, arrays = {}, {}
+    if checkpointdir:
+        if not os.path.exists(checkpointdir):
+            os.makedirs(checkpointdir)
+        checkpointfile = os.path.join(
+            checkpointdir,
+            os.path.basename(os.path.normpath(savedir))
+            + "_"
+            + cropname
+            + "_checkpoint.npz",
         )
-    print("End: " + str(dt.datetime.now()))
+        # everything the partial scores and finished stages depend on, so a
+        # checkpoint isn't resumed after the crop or settings have changed
+        key = {
+            "cropname": cropname,
+            "savedir": os.path.abspath(savedir),
+            "method": method,
+            "shape": list(tas.shape),
+            "dtypes": dtypes,
+            "scoring_key": list(scoring_key(crop)),
+            "SOIL": SOIL,
+            "precmethod": precmethod,
+            "yearaggmethod": yearaggmethod,
+        }
+        if manifest is not None:
+            key["inputs"] = manifest
+        if resume:
+            state, arrays = load_checkpoint(checkpointfile, key)
+        state = dict(key, **state)
+    stages = state.get("stages", [])
 
-    # Always take the highest of the growing season scores as this
-    # is the growing season length the crop will likely grow in
-    print("Updating T & P suitability scores for this gtime")
-    print("Start: " + str(dt.datetime.now()))
-    sys.stdout.flush()
-    if counter == 1:
-        tempscore_old = tempscore
-        precscore_old = precscore
+    hashes = {}
+    cached = {}
+    if manifest is not None:
+        hashes = stage_hashes(crop, method, tas, manifest, dtypes)
+        cachefile = os.path.join(savedir, cropname + "_cache.json")
+        if os.path.exists(cachefile):
+            with open(cachefile) as f:
+                cached = json.load(f)
+        for stage in STAGE_OUTPUTS:
+            outputs = [
+                os.path.join(savedir, cropname + suffix + ".nc")
+                for suffix in STAGE_OUTPUTS[stage]
+            ]
+            if cached.get(stage) == hashes[stage] and all(
+                os.path.exists(output) for output in outputs
+            ):
+                print("Outputs of stage " + stage + " are up to date, skipping it")
+                stages.append(stage)
+            else:
+                # forget the outputs that are about to be overwritten, in
+                # case the run stops part way through writing them
+                cached.pop(stage, None)
+        with open(cachefile, "w") as f:
+            json.dump(cached, f, indent=1)
+        sys.stdout.flush()
+
+    def stage_done(stage):
+        stages.append(stage)
+        if checkpointfile:
+            save_checkpoint(checkpointfile, dict(state, stages=stages))
+        if hashes:
+            cached[stage] = hashes[stage]
+            with open(cachefile, "w") as f:
+                json.dump(cached, f, indent=1)
+
+    if alias_of is not None:
+        source = alias_of["cropname"]
+        if alias_of["SOIL"] == SOIL:
+            shared = list(STAGE_OUTPUTS)
+        else:
+            shared = ["scores"]
+        for stage in shared:
+            if stage not in stages and link_outputs(
+                savedir, source, cropname, STAGE_OUTPUTS[stage]
+            ):
+                print(
+                    "Linked outputs of stage "
+                    + stage
+                    + " to those of "
+                    + source
+                    + ", which has the same scoring parameters"
+                )
+                if stage == "decadal":
+                    link_outputs(plotdir, source, cropname, ["_current_decade.png"])
+                stage_done(stage)
+        sys.stdout.flush()
+
+    # outputs about to be written mustn't write through links to other crops'
+    for stage in STAGE_OUTPUTS:
+        if stage not in stages:
+            unlink_outputs(savedir, cropname, STAGE_OUTPUTS[stage])
+    if "decadal" not in stages:
+        unlink_outputs(plotdir, cropname, ["_current_decade.png"])
+
+    if "scores" in stages:
+        scores = None
+        if not all(stage in stages for stage in STAGE_OUTPUTS):
+            print("Reading scores from " + savedir)
+            sys.stdout.flush()
+            scores = read_scores(savedir, cropname)
     else:
-        if len(tempscore_old["time"]) > len(tempscore["time"]):
-            tempscore_old = tempscore_old.sel(
-                time=slice(tempscore["time"][0], tempscore["time"][-1])
+        carry = None
+        if append:
+            last = last_output_day(savedir, cropname)
+            ndays = met_after(tas, last).sizes["time"] - allgtimes[-1] + 1
+            if ndays < 1:
+                print("No new days to score for " + cropname + " after " + str(last))
+                return
+            print(
+                "Appending "
+                + str(ndays)
+                + " days to the existing outputs for "
+                + cropname
+                + ", which end at "
+                + str(last)
             )
-        if len(precscore_old["time"]) > len(precscore["time"]):
-            precscore_old = precscore_old.sel(
-                time=slice(precscore["time"][0], precscore["time"][-1])
-            )
-        tempscore = xr.where(
-            tempscore > tempscore_old, tempscore, tempscore_old
-        )  # .astype('uint8')
-        precscore = xr.where(
-            precscore > precscore_old, precscore, precscore_old
-        )  # .astype('uint8')
-        tempscore_old = tempscore
-        precscore_old = precscore
+            sys.stdout.flush()
+            carry = precip_carry(pre, last, dtype=dtypes["totals"])
+            tas, tmn, tmx, pre = [
+                met_after(met, last).load() for met in (tas, tmn, tmx, pre)
+            ]
+        scores = score_crop(
+            crop,
+            tas,
+            tmn,
+            tmx,
+            pre,
+            method,
+            buffers,
+            checkpointfile,
+            (state, arrays),
+            checkpoint_every,
+            carry,
+            None if append else memo,
+            None if append else prefix,
+            dtypes,
+        )
+        if memo is not None and not append:
+            print("Reused intermediates:\n" + memo_report(memo))
+        if append:
+            append_scores(savedir, cropname, *scores)
+            # the post-processing needs the whole of the daily scores, which
+            # it reads back a year at a time
+            scores = read_scores(savedir, cropname)
+        else:
+            save_scores(savedir, cropname, *scores)
+        stage_done("scores")
+    if scores is not None:
+        (
+            final_score_crop,
+            tempscore,
+            precscore,
+            ktmp_days_avg_prop,
+            kmax_days_avg_prop,
+        ) = scores
+    del arrays
 
-        print("End: " + str(dt.datetime.now()))
+    if "kprop" not in stages:
+        # calculate and plot monthly climos of ktmp & kmax days avg prop for each decade and their differences
+        print("Calculating monthly climo of ktmp/kmax proportions and decadal changes")
         sys.stdout.flush()
-    counter += 1
-
-# Combine the temperature and precipitation suitability scores
-# by taking the minimum, as this will likely be the
-# constraining factor on any crop growth
-print("Calculating final combined crop suitability score")
-print("Start: " + str(dt.datetime.now()))
-sys.stdout.flush()
-final_score_crop = xr.where(precscore < tempscore, precscore, tempscore)
-print(final_score_crop.dtype)
-print("End: " + str(dt.datetime.now()))
-
-print("Calculating average ktmp_ and kmax_days proportions")
-print("Start: " + str(dt.datetime.now()))
-sys.stdout.flush()
-ktmp_days_avg_prop = ktmp_days_prop_total / len(allgtimes)
-kmax_days_avg_prop = kmax_days_prop_total / len(allgtimes)
-tcoords_k = tmn["time"][: -allgtimes[-1] + 1]
-ktmp_days_avg_prop = xr.DataArray(
-    ktmp_days_avg_prop, coords=[tcoords_k, ycoords_tmx, xcoords_tmx]
-)
-kmax_days_avg_prop = xr.DataArray(
-    kmax_days_avg_prop, coords=[tcoords_k, ycoords_tmx, xcoords_tmx]
-)
-print(ktmp_days_avg_prop)
-print(ktmp_days_avg_prop.dtype)
-print("End: " + str(dt.datetime.now()))
-
-# Save outputs to file
-print("Saving to netcdf")
-print("Start: " + str(dt.datetime.now()))
-sys.stdout.flush()
-# save to netcdf
-final_score_crop.name = "crop_suitability_score"
-final_score_crop.encoding["zlib"] = True
-final_score_crop.encoding["complevel"] = 1
-final_score_crop.encoding["shuffle"] = False
-final_score_crop.encoding["contiguous"] = False
-final_score_crop.encoding["dtype"] = np.dtype("uint8")
-encoding = {}
-encoding["crop_suitability_score"] = final_score_crop.encoding
-final_score_crop.to_netcdf(os.path.join(savedir, cropname + ".nc"), encoding=encoding)
-
-tempscore.name = "temperature_suitability_score"
-tempscore.encoding["zlib"] = True
-tempscore.encoding["complevel"] = 1
-tempscore.encoding["shuffle"] = False
-tempscore.encoding["contiguous"] = False
-tempscore.encoding["dtype"] = np.dtype("uint8")
-encoding = {}
-encoding["temperature_suitability_score"] = tempscore.encoding
-tempscore.to_netcdf(os.path.join(savedir, cropname + "_temp.nc"), encoding=encoding)
-
-precscore.name = "precip_suitability_score"
-precscore.encoding["zlib"] = True
-precscore.encoding["complevel"] = 1
-precscore.encoding["shuffle"] = False
-precscore.encoding["contiguous"] = False
-precscore.encoding["dtype"] = np.dtype("uint8")
-encoding = {}
-encoding["precip_suitability_score"] = precscore.encoding
-precscore.to_netcdf(os.path.join(savedir, cropname + "_prec.nc"), encoding=encoding)
-
-ktmp_days_avg_prop.name = "average_proportion_of_ktmp_days_in_gtime"
-ktmp_days_avg_prop.encoding["zlib"] = True
-ktmp_days_avg_prop.encoding["complevel"] = 1
-ktmp_days_avg_prop.encoding["shuffle"] = False
-ktmp_days_avg_prop.encoding["contiguous"] = False
-ktmp_days_avg_prop.encoding["dtype"] = np.dtype("float32")
-encoding = {}
-encoding["average_proportion_of_ktmp_days_in_gtime"] = ktmp_days_avg_prop.encoding
-ktmp_days_avg_prop.to_netcdf(
-    os.path.join(savedir, cropname + "_ktmp_days_avg_prop.nc"),
-    encoding=encoding,
-)
+        (
+            ktmpap_monavg_climo_diffs,
+            kmaxap_monavg_climo_diffs,
+        ) = calc_decadal_kprop_changes(
+            ktmp_days_avg_prop,
+            kmax_days_avg_prop,
+            str(SOIL),
+            lcmloc,
+            bgsloc,
+            cropname,
+            savedir,
+        )
+        # for month in range(1, 13):
+        #    plot_decadal_changes(kmaxap_monavg_climo_diffs.sel(month=month),
+        #                         save=os.path.join(plotdir, cropname + '_kmaxdaysprop_decadal_change_month' + str(month) + '.png'),
+        #                         revcolbar = 1)
+        # for month in range(1, 13):
+        #    plot_decadal_changes(ktmpap_monavg_climo_diffs.sel(month=month),
+        #                         save=os.path.join(plotdir, cropname + '_ktmpdaysprop_decadal_change_month' + str(month) + '.png'),
+        #                         revcolbar = 1)
+        stage_done("kprop")
 
-kmax_days_avg_prop.name = "average_proportion_of_kmax_days_in_gtime"
-kmax_days_avg_prop.encoding["zlib"] = True
-kmax_days_avg_prop.encoding["complevel"] = 1
-kmax_days_avg_prop.encoding["shuffle"] = False
-kmax_days_avg_prop.encoding["contiguous"] = False
-kmax_days_avg_prop.encoding["dtype"] = np.dtype("float32")
-encoding = {}
-encoding["average_proportion_of_kmax_days_in_gtime"] = kmax_days_avg_prop.encoding
-kmax_days_avg_prop.to_netcdf(
-    os.path.join(savedir, cropname + "_kmax_days_avg_prop.nc"),
-    encoding=encoding,
-)
-print("End: " + str(dt.datetime.now()))
+    if "doy" not in stages:
+        # calculate day of year of maximum score
+        print("Finding days of years of the maximum score")
+        sys.stdout.flush()
+        maxdoys, maxdoys_temp, maxdoys_prec = calculate_max_doy(
+            final_score_crop, tempscore, precscore
+        )
+        print(
+            "Calculating yearly average of this and decadal changes using modulo arithmetic/circular averaging"
+        )
+        sys.stdout.flush()
+        (
+            maxdoys_decadal_changes,
+            maxdoys_temp_decadal_changes,
+            maxdoys_prec_decadal_changes,
+        ) = calc_decadal_doy_changes(
+            maxdoys,
+            maxdoys_temp,
+            maxdoys_prec,
+            str(SOIL),
+            lcmloc,
+            bgsloc,
+            cropname,
+            savedir,
+        )
+        # plot_decadal_changes(maxdoys_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_decadal_changes.png'))
+        # plot_decadal_changes(maxdoys_temp_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_temp_decadal_changes.png'))
+        # plot_decadal_changes(maxdoys_prec_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_prec_decadal_changes.png'))
+        stage_done("doy")
 
+    if "decadal" not in stages:
+        # calculate yearly scores and decadal changes
+        print("Calculating yearly scores and decadal changes")
+        sys.stdout.flush()
+        (
+            allscore_decades,
+            tempscore_decades,
+            precscore_decades,
+            allscore_decadal_changes,
+            tempscore_decadal_changes,
+            precscore_decadal_changes,
+        ) = calc_decadal_changes(
+            tempscore,
+            precscore,
+            str(SOIL),
+            lcmloc,
+            bgsloc,
+            cropname,
+            savedir,
+            yearaggmethod,
+            dtype=dtypes["years"],
+        )
+        # plot_decadal_changes(allscore_decadal_changes, save=os.path.join(plotdir, cropname + '_decadal_changes.png'))
+        # plot_decadal_changes(tempscore_decadal_changes, save=os.path.join(plotdir, cropname + '_tempscore_decadal_changes.png'))
+        # plot_decadal_changes(precscore_decadal_changes, save=os.path.join(plotdir, cropname + '_precscore_decadal_changes.png'))
+        # plot first decade's scores
+        if plot and allscore_decades.sizes["decade"] > 0:
+            plot_decade(
+                allscore_decades[0, :, :],
+                tempscore_decades[0, :, :],
+                precscore_decades[0, :, :],
+                save=os.path.join(plotdir, cropname + "_current_decade.png"),
+            )
+        stage_done("decadal")
 
-# calculate and plot monthly climos of ktmp & kmax days avg prop for each decade and their differences
-print("Calculating monthly climo of ktmp/kmax proportions and decadal changes")
-sys.stdout.flush()
-(
-    ktmpap_monavg_climo_diffs,
-    kmaxap_monavg_climo_diffs,
-) = calc_decadal_kprop_changes(
-    ktmp_days_avg_prop,
-    kmax_days_avg_prop,
-    str(SOIL),
-    lcmloc,
-    bgsloc,
-    cropname,
-    savedir,
-)
-# for month in range(1, 13):
-#    plot_decadal_changes(kmaxap_monavg_climo_diffs.sel(month=month),
-#                         save=os.path.join(plotdir, cropname + '_kmaxdaysprop_decadal_change_month' + str(month) + '.png'),
-#                         revcolbar = 1)
-# for month in range(1, 13):
-#    plot_decadal_changes(ktmpap_monavg_climo_diffs.sel(month=month),
-#                         save=os.path.join(plotdir, cropname + '_ktmpdaysprop_decadal_change_month' + str(month) + '.png'),
-#                         revcolbar = 1)
-
-# calculate day of year of maximum score
-print("Finding days of years of the maximum score")
-sys.stdout.flush()
-maxdoys, maxdoys_temp, maxdoys_prec = calculate_max_doy(
-    final_score_crop, tempscore, precscore
-)
-print(
-    "Calculating yearly average of this and decadal changes using modulo arithmetic/circular averaging"
-)
-sys.stdout.flush()
-(
-    maxdoys_decadal_changes,
-    maxdoys_temp_decadal_changes,
-    maxdoys_prec_decadal_changes,
-) = calc_decadal_doy_changes(
-    maxdoys,
-    maxdoys_temp,
-    maxdoys_prec,
-    str(SOIL),
-    lcmloc,
-    bgsloc,
-    cropname,
-    savedir,
-)
-# plot_decadal_changes(maxdoys_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_decadal_changes.png'))
-# plot_decadal_changes(maxdoys_temp_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_temp_decadal_changes.png'))
-# plot_decadal_changes(maxdoys_prec_decadal_changes, save=os.path.join(plotdir, cropname + '_maxdoys_prec_decadal_changes.png'))
-
-# calculate yearly scores and decadal changes
-print("Calculating yearly scores and decadal changes")
-sys.stdout.flush()
-(
-    allscore_decades,
-    tempscore_decades,
-    precscore_decades,
-    allscore_decadal_changes,
-    tempscore_decadal_changes,
-    precscore_decadal_changes,
-) = calc_decadal_changes(
-    tempscore,
-    precscore,
-    str(SOIL),
-    lcmloc,
-    bgsloc,
-    cropname,
-    savedir,
-    yearaggmethod,
-)
-# plot_decadal_changes(allscore_decadal_changes, save=os.path.join(plotdir, cropname + '_decadal_changes.png'))
-# plot_decadal_changes(tempscore_decadal_changes, save=os.path.join(plotdir, cropname + '_tempscore_decadal_changes.png'))
-# plot_decadal_changes(precscore_decadal_changes, save=os.path.join(plotdir, cropname + '_precscore_decadal_changes.png'))
-# plot first decade's scores
-plot_decade(
-    allscore_decades[0, :, :],
-    tempscore_decades[0, :, :],
-    precscore_decades[0, :, :],
-    save=os.path.join(plotdir, cropname + "_current_decade.png"),
-)
+    if scores is not None:
+        # close the daily scores if they were read back from file
+        for score in scores:
+            score.close()
+
+    if checkpointfile:
+        os.remove(checkpointfile)
+
+
+def plan_crop(crop, shape, method, mem_limit=None, append=False):
+    """
+    Print the predicted peak memory of each stage of running the crop on
+    driving data of size shape (time, y, x), the arrays that dominate it and
+    the predicted runtime. If the peak is over mem_limit (bytes), recommend
+    a tile size or time block length that fits. With append, shape is the
+    size of the driving data read in to append to the crop's existing
+    outputs, see memory_plan.
+    """
+    GB = 1.0e9
+    print("Plan for " + crop["cropname"] + ", driving data size " + str(shape))
+    for stage, peak, arrays in memory_plan(
+        shape, method, crop["GMIN"], crop["GMAX"], append
+    ):
+        print("  " + stage + ": " + "%.3g" % (peak / GB) + "GB")
+        for array, nbytes in sorted(arrays.items(), key=lambda a: -a[1])[:3]:
+            print("    " + array + ": " + "%.3g" % (nbytes / GB) + "GB")
+    resources = estimate_crop_resources(
+        shape, crop["GMIN"], crop["GMAX"], method, precmethod
+    )
+    print(
+        "  Runtime: "
+        + str(round((resources["load_runtime"] + resources["crop_runtime"]) / 3600, 1))
+        + " hours for "
+        + str(resources["ngtimes"])
+        + " growing season lengths"
+    )
+    if mem_limit:
+        blocks = recommend_blocks(
+            shape, crop["GMIN"], crop["GMAX"], method, mem_limit, append
+        )
+        if blocks is None:
+            print("  Fits within " + "%.3g" % (mem_limit / GB) + "GB")
+        else:
+            print(
+                "  Over "
+                + "%.3g" % (mem_limit / GB)
+                + "GB, use tiles of at most "
+                + str(blocks["y"])
+                + " y rows, or time blocks of at most "
+                + str(blocks["time"])
+                + " days"
+            )
+    sys.stdout.flush()
+
+
+def add_trace_args(parser):
+    """
+    Add the options for tracing the run to parser
+    """
+    parser.add_argument(
+        "--trace",
+        help="file to append a JSON line of the timings of each stage to",
+    )
+    parser.add_argument(
+        "--progress-every",
+        type=float,
+        default=60.0,
+        help="seconds between progress lines when tracing",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        choices=["rss", "tracemalloc"],
+        help="also trace the peak and retained memory of each stage",
+    )
+
+
+def begin_trace(args):
+    """
+    Start tracing the run, if asked to by the options from add_trace_args
+    """
+    if args.trace_memory and not args.trace:
+        raise ValueError("--trace-memory needs --trace")
+    if args.trace:
+        start_trace(args.trace, args.progress_every, args.trace_memory)
+
+
+def finish_trace(tracefile):
+    """
+    Stop tracing and print the time spent in each stage, and their memory
+    if it was traced, over all the runs traced to tracefile
+    """
+    stop_trace()
+    print("Time spent in each stage (from " + tracefile + "):")
+    print("\n".join(trace_summary(tracefile)))
+    memory = trace_memory_summary(tracefile)
+    if memory:
+        print("Memory of each stage (from " + tracefile + "):")
+        print("\n".join(memory))
+    sys.stdout.flush()
+
+
+def add_checkpoint_args(parser):
+    """
+    Add the options for checkpointing and resuming runs to parser
+    """
+    parser.add_argument(
+        "--checkpoint-dir",
+        help="folder to write checkpoints to, ideally on fast local storage",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=1,
+        help="number of growing season lengths between checkpoints",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue from the last checkpoint in --checkpoint-dir",
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calculate the EcoCrop suitability scores of a crop for "
+        "one rcp and ensemble member of the CHESS-SCAPE data"
+    )
+    parser.add_argument(
+        "cropind", help="index or name of the crop, or several separated by commas"
+    )
+    parser.add_argument("rcp", help="'85' or '26'")
+    parser.add_argument("ensmem", help="'01', '04', '06' or '15'")
+    parser.add_argument("pf", help="'past' or 'future'")
+    parser.add_argument("method", help="'annual' or 'perennial'")
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="only print the predicted memory and runtime, without reading the data",
+    )
+    parser.add_argument(
+        "--mem-limit", type=float, help="memory limit (GB) to plan tiles for"
+    )
+    add_checkpoint_args(parser)
+    add_trace_args(parser)
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="extend the existing outputs to the end of the driving data",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="skip the stages whose outputs are already up to date",
+    )
+    parser.add_argument(
+        "--memo-mem",
+        type=float,
+        help="memory (GB) for reusing intermediates between crops",
+    )
+    parser.add_argument(
+        "--prefix-dir",
+        help="folder of running totals written by ecocrop_prefix_sums.py",
+    )
+    parser.add_argument(
+        "--dtypes",
+        choices=list(DTYPE_POLICIES),
+        default="balanced",
+        help="dtype policy of the driving data and each stage",
+    )
+    parser.add_argument(
+        "--checksums",
+        action="store_true",
+        help="write checksums of each crop's outputs for verifying other runs",
+    )
+    args = parser.parse_args(argv)
+
+    crops = [load_crop(cropind) for cropind in args.cropind.split(",")]
+    if args.plan:
+        tas = open_met(args.rcp, args.ensmem, args.pf)[0]
+        savedir = scenario_paths(args.rcp, args.ensmem, args.pf)[4]
+        for crop in crops:
+            shape = tas.shape
+            if args.append:
+                # the driving data after the crop's last existing output
+                last = last_output_day(savedir, crop["cropname"])
+                shape = met_after(tas, last).shape
+            mem_limit = args.mem_limit * 1.0e9 if args.mem_limit else None
+            plan_crop(crop, shape, args.method, mem_limit, args.append)
+        return
+
+    begin_trace(args)
+    paths = scenario_paths(args.rcp, args.ensmem, args.pf)
+    savedir, plotdir = paths[4:]
+    manifest = input_manifest(paths[:4]) if args.cache else None
+    if args.append:
+        # each crop reads in only the driving data it needs
+        tas, tmn, tmx, pre = open_met(args.rcp, args.ensmem, args.pf, args.dtypes)
+    else:
+        tas, tmn, tmx, pre = load_met(args.rcp, args.ensmem, args.pf, args.dtypes)
+    buffers = {}
+    memo = new_memo(args.memo_mem * 1.0e9) if args.memo_mem else None
+    prefix = None
+    if args.prefix_dir:
+        prefix = open_prefix_sums(args.prefix_dir, args.rcp, args.ensmem, args.pf)
+    # crops already run, by their scoring_key
+    done = {}
+    for crop in crops:
+        key = scoring_key(crop)
+        alias_of = None
+        for other in done.get(key, []):
+            if alias_of is None or other["SOIL"] == crop["SOIL"]:
+                alias_of = other
+        run_crop(
+            crop,
+            tas,
+            tmn,
+            tmx,
+            pre,
+            args.method,
+            savedir,
+            plotdir,
+            buffers,
+            args.checkpoint_dir,
+            args.resume,
+            args.checkpoint_every,
+            args.append,
+            manifest,
+            alias_of,
+            memo,
+            prefix,
+            args.dtypes,
+        )
+        if args.checksums:
+            write_output_checksums(savedir, crop["cropname"])
+        done.setdefault(key, []).append(crop)
+    if args.trace:
+        finish_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
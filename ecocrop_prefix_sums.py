@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import argparse
+import datetime as dt
+from ecocrop_utils import write_prefix_sums
+from ecocrop_lotus_himem import open_met, prefix_dir, prefix_key
+
+#######################################################
+# Setup
+#######################################################
+"""
+Calculate the running totals (prefix sums) along time of the
+daily precipitation and mean temperature of one rcp and
+ensemble member of the driving data, once, for all the crops
+run on it to share.
+
+The rolling sum over any growing season length can then be
+read off the running totals with one subtraction per day
+(see ecocrop_utils.window_sums), instead of each job
+recalculating the running total for every growing season
+length of every crop. They are written as memory-mappable
+.npy files, accumulated in float32 in the same order as in
+the scoring, so the scores are identical with or without
+them. Each is 4 bytes per gridpoint-day.
+
+Pass the same storedir to ecocrop_lotus_himem.py or
+ecocrop_lotus_ensemble.py with --prefix-dir to use them. They
+are only used if the driving data hasn't changed since they
+were written.
+
+Inputs:
+
+rcp, ensmem, pf: As for ecocrop_lotus_himem.py
+storedir: ----- Folder to write the running totals to, in a
+                subfolder for the rcp and ensemble member
+--chunk: ------ Number of days of the driving data to read
+                at a time. Default 360
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write the running totals of the precipitation and "
+        "temperature of one rcp and ensemble member of the CHESS-SCAPE data"
+    )
+    parser.add_argument("rcp", help="'85' or '26'")
+    parser.add_argument("ensmem", help="'01', '04', '06' or '15'")
+    parser.add_argument("pf", help="'past' or 'future'")
+    parser.add_argument("storedir", help="folder to write the running totals to")
+    parser.add_argument("--chunk", type=int, default=360)
+    args = parser.parse_args(argv)
+
+    outdir = prefix_dir(args.storedir, args.rcp, args.ensmem, args.pf)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    keyfile = os.path.join(outdir, "prefix_sums.json")
+    if os.path.exists(keyfile):
+        os.remove(keyfile)
+
+    tas, tmn, tmx, pre = open_met(args.rcp, args.ensmem, args.pf)
+    for name, data in [("pre", pre), ("tas", tas)]:
+        print("Calculating running total of " + name)
+        print("Start: " + str(dt.datetime.now()))
+        sys.stdout.flush()
+        write_prefix_sums(data, os.path.join(outdir, name + "_prefix.npy"), args.chunk)
+        print("End: " + str(dt.datetime.now()))
+
+    # written last, so the running totals are only used once complete
+    with open(keyfile, "w") as f:
+        json.dump(prefix_key(args.rcp, args.ensmem, args.pf), f, indent=1)
+    print("Written running totals to " + outdir)
+
+
+if __name__ == "__main__":
+    main()
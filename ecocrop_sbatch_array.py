@@ -0,0 +1,368 @@
+import os
+import sys
+import argparse
+import numpy as np
+from ecocrop_utils import estimate_crop_resources, load_crop_store, scoring_groups
+import ecocrop_lotus_himem
+
+#######################################################
+# Setup
+#######################################################
+"""
+Write SLURM array job scripts that run every runnable crop
+in the EcoCrop database for one rcp and ensemble member,
+requesting only the memory and time each crop needs.
+
+The peak memory and runtime of each crop are estimated from
+the size of the driving data, the crop's growing season
+lengths and the precipitation scoring method (precmethod in
+ecocrop_lotus_himem.py, see
+ecocrop_utils.estimate_crop_resources). Crops with the same
+scoring parameters are put in the same job, as only the
+first of them is scored and the others link to its outputs
+(see ecocrop_lotus_himem.py), unless redoing the
+post-processing for each of their soil textures wouldn't fit
+in the time limit, in which case they are split between
+jobs by soil texture. Crops that need similar memory are
+packed together into jobs that run them one after the other
+on the same driving data, up to the time limit, so that the
+data is only read once per job. One array job script is
+written for each memory request, using the high-memory
+partition only for those that don't fit on a standard node.
+Each job activates the conda environment, as in
+ecocrop_lotus_himem_sbatch_template.sbatch.
+
+Inputs:
+
+rcp, ensmem, pf, method: As for ecocrop_lotus_himem.py
+--ecocroploc: - Path to the EcoCrop csv database or crop store.
+                Defaults to ecocroploc in ecocrop_lotus_himem.py
+--shape: ------ time, y, x size of the driving data. Read from
+                the driving data's metadata if not given
+--node-mem: --- Memory of a standard node (GB). Default 256
+--max-mem: ---- Memory of a high-memory node (GB). Default 1000
+--mem-step: --- Memory requests are rounded up to a multiple
+                of this (GB). Default 16
+--time-limit: - Maximum runtime of a job (hours). Default 48
+--safety: ----- Factor to multiply the estimated memory and
+                runtime by. Default 1.25
+--partition: -- Partition for standard nodes.
+                Default short-serial
+--highmem-partition: Partition for high-memory nodes.
+                Default high-mem
+--conda: ------ Path of the anaconda3 folder. Defaults to
+                that of the conda running this script
+--env: -------- Name of the conda environment.
+                Default testecocrop
+--python: ----- Python executable to run the jobs with.
+                Default the environment's python, in case
+                activating it doesn't work
+--outdir: ----- Folder to write the job scripts to.
+                Default current folder
+"""
+
+GB = 1.0e9
+
+
+def conda_root():
+    """
+    anaconda3 folder of the conda running this script, or None if it isn't
+    run from conda
+    """
+    conda = os.environ.get("CONDA_EXE")
+    if conda is None:
+        return None
+    return os.path.dirname(os.path.dirname(conda))
+
+
+def mem_request(memory, safety, step):
+    """
+    Memory to request (GB) for a job with the estimated peak memory (bytes),
+    rounded up to a multiple of step (GB) so that jobs with similar memory
+    needs share an array job.
+    """
+    return int(np.ceil(memory * safety / GB / step) * step)
+
+
+def split_group(group, soils, resources, time_limit, safety):
+    """
+    Split a group of crops with the same scoring parameters into parts that
+    each fit within the time limit, keeping the crops with the same soil
+    texture together. Each part scores its first crop and then redoes the
+    post-processing once for each other soil texture in it.
+
+    Parameters
+    ----------
+    group : list of int
+        cropinds of the group
+    soils : numpy array
+        SOIL of each crop in the crop store
+    resources : dict
+        Estimated resources of scoring one crop of the group, see
+        estimate_crop_resources
+    time_limit : float
+        Maximum runtime of a job (seconds)
+    safety : float
+        Factor to multiply the estimated runtimes by
+
+    Returns
+    -------
+    parts : list of lists of int
+        cropinds of each part, in the order of group if it isn't split
+
+    """
+    bysoil = {}
+    for cropind in group:
+        bysoil.setdefault(soils[cropind], []).append(cropind)
+    runtime = resources["load_runtime"] + resources["crop_runtime"]
+    parts = []
+    nsoils = []
+    for soilcrops in bysoil.values():
+        if (
+            parts
+            and (runtime + nsoils[-1] * resources["post_runtime"]) * safety
+            <= time_limit
+        ):
+            parts[-1].extend(soilcrops)
+            nsoils[-1] += 1
+        else:
+            parts.append(list(soilcrops))
+            nsoils.append(1)
+    if len(parts) == 1:
+        return [list(group)]
+    return parts
+
+
+def pack_crops(crops, time_limit, safety):
+    """
+    Pack crops into jobs, first-fit in order of decreasing memory. Each job
+    runs its crops one after the other on the same driving data, so needs
+    the memory of its largest crop and the runtime of all its crops.
+
+    Parameters
+    ----------
+    crops : list of dicts
+        cropinds, memory request (GB, see mem_request) and the estimated
+        resources (see estimate_crop_resources) of each group of crops with
+        the same scoring parameters, which are kept in the same job
+    time_limit : float
+        Maximum runtime of a job (seconds)
+    safety : float
+        Factor to multiply the estimated runtimes by
+
+    Returns
+    -------
+    jobs : list of dicts
+        mem (GB), cropinds and runtime (seconds, estimated) of each job
+
+    """
+    jobs = []
+    for crop in sorted(crops, key=lambda c: (-c["mem"], -c["crop_runtime"])):
+        for job in jobs:
+            runtime = job["runtime"] + crop["crop_runtime"]
+            if job["mem"] == crop["mem"] and runtime * safety <= time_limit:
+                job["cropinds"].extend(crop["cropinds"])
+                job["runtime"] = runtime
+                break
+        else:
+            jobs.append(
+                {
+                    "mem": crop["mem"],
+                    "cropinds": list(crop["cropinds"]),
+                    "runtime": crop["load_runtime"] + crop["crop_runtime"],
+                }
+            )
+    return jobs
+
+
+def array_script(jobs, partition, args):
+    """
+    SLURM array job script running each of jobs, which share a memory
+    request, as one task of the array. Raises an error if any job needs more
+    than the time limit.
+    """
+    runtime = max(j["runtime"] for j in jobs) * args.safety
+    if runtime > args.time_limit * 3600:
+        raise ValueError(
+            "A job of "
+            + str(jobs[0]["mem"])
+            + "GB needs "
+            + str(round(runtime / 3600, 1))
+            + " hours, more than the time limit of "
+            + str(args.time_limit)
+            + " hours"
+        )
+    minutes = max(60, int(np.ceil(runtime / 60)))
+    lines = [
+        "#!/bin/bash",
+        "#SBATCH -p " + partition,
+        "#SBATCH -o %A_%a.out",
+        "#SBATCH -e %A_%a.err",
+        "#SBATCH --time=" + str(minutes // 60) + ":" + "%02d" % (minutes % 60) + ":00",
+        "#SBATCH --mem=" + str(jobs[0]["mem"]) + "GB",
+        "#SBATCH --array=0-" + str(len(jobs) - 1),
+        "",
+        "# activate anaconda environment",
+        "export PATH=" + os.path.join(args.conda, "bin") + ":$PATH",
+        "source " + os.path.join(args.conda, "bin", "activate") + " " + args.env,
+        "",
+        "# crops run by each task of the array",
+        "CROPS=(",
+    ]
+    lines += ['"' + ",".join(str(c) for c in job["cropinds"]) + '"' for job in jobs]
+    lines += [
+        ")",
+        "",
+        "# use full path to specific environment's python, in case environment",
+        "# activatation doesn't work",
+        " ".join(
+            [
+                args.python,
+                os.path.abspath(ecocrop_lotus_himem.__file__),
+                "${CROPS[$SLURM_ARRAY_TASK_ID]}",
+                args.rcp,
+                args.ensmem,
+                args.pf,
+                args.method,
+            ]
+        ),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write SLURM array job scripts to run all the crops, "
+        "packed into jobs by their estimated memory and runtime"
+    )
+    parser.add_argument("rcp", help="'85' or '26'")
+    parser.add_argument("ensmem", help="'01', '04', '06' or '15'")
+    parser.add_argument("pf", help="'past' or 'future'")
+    parser.add_argument("method", help="'annual' or 'perennial'")
+    parser.add_argument("--ecocroploc", default=ecocrop_lotus_himem.ecocroploc)
+    parser.add_argument("--shape", type=int, nargs=3, metavar=("TIME", "Y", "X"))
+    parser.add_argument("--node-mem", type=float, default=256)
+    parser.add_argument("--max-mem", type=float, default=1000)
+    parser.add_argument("--mem-step", type=float, default=16)
+    parser.add_argument("--time-limit", type=float, default=48)
+    parser.add_argument("--safety", type=float, default=1.25)
+    parser.add_argument("--partition", default="short-serial")
+    parser.add_argument("--highmem-partition", default="high-mem")
+    parser.add_argument("--conda", default=conda_root())
+    parser.add_argument("--env", default="testecocrop")
+    parser.add_argument("--python")
+    parser.add_argument("--outdir", default=".")
+    args = parser.parse_args(argv)
+    if args.conda is None:
+        raise ValueError("Give the path of the anaconda3 folder with --conda")
+    if args.python is None:
+        args.python = os.path.join(args.conda, "envs", args.env, "bin", "python")
+
+    if args.shape:
+        shape = tuple(args.shape)
+    else:
+        tas = ecocrop_lotus_himem.open_met(args.rcp, args.ensmem, args.pf)[0]
+        shape = tas.shape
+    print("Driving data size (time, y, x): " + str(shape))
+    precmethod = ecocrop_lotus_himem.precmethod
+    print("Precipitation scoring method: " + str(precmethod))
+
+    store = load_crop_store(args.ecocroploc)
+    crops = []
+    toobig = []
+    toolong = []
+    groups = scoring_groups(store)
+    for group in groups:
+        cropind = group[0]
+        resources = estimate_crop_resources(
+            shape,
+            store["GMIN"][cropind],
+            store["GMAX"][cropind],
+            args.method,
+            precmethod,
+        )
+        mem = mem_request(
+            resources["met_memory"] + resources["work_memory"],
+            args.safety,
+            args.mem_step,
+        )
+        for part in split_group(
+            group, store["SOIL"], resources, args.time_limit * 3600, args.safety
+        ):
+            crop = dict(resources, cropinds=part, mem=mem)
+            # the rest of the part only redo the masking and post-processing,
+            # once for each other SOIL
+            nsoils = len(set(store["SOIL"][part]))
+            crop["crop_runtime"] += (nsoils - 1) * crop["post_runtime"]
+            if crop["mem"] > args.max_mem:
+                toobig.append(crop)
+            elif (
+                crop["load_runtime"] + crop["crop_runtime"]
+            ) * args.safety > args.time_limit * 3600:
+                toolong.append(crop)
+            else:
+                crops.append(crop)
+
+    print(
+        str(store["runnable"].sum())
+        + " runnable crops, "
+        + str(len(groups))
+        + " with distinct scoring parameters"
+    )
+    jobs = pack_crops(crops, args.time_limit * 3600, args.safety)
+    for mem in sorted(set(job["mem"] for job in jobs)):
+        memjobs = [job for job in jobs if job["mem"] == mem]
+        if mem > args.node_mem:
+            partition = args.highmem_partition
+        else:
+            partition = args.partition
+        outfile = os.path.join(
+            args.outdir,
+            "ecocrop_array_rcp"
+            + args.rcp
+            + "_ens"
+            + args.ensmem
+            + "_"
+            + args.pf
+            + "_"
+            + args.method
+            + "_"
+            + str(mem)
+            + "GB.sbatch",
+        )
+        with open(outfile, "w") as f:
+            f.write(array_script(memjobs, partition, args))
+        print(
+            "Written "
+            + outfile
+            + ": "
+            + str(len(memjobs))
+            + " jobs, "
+            + str(sum(len(job["cropinds"]) for job in memjobs))
+            + " crops, "
+            + str(mem)
+            + "GB on "
+            + partition
+        )
+
+    if toobig:
+        print(
+            str(sum(len(crop["cropinds"]) for crop in toobig))
+            + " crops need more than "
+            + str(args.max_mem)
+            + "GB and were not written, cropinds: "
+            + ",".join(str(c) for crop in toobig for c in crop["cropinds"])
+        )
+    if toolong:
+        print(
+            str(sum(len(crop["cropinds"]) for crop in toolong))
+            + " crops need more than "
+            + str(args.time_limit)
+            + " hours and were not written, cropinds: "
+            + ",".join(str(c) for crop in toolong for c in crop["cropinds"])
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+import os
+import sys
+import argparse
+import datetime as dt
+import numpy as np
+import xarray as xr
+
+#######################################################
+# Setup
+#######################################################
+"""
+Write synthetic driving data shaped like the CHESS-SCAPE data
+(daily tas, tasmin, tasmax and pr on the 1km British National
+Grid, 360-day calendar, one netCDF file per variable per month,
+named and laid out as in testdata), of any grid size and number
+of years, for testing how the code scales without access to the
+CEDA archive.
+
+The data aren't real weather but have the features the scores
+depend on: a seasonal cycle of temperature that is colder to the
+north and varies more to the east, a warming trend, day-to-day
+weather that persists for several days and varies smoothly
+across the grid, a few heat waves and cold spells each year,
+a diurnal temperature range that is larger in summer, and wet
+and dry spells with skewed daily rainfall amounts, wetter in the
+west and in winter. A smooth, random part of the grid (--sea)
+is sea, where all the variables are missing, as in the real
+data. The same --seed gives the same data. lat and lon aren't
+written, as the code doesn't use them.
+
+The files can be read with ecocrop_lotus_himem.load_met or
+open_met with paths=synthetic_paths(outdir, rcp, ensmem).
+
+Inputs:
+
+outdir: ------- Folder to write the files to, in a subfolder
+                for each variable
+--nx, --ny: --- Number of gridpoints in x and y. Default
+                656 x 1057, the full CHESS-SCAPE grid
+--x0, --y0: --- Coordinates (m) of the first gridpoint. Default
+                500, 500, as in CHESS-SCAPE
+--start-year: - First year. Default 2020
+--years: ------ Number of years. Default 1
+--rcp, --ensmem: Used in the file names. Default 85, 01
+--warming: ---- Warming trend (K per century). Default 4
+--sea: -------- Fraction of the grid that is sea. Default 0.25
+--seed: ------- Seed of the random numbers. Default 0
+"""
+
+VARIABLES = {
+    "tas": {
+        "standard_name": "air_temperature",
+        "long_name": "Near-surface air temperature",
+        "units": "K",
+        "cell_methods": "time: mean",
+        "comment": "1.5 m above surface",
+    },
+    "tasmin": {
+        "long_name": "Near-surface daily minimum air temperature",
+        "units": "K",
+        "cell_methods": "time: minimum",
+        "comment": "1.5 m above surface",
+    },
+    "tasmax": {
+        "long_name": "Near-surface daily maximum air temperature",
+        "units": "K",
+        "cell_methods": "time: maximum",
+        "comment": "1.5 m above surface",
+    },
+    "pr": {
+        "standard_name": "precipitation_flux",
+        "long_name": "Precipitation flux",
+        "units": "kg m-2 s-1",
+        "cell_methods": "time: mean",
+    },
+}
+
+CRS_ATTRS = {
+    "grid_mapping_name": "transverse_mercator",
+    "longitude_of_central_meridian": -2.0,
+    "false_easting": 400000.0,
+    "false_northing": -100000.0,
+    "latitude_of_projection_origin": 49.0,
+    "scale_factor_at_projection_origin": 0.9996012717,
+    "longitude_of_prime_meridian": 0.0,
+    "semi_major_axis": 6377563.396,
+    "inverse_flattening": 299.3249646,
+    "projected_crs_name": "OSGB 1936 / British National Grid",
+    "EPSG_code": "EPSG:27700",
+    "unit": "m",
+}
+
+TIME_UNITS = "hours since 1970-01-01T00:00:00Z"
+
+# Climate of the synthetic data. Temperatures in K, lengths in days of the
+# 360-day year, precipitation in kg m-2 s-1 (mm/s)
+CLIMATE = {
+    "tmean": 285.0,  # annual mean temperature at the south of the UK
+    "tmean_north": -5.0,  # change of the annual mean over the length of the UK
+    "tmean_relief": 1.5,  # std of the smooth variation of the annual mean
+    "tamp": 6.5,  # amplitude of the seasonal cycle
+    "tamp_east": 1.5,  # change of the amplitude across the width of the UK
+    "tpeak": 200,  # warmest day of the year
+    "tanom": 2.5,  # std of the day-to-day weather
+    "tanom_persist": 0.8,  # day-to-day correlation of the weather
+    "tlocal": 0.4,  # std of the small scale variation of the weather
+    "dtr": 6.0,  # mean diurnal temperature range
+    "dtr_amp": 2.5,  # amplitude of its seasonal cycle
+    "events": 2,  # heat waves and cold spells per year
+    "event_days": (3, 8),  # range of their lengths
+    "event_size": (6.0, 12.0),  # range of their temperature anomalies
+    "wet": 0.55,  # fraction of wet days
+    "wet_persist": 0.6,  # day-to-day correlation of the wet days
+    "wet_amp": 0.1,  # amplitude of the seasonal cycle of the wet days
+    "prwet": 7.0 / 86400.0,  # mean rainfall on wet days
+    "prwet_west": 0.6,  # relative increase across the width of the UK
+    "prwet_shape": 0.7,  # shape of the gamma distribution of wet day rainfall
+}
+
+# Size (m) of the UK grid, over which the gradients of CLIMATE apply
+UK_SIZE = {"x": 656000.0, "y": 1057000.0}
+
+
+def smooth_field(rng, y, x, scale=150000.0, nwaves=8):
+    """
+    Random field on the grid (y, x) varying smoothly over lengths of about
+    scale (m), with mean 0 and std about 1, as a sum of nwaves waves.
+    """
+    field = np.zeros((y.size, x.size), dtype="float64")
+    for wave in range(nwaves):
+        angle = rng.uniform(0, np.pi)
+        k = 2 * np.pi / (scale * rng.uniform(0.5, 2.0))
+        phase = rng.uniform(0, 2 * np.pi)
+        field += np.cos(
+            k * np.cos(angle) * x[None, :] + k * np.sin(angle) * y[:, None] + phase
+        )
+    return field * np.sqrt(2.0 / nwaves)
+
+
+def static_fields(y, x, sea, rng):
+    """
+    Fields of the grid that don't change with time: the sea mask, the
+    annual mean and seasonal amplitude of the temperature and the mean
+    rainfall on wet days.
+    """
+    yn, xn = np.meshgrid(y / UK_SIZE["y"], x / UK_SIZE["x"], indexing="ij")
+    land = smooth_field(rng, y, x, scale=300000.0)
+    if sea > 0:
+        seamask = land < np.quantile(land, sea)
+    else:
+        seamask = np.zeros(land.shape, dtype="bool")
+    tmean = (
+        CLIMATE["tmean"]
+        + CLIMATE["tmean_north"] * yn
+        + CLIMATE["tmean_relief"] * smooth_field(rng, y, x)
+    )
+    tamp = CLIMATE["tamp"] + CLIMATE["tamp_east"] * (xn - 0.5)
+    prwet = CLIMATE["prwet"] * (
+        1 + CLIMATE["prwet_west"] * (0.5 - xn) + 0.2 * smooth_field(rng, y, x)
+    )
+    return {"sea": seamask, "tmean": tmean, "tamp": tamp, "prwet": prwet}
+
+
+def new_weather(rng):
+    """
+    State of the day-to-day weather, carried from one month to the next:
+    the large scale temperature anomaly and its north-south and east-west
+    gradients, and the same for the wetness.
+    """
+    return {
+        "tanom": rng.normal(0, CLIMATE["tanom"], 3),
+        "wet": rng.normal(0, 1, 3),
+        "events": [],
+    }
+
+
+def ar1(state, persist, std, ndays, rng):
+    """
+    ndays of three AR(1) series with correlation persist and std std,
+    continuing from state, which is updated.
+    """
+    series = np.empty((ndays, 3))
+    innovation = std * np.sqrt(1 - persist**2)
+    for day in range(ndays):
+        state[:] = persist * state + rng.normal(0, innovation, 3)
+        series[day] = state
+    return series
+
+
+def plan_events(year, rng):
+    """
+    Heat waves in the summer and cold spells in the winter of year, as
+    [(first day of the record, length, temperature anomaly)], the days
+    counted from the start of year in the 360-day calendar.
+    """
+    events = []
+    for event in range(CLIMATE["events"]):
+        length = rng.integers(*CLIMATE["event_days"], endpoint=True)
+        size = rng.uniform(*CLIMATE["event_size"])
+        events.append((year * 360 + rng.integers(160, 240), length, size))
+        start = rng.integers(-30, 50) % 360
+        events.append((year * 360 + start, length, -size))
+    return events
+
+
+def month_data(static, weather, year, month, start_year, warming, rng):
+    """
+    The daily tas, tasmin, tasmax and pr of month of year, each a float32
+    numpy array (30, y, x).
+    """
+    shape = static["tmean"].shape
+    ny, nx = shape
+    yn = np.linspace(-1, 1, ny)[None, :, None]
+    xn = np.linspace(-1, 1, nx)[None, None, :]
+    doy = np.arange(30) + (month - 1) * 30
+    days = (year - start_year) * 360 + doy
+    season = np.cos(2 * np.pi * (doy - CLIMATE["tpeak"]) / 360.0)
+
+    # large scale weather, heat waves and cold spells
+    anom = ar1(weather["tanom"], CLIMATE["tanom_persist"], CLIMATE["tanom"], 30, rng)
+    if month == 1:
+        weather["events"] = plan_events(year - start_year, rng)
+    events = np.zeros(30)
+    for first, length, size in weather["events"]:
+        inevent = (days >= first) & (days < first + length)
+        events[inevent] += size
+    tas = (
+        static["tmean"][None, ...]
+        + static["tamp"][None, ...] * season[:, None, None]
+        + warming / 100.0 * (days / 360.0)[:, None, None]
+        + (anom[:, 0] + events)[:, None, None]
+        + 0.5 * anom[:, 1, None, None] * yn
+        + 0.5 * anom[:, 2, None, None] * xn
+        + rng.normal(0, CLIMATE["tlocal"], (30,) + shape)
+    )
+
+    # wet and dry spells, and skewed rainfall on the wet days
+    wet = ar1(weather["wet"], CLIMATE["wet_persist"], 1.0, 30, rng)
+    wetness = (
+        wet[:, 0, None, None]
+        + 0.5 * wet[:, 1, None, None] * yn
+        + 0.5 * wet[:, 2, None, None] * xn
+        + 0.5 * rng.normal(0, 1, (30,) + shape)
+    ) / np.sqrt(1.5)
+    wetfrac = CLIMATE["wet"] - CLIMATE["wet_amp"] * season
+    iswet = wetness > norm_quantile(1 - wetfrac)[:, None, None]
+    shape_ = CLIMATE["prwet_shape"]
+    pr = np.where(
+        iswet,
+        rng.gamma(shape_, 1.0 / shape_, (30,) + shape) * static["prwet"][None, ...],
+        0.0,
+    )
+
+    # bigger diurnal range in the summer and on dry days
+    dtr = (
+        CLIMATE["dtr"]
+        + CLIMATE["dtr_amp"] * season[:, None, None]
+        + np.where(iswet, -1.5, 1.0)
+        + rng.normal(0, 1.0, (30,) + shape)
+    )
+    dtr = np.maximum(dtr, 0.5)
+    tasmin = tas - dtr * rng.uniform(0.4, 0.6, (30,) + shape)
+    tasmax = tasmin + dtr
+
+    data = {"tas": tas, "tasmin": tasmin, "tasmax": tasmax, "pr": pr}
+    for var in data:
+        data[var] = data[var].astype("float32")
+        data[var][:, static["sea"]] = np.nan
+    return data
+
+
+def norm_quantile(p):
+    """
+    Quantile of the standard normal distribution at probability p, using
+    the approximation of Abramowitz and Stegun (26.2.23), good to 5e-4.
+    """
+    p = np.asarray(p, dtype="float64")
+    q = np.where(p < 0.5, p, 1 - p)
+    t = np.sqrt(-2 * np.log(q))
+    z = t - (2.515517 + 0.802853 * t + 0.010328 * t**2) / (
+        1 + 1.432788 * t + 0.189269 * t**2 + 0.001308 * t**3
+    )
+    return np.where(p < 0.5, -z, z)
+
+
+def month_dataset(var, data, y, x, year, month):
+    """
+    Dataset of one variable for one month, with the coordinates, attributes
+    and encoding of the CHESS-SCAPE files.
+    """
+    time = xr.cftime_range(
+        start="%04d-%02d-01 12:00" % (year, month),
+        periods=30,
+        freq="D",
+        calendar="360_day",
+    )
+    bounds = xr.cftime_range(
+        start="%04d-%02d-01" % (year, month), periods=31, freq="D", calendar="360_day"
+    )
+    ds = xr.Dataset(
+        {
+            var: (
+                ("time", "y", "x"),
+                data,
+                dict(VARIABLES[var], grid_mapping="crsOSGB"),
+            ),
+            "time_bnds": (
+                ("time", "bnds"),
+                np.stack([bounds[:-1], bounds[1:]], axis=1),
+            ),
+            "crsOSGB": ((), np.int32(0), CRS_ATTRS),
+        },
+        coords={
+            "time": (
+                "time",
+                time,
+                {
+                    "standard_name": "time",
+                    "long_name": "time in " + TIME_UNITS,
+                    "bounds": "time_bnds",
+                    "axis": "T",
+                },
+            ),
+            "y": (
+                "y",
+                y,
+                {
+                    "standard_name": "projection_y_coordinate",
+                    "long_name": "northing of British National Grid (BNG) "
+                    "coordinate system",
+                    "units": "m",
+                    "axis": "Y",
+                },
+            ),
+            "x": (
+                "x",
+                x,
+                {
+                    "standard_name": "projection_x_coordinate",
+                    "long_name": "easting of British National Grid (BNG) "
+                    "coordinate system",
+                    "units": "m",
+                    "axis": "X",
+                },
+            ),
+        },
+        attrs={
+            "title": "Synthetic CHESS-SCAPE-like driving data, written by "
+            "ecocrop_synthetic_data.py",
+            "Conventions": "CF-1.8",
+        },
+    )
+    encoding = {
+        var: {
+            "dtype": "float32",
+            "_FillValue": np.float32(-1e20),
+            "chunksizes": (1, y.size, x.size),
+        },
+        "time": {
+            "units": TIME_UNITS,
+            "calendar": "360_day",
+            "dtype": "float32",
+            "_FillValue": None,
+        },
+        "time_bnds": {
+            "units": TIME_UNITS,
+            "calendar": "360_day",
+            "_FillValue": None,
+        },
+    }
+    return ds, encoding
+
+
+def month_filename(outdir, var, rcp, ensmem, year, month):
+    """
+    Path of the file of var for month of year, named as in CHESS-SCAPE
+    """
+    return os.path.join(
+        outdir,
+        var,
+        "chess-scape_rcp"
+        + rcp
+        + "_"
+        + ensmem
+        + "_"
+        + var
+        + "_uk_1km_daily_"
+        + "%04d%02d01-%04d%02d30" % (year, month, year, month)
+        + ".nc",
+    )
+
+
+def synthetic_paths(outdir, rcp="85", ensmem="01"):
+    """
+    (taspath, prepath, tmnpath, tmxpath) of the synthetic data in outdir,
+    to pass to open_met or load_met as paths.
+    """
+    return tuple(
+        os.path.join(
+            outdir,
+            var,
+            "chess-scape_rcp"
+            + rcp
+            + "_"
+            + ensmem
+            + "_"
+            + var
+            + "_uk_1km_daily_????????-????????.nc",
+        )
+        for var in ["tas", "pr", "tasmin", "tasmax"]
+    )
+
+
+def write_synthetic_data(
+    outdir,
+    nx=656,
+    ny=1057,
+    x0=500.0,
+    y0=500.0,
+    start_year=2020,
+    years=1,
+    rcp="85",
+    ensmem="01",
+    warming=4.0,
+    sea=0.25,
+    seed=0,
+):
+    """
+    Write the synthetic driving data, one file per variable per month, to
+    subfolders of outdir for each variable. Returns the
+    (taspath, prepath, tmnpath, tmxpath) to pass to open_met or load_met.
+    Only one month is held in memory at a time.
+    """
+    rng = np.random.default_rng(seed)
+    y = y0 + 1000.0 * np.arange(ny)
+    x = x0 + 1000.0 * np.arange(nx)
+    static = static_fields(y, x, sea, rng)
+    weather = new_weather(rng)
+    for var in VARIABLES:
+        if not os.path.exists(os.path.join(outdir, var)):
+            os.makedirs(os.path.join(outdir, var))
+    for year in range(start_year, start_year + years):
+        print("Writing synthetic data for " + str(year))
+        sys.stdout.flush()
+        for month in range(1, 13):
+            data = month_data(static, weather, year, month, start_year, warming, rng)
+            for var in VARIABLES:
+                ds, encoding = month_dataset(var, data[var], y, x, year, month)
+                ds.to_netcdf(
+                    month_filename(outdir, var, rcp, ensmem, year, month),
+                    encoding=encoding,
+                )
+    return synthetic_paths(outdir, rcp, ensmem)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write synthetic driving data shaped like the CHESS-SCAPE data"
+    )
+    parser.add_argument("outdir", help="folder to write the files to")
+    parser.add_argument("--nx", type=int, default=656)
+    parser.add_argument("--ny", type=int, default=1057)
+    parser.add_argument("--x0", type=float, default=500.0)
+    parser.add_argument("--y0", type=float, default=500.0)
+    parser.add_argument("--start-year", type=int, default=2020)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--rcp", default="85")
+    parser.add_argument("--ensmem", default="01")
+    parser.add_argument("--warming", type=float, default=4.0)
+    parser.add_argument("--sea", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print("Start: " + str(dt.datetime.now()))
+    write_synthetic_data(
+        args.outdir,
+        args.nx,
+        args.ny,
+        args.x0,
+        args.y0,
+        args.start_year,
+        args.years,
+        args.rcp,
+        args.ensmem,
+        args.warming,
+        args.sea,
+        args.seed,
+    )
+    print("End: " + str(dt.datetime.now()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
 import os
+import sys
+import glob
+import time
+import functools
+import contextlib
+import tracemalloc
+import threading
+import itertools
+import collections
+import json
+import hashlib
+import inspect
 import xarray as xr
 import numpy as np
+import pandas as pd
+import datetime as dt
 import cartopy as cp
 import matplotlib.pyplot as plt
 
@@ -14,176 +28,2144 @@ def circular_avg(maxdoys, dim):
     - Calculate the cosine of the same year's 'angles' and store it
     - Repeat for all the years in a given average
     - Sum up the sines and cosines separately
-    - Calculate the arctan of these element-wise
+    - Calculate the quadrant-aware arctan (arctan2) of these element-wise
     - Convert back to 'degrees' (i.e. days of year)
     as defined at https://en.wikipedia.org/wiki/Circular_mean
     """
     maxdoys_rad = np.deg2rad(maxdoys)
 
-    maxdoys_sin = np.sin(maxdoys_rad)
-    maxdoys_cos = np.cos(maxdoys_rad)
+    maxdoys_sinsum = np.sin(maxdoys_rad).sum(dim)
+    maxdoys_cossum = np.cos(maxdoys_rad).sum(dim)
 
-    maxdoys_sinsum = maxdoys_sin.sum(dim) / len(maxdoys[dim])
-    maxdoys_cossum = maxdoys_cos.sum(dim) / len(maxdoys[dim])
+    maxdoys_radavg = np.arctan2(maxdoys_sinsum, maxdoys_cossum) % (2 * np.pi)
 
-    maxdoys_radavg = xr.where(
-        xr.ufuncs.logical_and(maxdoys_sinsum > 0, maxdoys_cossum > 0),
-        xr.ufuncs.arctan(maxdoys_sinsum / maxdoys_cossum),
-        xr.where(
-            xr.ufuncs.logical_and(maxdoys_sinsum < 0, maxdoys_cossum > 0),
-            xr.ufuncs.arctan(maxdoys_sinsum / maxdoys_cossum) + (2 * np.pi),
-            xr.where(
-                maxdoys_cossum < 0,
-                xr.ufuncs.arctan(maxdoys_sinsum / maxdoys_cossum) + np.pi,
-                0,
-            ),
-        ),
+    maxdoys_avg = np.rad2deg(maxdoys_radavg)
+
+    return maxdoys_avg
+
+
+def circular_decadal_stats(maxdoys, dim="year", period=10):
+    """
+    Circular mean and mean resultant length of day-of-year data over
+    consecutive blocks (decades by default) of the 'dim' dimension,
+    calculated for all blocks at once by reshaping 'dim' into
+    (block, year-in-block). Any incomplete block at the end is dropped.
+    NaNs (e.g. years with no maximum score) are ignored.
+
+    Inputs
+    ------
+    maxdoys: xarray dataarray with dimensions (dim, y, x) of days of year,
+             treated as angles in degrees on a 0-360 domain
+    dim: The dimension to average over. Its coordinate values are used to
+         label each block by the first value in it
+    period: The number of elements of dim in each block
+
+    Returns
+    -------
+    doy_avg: xarray dataarray with dimensions (decade, y, x)
+        The circular mean day of year of each block, NaN where every year
+        of the block is NaN
+    doy_rlen: xarray dataarray with dimensions (decade, y, x)
+        The mean resultant length of each block, between 0 (days of year
+        spread evenly around the year) and 1 (all on the same day of year)
+    """
+    nyears = maxdoys.sizes[dim]
+    nblocks = nyears // period
+    maxdoys = maxdoys.transpose(dim, ...)
+    vals = maxdoys.values[: nblocks * period].astype("float64")
+    vals = vals.reshape((nblocks, period) + vals.shape[1:])
+    rads = np.deg2rad(vals)
+    valid = ~np.isnan(rads)
+    sinsum = np.nansum(np.sin(rads), axis=1)
+    cossum = np.nansum(np.cos(rads), axis=1)
+    nvalid = valid.sum(axis=1)
+
+    # blocks with no valid years (e.g. masked cells) have no mean
+    radavg = np.where(nvalid > 0, np.arctan2(sinsum, cossum) % (2 * np.pi), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rlen = np.where(nvalid > 0, np.hypot(sinsum, cossum) / nvalid, np.nan)
+
+    blocks = maxdoys[dim].values[: nblocks * period : period]
+    coords = {"decade": blocks}
+    for odim in maxdoys.dims[1:]:
+        coords[odim] = maxdoys[odim]
+    dims = ("decade",) + maxdoys.dims[1:]
+    doy_avg = xr.DataArray(np.rad2deg(radavg), coords=coords, dims=dims)
+    doy_avg.name = maxdoys.name
+    doy_rlen = xr.DataArray(rlen.astype("float32"), coords=coords, dims=dims)
+    doy_rlen.name = "mean_resultant_length"
+
+    return doy_avg, doy_rlen
+
+
+def decadal_means(data, dim="year", period=10):
+    """
+    Average data over consecutive blocks (decades by default) of the 'dim'
+    dimension in a single reduction, by coarsening 'dim' into blocks of
+    length 'period'. Any incomplete block at the end is dropped.
+
+    Inputs
+    ------
+    data: xarray dataarray with dimension dim
+    dim: The dimension to average over. Its coordinate values are used to
+         label each block by the first value in it
+    period: The number of elements of dim in each block
+
+    Returns
+    -------
+    data_decades: xarray dataarray
+        data averaged over each block, with dim replaced by 'decade'
+    """
+    data_decades = data.coarsen(
+        {dim: period}, boundary="trim", coord_func={dim: "min"}
+    ).mean()
+    data_decades = data_decades.rename({dim: "decade"})
+    return data_decades
+
+
+def decadal_changes(decades, baseline="first", refavg=None):
+    """
+    Calculate the differences between each decade and a baseline as a single
+    broadcast subtraction.
+
+    Inputs
+    ------
+    decades: xarray dataarray with a 'decade' dimension, e.g. from
+             decadal_means or circular_decadal_stats
+    baseline: The baseline to difference against. Can be:
+              - 'first': the first decade, which is dropped from the output
+              - a decade label, e.g. 2020: that decade, which is dropped from
+                the output
+              - a (start, end) tuple of decade labels, e.g. (1980, 2000):
+                the average of the decades from start to end inclusive. All
+                decades are kept in the output
+    refavg: Function to average over a reference period with, called as
+            refavg(data, "decade"). The default is the arithmetic mean.
+            Only used when baseline is a (start, end) tuple.
+
+    Returns
+    -------
+    changes: xarray dataarray
+        The grid elementwise differences between each decade and the
+        baseline. Empty if there are no decades, e.g. for a record
+        shorter than a decade
+    """
+    if isinstance(baseline, str) and baseline == "first":
+        if decades.sizes["decade"] == 0:
+            # a record shorter than a decade has no changes either
+            return decades.copy()
+        reference = decades.isel(decade=0)
+        others = decades.isel(decade=slice(1, None))
+    elif isinstance(baseline, (tuple, list)):
+        refdecades = decades.sel(decade=slice(baseline[0], baseline[1]))
+        if refdecades.sizes["decade"] == 0:
+            raise ValueError(
+                "No decades within the baseline period " + str(tuple(baseline))
+            )
+        if refavg is None:
+            reference = refdecades.mean("decade")
+        else:
+            reference = refavg(refdecades, "decade")
+        others = decades
+    else:
+        if baseline not in decades["decade"].values:
+            raise ValueError(
+                "Baseline decade "
+                + str(baseline)
+                + " not in decades "
+                + str(list(decades["decade"].values))
+            )
+        reference = decades.sel(decade=baseline, drop=True)
+        others = decades.drop_sel(decade=baseline)
+
+    changes = others - reference
+    changes.name = decades.name
+    changes.encoding = decades.encoding.copy()
+    return changes
+
+
+def monthly_decadal_climatology(data, period=10):
+    """
+    Calculate the monthly climatology for each decade of one or more daily
+    dataarrays sharing the same time axis, in a single reduction keyed on
+    (decade, month).
+    Each month's daily values are first averaged (one np.add.reduceat over
+    the contiguous runs of days in each month), then the monthly averages are
+    grouped by (decade, month) and averaged (a second reduceat over the
+    months sorted by that key). The grouping is only calculated once and
+    shared between all the dataarrays.
+    Decades are labelled by their first year, counting from the first year
+    in the data. Every month belongs to exactly one decade, so a ragged
+    final decade is averaged over the months it does have; (decade, month)
+    pairs with no data are NaN.
+    The daily values are read a year at a time, so the dataarrays can be
+    opened lazily from file without the whole of them being read in.
+
+    Inputs
+    ------
+    data: list of xarray dataarrays with dimensions (time, y, x)
+    period: The number of years in each 'decade'
+
+    Returns
+    -------
+    climos: list of xarray dataarrays with dimensions (decade, month, y, x),
+            one for each dataarray in data
+    """
+    time = data[0]["time"]
+    years = time.dt.year.values
+    months = time.dt.month.values
+
+    # contiguous runs of days in the same month
+    yearmonths = years * 12 + months - 1
+    mstarts = np.flatnonzero(np.r_[True, yearmonths[1:] != yearmonths[:-1]])
+    mlens = np.diff(np.r_[mstarts, len(yearmonths)])
+
+    # the (decade, month) each run belongs to
+    syear = years[0]
+    rdecs = (years[mstarts] - syear) // period
+    rmonths = months[mstarts] - 1
+    keys = rdecs * 12 + rmonths
+    order = np.argsort(keys, kind="stable")
+    ukeys, kstarts, klens = np.unique(
+        keys[order], return_index=True, return_counts=True
     )
+    ndecs = rdecs[-1] + 1
+    decades = syear + period * np.arange(ndecs)
+
+    # the runs in each year, as the days are read in a year at a time
+    yruns = np.flatnonzero(np.r_[True, years[mstarts][1:] != years[mstarts][:-1]])
+    yruns = np.r_[yruns, len(mstarts)]
+    rbounds = np.r_[mstarts, len(years)]
+
+    climos = []
+    for da in data:
+        da = da.transpose("time", ...)
+        monavg = []
+        for rstart, rend in zip(yruns[:-1], yruns[1:]):
+            yrdata = da.isel(time=slice(rbounds[rstart], rbounds[rend])).values
+            monavg.append(
+                np.add.reduceat(yrdata, mstarts[rstart:rend] - mstarts[rstart], axis=0)
+            )
+        monavg = np.concatenate(monavg)
+        monavg /= mlens.reshape((-1,) + (1,) * (monavg.ndim - 1))
+        decmonavg = np.add.reduceat(monavg[order], kstarts, axis=0)
+        decmonavg /= klens.reshape((-1,) + (1,) * (decmonavg.ndim - 1))
+        climo = np.full(
+            (ndecs * 12,) + decmonavg.shape[1:], np.nan, dtype=decmonavg.dtype
+        )
+        climo[ukeys] = decmonavg
+        climo = climo.reshape((ndecs, 12) + decmonavg.shape[1:])
+
+        coords = {"decade": decades, "month": np.arange(1, 13)}
+        for odim in da.dims[1:]:
+            coords[odim] = da[odim]
+        climo = xr.DataArray(
+            climo, coords=coords, dims=("decade", "month") + da.dims[1:]
+        )
+        climo.name = da.name
+        climos.append(climo)
 
-    maxdoys_avg = np.rad2deg(maxdoys_radavg)
+    return climos
+
+
+# State of the trace of the run (see start_trace). Tracing is off while file
+# is None. Each thread has its own stack of open spans, so reading the next
+# driving data in the background doesn't nest within the scoring
+_TRACE = {
+    "file": None,
+    "stacks": {},
+    "lock": threading.Lock(),
+    "progress": {},
+    "progress_every": 60.0,
+    "memory": None,
+}
+
+
+def start_trace(tracefile, progress_every=60.0, memory=None):
+    """
+    Start tracing the run: each call of a function decorated with traced
+    (or block within trace_span) is then written as one JSON line to
+    tracefile (appended to), with its wall and CPU time, the bytes the
+    process read and wrote during it and anything noted with trace_note,
+    e.g. the gridpoint-days it processed. Progress lines from
+    trace_progress are printed at most every progress_every seconds.
+
+    With memory "rss", each span also records the peak resident memory of
+    the process during it (rss_peak) and how much more is resident at its
+    end than at its start (rss_retained). With memory "tracemalloc", the
+    peak and retained memory allocated by python and numpy within the
+    span are recorded too (traced_peak, traced_retained), which is exact
+    but slows the run down.
+    """
+    if memory not in [None, "rss", "tracemalloc"]:
+        raise ValueError("memory must be None, 'rss' or 'tracemalloc'")
+    stop_trace()
+    _TRACE["file"] = open(tracefile, "a")
+    _TRACE["stacks"] = {}
+    _TRACE["progress"] = {}
+    _TRACE["progress_every"] = progress_every
+    _TRACE["memory"] = memory
+    if memory == "tracemalloc":
+        tracemalloc.start()
+
+
+def stop_trace():
+    """
+    Stop tracing the run, closing the trace file
+    """
+    if _TRACE["file"] is not None:
+        _TRACE["file"].close()
+    if _TRACE["memory"] == "tracemalloc":
+        tracemalloc.stop()
+    _TRACE["file"] = None
+    _TRACE["memory"] = None
+
+
+def process_io():
+    """
+    (bytes read, bytes written) by the process so far, from /proc/self/io,
+    or (None, None) where that isn't available
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counts = dict(line.split(": ") for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None, None
+    return int(counts["rchar"]), int(counts["wchar"])
+
+
+def process_rss():
+    """
+    (resident memory, peak resident memory since it was last reset) of the
+    process in bytes, from /proc/self/status, or (None, None) where that
+    isn't available
+    """
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(
+                line.split(":", 1) for line in f.read().splitlines() if ":" in line
+            )
+        return (
+            int(status["VmRSS"].split()[0]) * 1024,
+            int(status["VmHWM"].split()[0]) * 1024,
+        )
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _reset_peak_memory():
+    """
+    Reset the peak resident memory of the process (and the tracemalloc
+    peak), so the peak of the next span can be measured. Where the peak
+    can't be reset, spans only see the peak since the process started.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    if _TRACE["memory"] == "tracemalloc":
+        tracemalloc.reset_peak()
+
+
+def _fold_peak_memory():
+    """
+    Fold the peak memory since the last reset into that of every open span,
+    as the peak is only measured from the last time it was reset, which may
+    have been at the start of a nested span
+    """
+    peak = process_rss()[1]
+    traced_peak = None
+    if _TRACE["memory"] == "tracemalloc":
+        traced_peak = tracemalloc.get_traced_memory()[1]
+    for stack in _TRACE["stacks"].values():
+        for span in stack:
+            if peak is not None:
+                span["rss_peak"] = max(span.get("rss_peak", 0), peak)
+            if traced_peak is not None:
+                span["_traced_peak"] = max(span["_traced_peak"], traced_peak)
+
+
+@contextlib.contextmanager
+def trace_span(name):
+    """
+    Record the block within it as a span called name of the trace, when
+    tracing is on (see start_trace). Spans nest: each records the names of
+    the spans it was called within. When tracing is off the only cost is
+    one check. The CPU time is that of the whole process, so includes any
+    other threads, as does the memory.
+    """
+    if _TRACE["file"] is None:
+        yield
+        return
+    stack = _TRACE["stacks"].setdefault(threading.get_ident(), [])
+    span = {
+        "span": "/".join([open_span["name"] for open_span in stack] + [name]),
+        "name": name,
+        "depth": len(stack),
+        "start": time.time(),
+    }
+    memory = _TRACE["memory"]
+    if memory is not None:
+        with _TRACE["lock"]:
+            _fold_peak_memory()
+            _reset_peak_memory()
+            rss = process_rss()[0]
+            if memory == "tracemalloc":
+                traced_start = tracemalloc.get_traced_memory()[0]
+                span["_traced_peak"] = traced_start
+    stack.append(span)
+    io = process_io()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        span["wall"] = time.perf_counter() - wall
+        span["cpu"] = time.process_time() - cpu
+        if io[0] is not None:
+            end = process_io()
+            span["bytes_read"] = end[0] - io[0]
+            span["bytes_written"] = end[1] - io[1]
+        if "cells_days" in span and span["wall"] > 0:
+            span["cells_days_per_s"] = span["cells_days"] / span["wall"]
+        with _TRACE["lock"]:
+            if memory is not None and _TRACE["memory"] == memory:
+                _fold_peak_memory()
+                if rss is not None:
+                    span["rss_retained"] = process_rss()[0] - rss
+                if memory == "tracemalloc":
+                    span["traced_peak"] = span.pop("_traced_peak") - traced_start
+                    span["traced_retained"] = (
+                        tracemalloc.get_traced_memory()[0] - traced_start
+                    )
+            span.pop("_traced_peak", None)
+            stack.pop()
+            if _TRACE["file"] is not None:
+                _TRACE["file"].write(json.dumps(span, default=_hashable) + "\n")
+                _TRACE["file"].flush()
+
+
+def traced(func):
+    """
+    Decorator that records each call of func as a span of the trace named
+    after it (see trace_span)
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _TRACE["file"] is None:
+            return func(*args, **kwargs)
+        with trace_span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def trace_note(**fields):
+    """
+    Record fields (e.g. cells_days, the number of gridpoint-days processed,
+    from which the throughput is calculated) in the innermost span of the
+    trace. Does nothing when tracing is off.
+    """
+    stack = _TRACE["stacks"].get(threading.get_ident())
+    if _TRACE["file"] is not None and stack:
+        stack[-1].update(fields)
+
+
+def trace_progress(name, done, total):
+    """
+    Print how far through total steps (e.g. growing season lengths) name
+    is, and the estimated time left, at most every progress_every seconds
+    (see start_trace) and when it finishes. Does nothing when tracing is
+    off.
+    """
+    if _TRACE["file"] is None:
+        return
+    now = time.perf_counter()
+    progress = _TRACE["progress"]
+    if name not in progress or done <= 1:
+        progress[name] = {"start": now, "first": done - 1, "shown": now}
+    state = progress[name]
+    if done < total and now - state["shown"] < _TRACE["progress_every"]:
+        return
+    state["shown"] = now
+    rate = (done - state["first"]) / max(now - state["start"], 1e-9)
+    line = "Progress: " + name + " " + str(done) + "/" + str(total)
+    line += " (" + str(int(100 * done / total)) + "%)"
+    if done < total and rate > 0:
+        eta = dt.timedelta(seconds=int((total - done) / rate))
+        line += ", ETA " + str(eta)
+    print(line)
+    sys.stdout.flush()
+
+
+def trace_summary(tracefile):
+    """
+    Total wall and CPU time, calls and gridpoint-days per second of each
+    span name in tracefile, as lines of a table, slowest first. The times
+    of each span include those of the spans nested within it.
+    """
+    totals = {}
+    with open(tracefile) as f:
+        for line in f:
+            span = json.loads(line)
+            total = totals.setdefault(
+                span["name"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "cells_days": 0}
+            )
+            total["calls"] += 1
+            total["wall"] += span["wall"]
+            total["cpu"] += span["cpu"]
+            total["cells_days"] += span.get("cells_days", 0)
+    lines = [
+        "%-28s %7s %10s %10s %12s"
+        % ("span", "calls", "wall s", "cpu s", "cells*days/s")
+    ]
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall"]):
+        rate = ""
+        if total["cells_days"] and total["wall"] > 0:
+            rate = "%.3g" % (total["cells_days"] / total["wall"])
+        lines.append(
+            "%-28s %7d %10.3f %10.3f %12s"
+            % (name, total["calls"], total["wall"], total["cpu"], rate)
+        )
+    return lines
+
+
+def trace_memory_summary(tracefile):
+    """
+    Largest peak resident memory, and the largest and total memory retained
+    at the end of the calls, of each span name in tracefile traced with
+    memory on (see start_trace), and the same for the memory allocated by
+    python and numpy if it was traced with tracemalloc, as lines of a table
+    in MB, highest peak first. Empty if no spans recorded their memory.
+    """
+    totals = {}
+    with open(tracefile) as f:
+        for line in f:
+            span = json.loads(line)
+            if "rss_peak" not in span and "traced_peak" not in span:
+                continue
+            total = totals.setdefault(
+                span["name"], {"calls": 0, "rss_retained_total": 0}
+            )
+            total["calls"] += 1
+            for field in ["rss_peak", "rss_retained", "traced_peak", "traced_retained"]:
+                value = span.get(field, 0)
+                total[field] = max(total.get(field, value), value)
+            total["rss_retained_total"] += span.get("rss_retained", 0)
+    if not totals:
+        return []
+    lines = [
+        "%-28s %7s %10s %10s %10s %10s %10s"
+        % (
+            "span (MB)",
+            "calls",
+            "peak",
+            "retained",
+            "total ret",
+            "alloc pk",
+            "alloc ret",
+        )
+    ]
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["rss_peak"]):
+        lines.append(
+            "%-28s %7d %10.1f %10.1f %10.1f %10.1f %10.1f"
+            % (
+                name,
+                total["calls"],
+                total["rss_peak"] / 1.0e6,
+                total["rss_retained"] / 1.0e6,
+                total["rss_retained_total"] / 1.0e6,
+                total["traced_peak"] / 1.0e6,
+                total["traced_retained"] / 1.0e6,
+            )
+        )
+    return lines
+
+
+# Masks read from disk, keyed on absolute path, their values aligned to a
+# particular data grid, keyed on (absolute path, grid), and boolean versions
+# of those, keyed on (absolute path, grid) or (absolute path, bits, grid)
+_MASK_RASTERS = {}
+_GRID_VALUES = {}
+_GRID_MASKS = {}
+
+# Name of the soil texture bit-field raster within the soil mask folder, and
+# the texture each bit represents by default. The bits in a given raster are
+# read from its CF flag_masks and flag_meanings attributes, so textures can
+# be added by rebuilding the raster without changing any code.
+SOIL_TEXTURE_FILE = "soil_texture_mask.nc"
+SOIL_TEXTURE_BITS = {"heavy": 1, "medium": 2, "light": 4, "organic": 8}
+
+
+def open_mask(maskfile):
+    """
+    Read a mask raster (geotiff or netcdf) into memory, or return it from the
+    cache if it has already been read.
+
+    Parameters
+    ----------
+    maskfile : string
+        path to the mask file.
+
+    Returns
+    -------
+    mask : xarray dataarray
+        The mask, with dimensions (y, x).
+
+    """
+    maskfile = os.path.abspath(maskfile)
+    if maskfile not in _MASK_RASTERS:
+        if maskfile[-3:] == "tif":
+            mask = xr.open_dataset(maskfile, engine="rasterio")["band_data"]
+            mask = mask.drop_vars("band").squeeze("band")
+        else:
+            mask = xr.open_dataarray(maskfile)
+        _MASK_RASTERS[maskfile] = mask.transpose("y", "x").load()
+    return _MASK_RASTERS[maskfile]
+
+
+def _grid_key(data):
+    """
+    Hashable description of the (y, x) grid of data
+    """
+    x = data["x"].values
+    y = data["y"].values
+    return (len(y), float(y[0]), float(y[-1]), len(x), float(x[0]), float(x[-1]))
+
+
+def _align_axis(maskcoord, datacoord, dim, maskname):
+    """
+    Indices into maskcoord of each of the datacoord values, raising an error
+    if any of them are not within a quarter of a gridbox of a mask gridpoint
+    """
+    if len(datacoord) > 1:
+        tol = 0.25 * np.abs(np.diff(datacoord)).min()
+    else:
+        tol = 0.25 * np.abs(np.diff(maskcoord)).min()
+    inds = maskcoord.get_indexer(datacoord, method="nearest", tolerance=tol)
+    if np.any(inds < 0):
+        raise ValueError(
+            "The "
+            + dim
+            + " coordinates of the mask "
+            + maskname
+            + " do not align with those of the data"
+        )
+    return inds
+
+
+def grid_values(mask, data):
+    """
+    Values of a mask on the (y, x) grid of data, checking that the grids
+    align. When mask is a filename the file is only read once and the result
+    is cached for each (mask, grid) combination.
+
+    Parameters
+    ----------
+    mask : string or xarray dataarray
+        path to the mask file or xarray dataarray of it.
+    data : xarray dataarray or dataset
+        Data with 'x' and 'y' coordinates to align the mask to.
+
+    Returns
+    -------
+    values : numpy array
+        2D (y, x) read-only array of the mask values.
+
+    """
+    key = None
+    if type(mask) == str:
+        key = (os.path.abspath(mask), _grid_key(data))
+        if key in _GRID_VALUES:
+            return _GRID_VALUES[key]
+        maskname = mask
+        mask = open_mask(mask)
+    else:
+        maskname = str(mask.name)
+        mask = mask.transpose("y", "x")
+
+    yinds = _align_axis(mask.indexes["y"], data["y"].values, "y", maskname)
+    xinds = _align_axis(mask.indexes["x"], data["x"].values, "x", maskname)
+    values = mask.values[np.ix_(yinds, xinds)]
+    values.flags.writeable = False
+
+    if key is not None:
+        _GRID_VALUES[key] = values
+    return values
+
+
+def grid_mask(mask, data):
+    """
+    Boolean version of a mask (True where mask > 0) on the (y, x) grid of
+    data, checking that the grids align. When mask is a filename the file is
+    only read once and the result is cached for each (mask, grid)
+    combination, so repeated calls for different products on the same grid
+    cost nothing.
+
+    Parameters
+    ----------
+    mask : string or xarray dataarray
+        path to the mask file or xarray dataarray of it.
+    data : xarray dataarray or dataset
+        Data with 'x' and 'y' coordinates to align the mask to.
+
+    Returns
+    -------
+    boolmask : numpy array, bool
+        2D (y, x) array, True for gridpoints to keep.
+
+    """
+    key = None
+    if type(mask) == str:
+        key = (os.path.abspath(mask), _grid_key(data))
+        if key in _GRID_MASKS:
+            return _GRID_MASKS[key]
+
+    boolmask = grid_values(mask, data) > 0
+    boolmask.flags.writeable = False
+
+    if key is not None:
+        _GRID_MASKS[key] = boolmask
+    return boolmask
+
+
+def apply_mask(boolmask, data):
+    """
+    Set data to 0 where boolmask is False, in place, without copying data.
+    The last two dimensions of data must be (y, x).
+
+    Parameters
+    ----------
+    boolmask : numpy array, bool
+        2D (y, x) array from grid_mask, True for gridpoints to keep.
+    data : xarray dataarray or dataset
+        Data to mask, which is modified.
+
+    Returns
+    -------
+    data : xarray dataarray or dataset
+        The masked data (the same object as was passed in).
+
+    """
+    if isinstance(data, xr.Dataset):
+        for var in data.data_vars.values():
+            apply_mask(boolmask, var)
+        return data
+    if data.dims[-2:] != ("y", "x"):
+        raise ValueError("Last two dimensions of data must be (y, x)")
+    data.load()
+    np.copyto(data.values, 0, where=~boolmask)
+    return data
+
+
+def lcm_mask(lcm, data):
+    """
+    Mask out non-growing regions using a version of the land-
+    cover map. data is masked in place.
+
+    Parameters
+    ----------
+    lcm : string or xarray dataarray
+        path to land cover map file or xarray dataarray of it.
+    data : xarray dataarray or dataset
+        Data to mask.
+
+    Returns
+    -------
+    data_masked : xarray dataarray or dataset
+        Masked version of data
+
+    """
+    return apply_mask(grid_mask(lcm, data), data)
+
+
+def soil_texture_file(maskloc):
+    """
+    Path of the soil texture bit-field raster. maskloc can be the raster
+    itself or the folder containing it.
+    """
+    if os.path.isdir(maskloc):
+        return os.path.join(maskloc, SOIL_TEXTURE_FILE)
+    return maskloc
+
+
+def soil_texture_flags(maskfile):
+    """
+    The bit used for each soil texture in a soil texture bit-field raster,
+    from its CF flag_masks and flag_meanings attributes.
+
+    Parameters
+    ----------
+    maskfile : string
+        path to the soil texture bit-field raster.
+
+    Returns
+    -------
+    flags : dict
+        {texture: bit}
+
+    """
+    mask = open_mask(maskfile)
+    meanings = mask.attrs["flag_meanings"].split()
+    bits = np.atleast_1d(mask.attrs["flag_masks"])
+    return dict(zip(meanings, [int(bit) for bit in bits]))
+
+
+def soil_texture_bits(SOIL, flags=SOIL_TEXTURE_BITS):
+    """
+    Combine the bits of all the soil textures in SOIL, the TEXT column of the
+    ecocrop database, e.g. 'heavy, medium, organic'. Textures without a bit
+    in flags are ignored.
+
+    Parameters
+    ----------
+    SOIL : string
+        Soil texture suitability string from the ecocrop database
+    flags : dict
+        {texture: bit}, e.g. from soil_texture_flags.
+
+    Returns
+    -------
+    bits : int
+        The bitwise OR of the bits of each texture, 0 if none have one.
+
+    """
+    bits = 0
+    for texture in str(SOIL).split(","):
+        bits |= flags.get(texture.strip().lower(), 0)
+    return bits
+
+
+def soil_texture_mask(SOIL, maskfile, data):
+    """
+    Boolean mask of the gridpoints with any of the soil textures in SOIL, on
+    the grid of data, from a single bitwise AND with the soil texture
+    bit-field raster. The raster is only read once and the result is cached
+    for each (raster, textures, grid) combination.
+
+    Parameters
+    ----------
+    SOIL : string
+        Soil texture suitability string from the ecocrop database
+    maskfile : string
+        path to the soil texture bit-field raster.
+    data : xarray dataarray or dataset
+        Data with 'x' and 'y' coordinates to align the mask to.
+
+    Returns
+    -------
+    boolmask : numpy array, bool or None
+        2D (y, x) array, True for gridpoints to keep, or None if SOIL
+        contains none of the textures in the raster.
+
+    """
+    flags = soil_texture_flags(maskfile)
+    bits = soil_texture_bits(SOIL, flags)
+    if bits == 0:
+        return None
+    print(
+        "Doing masking for soil textures "
+        + ", ".join(t for t, b in flags.items() if b & bits)
+    )
+
+    key = (os.path.abspath(maskfile), bits, _grid_key(data))
+    if key not in _GRID_MASKS:
+        boolmask = (grid_values(maskfile, data) & bits) != 0
+        boolmask.flags.writeable = False
+        _GRID_MASKS[key] = boolmask
+    return _GRID_MASKS[key]
+
+
+def soil_type_mask_all(data, SOIL, maskloc):
+    """
+    Mask out the gridpoints that don't have any of the soil textures the
+    crop grows in (SOIL). data is masked in place.
+
+    Parameters
+    ----------
+    data : xarray dataarray or dataset
+        data to be masked.
+    SOIL : string
+        Soil texture suitability string from the ecocrop database,
+        e.g. 'heavy, medium'
+    maskloc : string
+        path to the soil texture bit-field raster, or the folder containing
+        it.
+
+    Returns
+    -------
+    data_masked : xarray dataarray or dataset
+        masked version of data.
+
+    """
+    boolmask = soil_texture_mask(SOIL, soil_texture_file(maskloc), data)
+    if boolmask is not None:
+        data = apply_mask(boolmask, data)
+
+    return data
+
+
+def make_soil_texture_bitfield(texture_masks, flags=SOIL_TEXTURE_BITS):
+    """
+    Combine single-texture masks on the same grid into a soil texture
+    bit-field raster, as read by soil_texture_mask.
+
+    Parameters
+    ----------
+    texture_masks : dict
+        {texture: xarray dataarray}, each with values > 0 where the soil has
+        that texture. Textures must be keys of flags.
+    flags : dict
+        {texture: bit}
+
+    Returns
+    -------
+    bitfield : xarray dataarray, uint8
+        The bit-field raster, with CF flag_masks and flag_meanings attributes
+        for the textures in texture_masks.
+
+    """
+    textures = [t for t in flags if t in texture_masks]
+    template = texture_masks[textures[0]]
+    bitfield = np.zeros(template.shape, dtype="uint8")
+    for texture in textures:
+        bitfield |= np.where(
+            texture_masks[texture].values > 0, flags[texture], 0
+        ).astype("uint8")
+
+    bitfield = xr.DataArray(bitfield, coords=template.coords, dims=template.dims)
+    bitfield.name = "soil_texture"
+    bitfield.attrs["long_name"] = "Soil texture classes present"
+    bitfield.attrs["flag_masks"] = np.array([flags[t] for t in textures], dtype="uint8")
+    bitfield.attrs["flag_meanings"] = " ".join(textures)
+    return bitfield
+
+
+@traced
+def crop_mask(data, SOIL, LCMloc, sgmloc):
+    """
+    Combined land cover and soil type mask for a crop, on the grid of data.
+    The component masks are cached by grid_mask.
+
+    Parameters
+    ----------
+    data : xarray dataarray or dataset
+        Data with 'x' and 'y' coordinates to align the masks to.
+    SOIL : string
+        Soil group suitability string from the ecocrop database
+    LCMloc : string
+        Land cover mask. Path to tif
+    sgmloc : string
+        Soil texture bit-field raster, or the folder containing it
+
+    Returns
+    -------
+    boolmask : numpy array, bool
+        2D (y, x) array, True for gridpoints to keep.
+
+    """
+    boolmask = grid_mask(LCMloc, data)
+    soilmask = soil_texture_mask(SOIL, soil_texture_file(sgmloc), data)
+    if soilmask is not None:
+        boolmask = boolmask & soilmask
+    return boolmask
+
+
+# Parameters that must be present in the ecocrop database to run a crop
+CROP_PARAMS = [
+    "TOPMN",
+    "TOPMX",
+    "TMIN",
+    "TMAX",
+    "RMIN",
+    "RMAX",
+    "ROPMN",
+    "ROPMX",
+    "GMIN",
+    "GMAX",
+]
+# Killing temperature (degC) assumed for crops without a KTMPR
+KTMP_DEFAULT = -1.0
+# Crop parameters (as converted by crop_param_arrays) the daily scores
+# depend on. TEXT (SOIL) is only used for masking the yearly and decadal
+# scores
+SCORE_PARAMS = [
+    "TOPMIN",
+    "TOPMAX",
+    "TMIN",
+    "TMAX",
+    "PMIN",
+    "PMAX",
+    "POPMIN",
+    "POPMAX",
+    "KTMP",
+    "KMAX",
+    "GMIN",
+    "GMAX",
+]
+
+
+def crop_name(testcrop):
+    """
+    Filename-safe name for a crop, from the first of its common names
+    (COMNAME) or, if it has none, its scientific name.
+
+    Parameters
+    ----------
+    testcrop : pandas series
+        Row of the ecocrop database
+
+    Returns
+    -------
+    cropname : string
+
+    """
+    COMNAME = testcrop["COMNAME"]
+    if isinstance(COMNAME, str):
+        cropname = "_".join(COMNAME.split(",")[0].split(" "))
+        for char in "()'":
+            cropname = cropname.replace(char, "")
+    else:
+        cropname = "_".join(testcrop["ScientificName"].split(" "))
+        cropname = cropname.replace(".", "")
+    return cropname
+
+
+def growing_season_lengths(GMIN, GMAX):
+    """
+    The growing season lengths to calculate the suitability for, in
+    intervals of 10 days between GMIN and GMAX to reduce computational cost.
+
+    Parameters
+    ----------
+    GMIN : int
+        Minimum length of the growing season (days)
+    GMAX : int
+        Maximum length of the growing season (days)
+
+    Returns
+    -------
+    allgtimes : list of int16
+
+    """
+    if GMAX - GMIN <= 15:
+        gstart = np.int16(np.floor(GMIN / 10) * 10)
+    else:
+        gstart = np.int16(np.ceil(GMIN / 10) * 10)
+    gend = np.int16(np.ceil(GMAX / 10) * 10)
+    return list(np.arange(gstart, gend, 10, dtype="int16"))
+
+
+# dtypes each stage of a crop run works in, see dtype_policy:
+# temperature, precipitation: the driving data (tas, tasmin and tasmax, and
+#     pr) as read in
+# topt: the daily temperature suitability of the annual method (score_temp2)
+# totals: the running totals and rolling sums of the topt days, temperature
+#     and precipitation, and the work arrays of the scoring
+# counts: the running totals and rolling sums of the ktmp and kmax days
+# proportions: the ktmp_ and kmax_days proportion totals and averages
+# years: the yearly scores before they are saved as uint8
+# "balanced" is what the scores have always been calculated with,
+# "reference" does everything in float64 (or uint32) and "low-memory" also
+# reads the precipitation and keeps the proportions in float16. Use
+# ecocrop_dtype_report.py to compare them.
+DTYPE_POLICIES = {
+    "reference": {
+        "temperature": "float64",
+        "precipitation": "float64",
+        "topt": "float64",
+        "totals": "float64",
+        "counts": "uint32",
+        "proportions": "float64",
+        "years": "float64",
+    },
+    "balanced": {
+        "temperature": "float16",
+        "precipitation": "float32",
+        "topt": "float16",
+        "totals": "float32",
+        "counts": "uint16",
+        "proportions": "float32",
+        "years": "float64",
+    },
+    "low-memory": {
+        "temperature": "float16",
+        "precipitation": "float16",
+        "topt": "float16",
+        "totals": "float32",
+        "counts": "uint16",
+        "proportions": "float16",
+        "years": "float32",
+    },
+}
+DEFAULT_DTYPE_POLICY = "balanced"
+
+
+def dtype_policy(policy=None):
+    """
+    dtypes of each stage of a crop run (see DTYPE_POLICIES).
+
+    Parameters
+    ----------
+    policy : string, dict or None
+        Name of one of DTYPE_POLICIES, or a dict of the dtypes of some of
+        the stages, the others taken from the default policy. The default
+        policy if None.
+
+    Returns
+    -------
+    dtypes : dict
+        {stage: dtype name} for every stage
+
+    """
+    dtypes = dict(DTYPE_POLICIES[DEFAULT_DTYPE_POLICY])
+    if policy is None:
+        return dtypes
+    if isinstance(policy, str):
+        if policy not in DTYPE_POLICIES:
+            raise ValueError(
+                "dtype policy must be one of "
+                + ", ".join(DTYPE_POLICIES)
+                + ". Currently set as "
+                + policy
+            )
+        policy = DTYPE_POLICIES[policy]
+    unknown = set(policy) - set(dtypes)
+    if unknown:
+        raise ValueError(
+            "Unknown stages in dtype policy: " + ", ".join(sorted(unknown))
+        )
+    dtypes.update({stage: np.dtype(dtype).name for stage, dtype in policy.items()})
+    return dtypes
+
+
+# Memory (bytes) per gridpoint per day of driving data of the driving data
+# itself (tas, tasmin and tasmax as float16, pr as float32), and the fixed
+# memory of the python environment, masks and plotting.
+MET_BYTES = 10.0
+BASE_BYTES = 0.5e9
+# Peak memory (bytes per gridpoint per day of driving data) of each stage of
+# a crop run on top of the driving data, split into the arrays that dominate
+# it. The totals were measured with tracemalloc for the annual method, the
+# perennial method totals the temperature instead of the days within the
+# crop temperature range, which takes the same memory. The gtime work arrays
+# (apart from the T and P scores) and the running totals are freed before
+# the scores are combined, unless the running totals are kept in a memo
+# shared between crops, which still peaks in the gtime loop.
+MEMORY_STAGES = {
+    "running totals of topt, ktmp and kmax days and precipitation": {
+        "topt and precipitation running totals (float32)": 8.0,
+        "ktmp and kmax running totals (uint16)": 4.0,
+    },
+    "gtime loop": {
+        "topt and precipitation running totals (float32)": 8.0,
+        "ktmp and kmax running totals (uint16)": 4.0,
+        "ktmp/kmax_days_prop_total (float32)": 8.0,
+        "gtime work arrays (see gtime_arena)": 18.0,
+        "other": 0.5,
+    },
+    "combining and saving scores": {
+        "ktmp/kmax_days_prop_total (float32)": 8.0,
+        "ktmp/kmax_days_avg_prop (float32)": 8.0,
+        "final, T and P scores (uint8)": 3.0,
+        "other": 1.0,
+    },
+    "post-processing": {
+        "ktmp/kmax_days_prop_total (float32)": 8.0,
+        "ktmp/kmax_days_avg_prop (float32)": 8.0,
+        "final, T and P scores (uint8)": 3.0,
+        "masking and yearly/decadal aggregation": 2.0,
+    },
+}
+# Memory (bytes) per gridpoint of the arrays of each stage whose size doesn't
+# depend on the length of the driving data: the temporaries of each chunk of
+# 360 days the running totals are calculated in (see running_total), and
+# the proportions of the ktmp_ and kmax_days of 64 days at a time (see
+# gtime_arena)
+MEMORY_STAGE_GRID = {
+    "running totals of topt, ktmp and kmax days and precipitation": {
+        "temporaries of each chunk of days": 3600.0,
+    },
+    "gtime loop": {
+        "ktmp/kmax_days proportions of each chunk of days (float64)": 512.0,
+    },
+}
+# Memory (bytes) per gridpoint of the stages that take the place of those of
+# MEMORY_STAGES when appending new days to existing daily outputs (see
+# run_crop). The post-processing then reads the daily outputs back from file
+# a year (360 days) at a time, instead of holding all of them: the float32
+# proportions of the ktmp_ and kmax_days of a year, as read and decoded
+MEMORY_APPEND_GRID = {
+    "post-processing": {
+        "a year of the daily outputs, read back from file": 3600.0,
+    },
+}
+# Arrays of MEMORY_STAGES that only cover the starting days of the shortest
+# ("GMIN") or longest ("GMAX") growing season length, rather than every day
+# of the driving data
+MEMORY_ARRAY_DAYS = {
+    "gtime work arrays (see gtime_arena)": "GMIN",
+    "final, T and P scores (uint8)": "GMIN",
+    "ktmp/kmax_days_prop_total (float32)": "GMAX",
+    "ktmp/kmax_days_avg_prop (float32)": "GMAX",
+}
+# Spans of the trace (see trace_span) that make up each stage of
+# MEMORY_STAGES, for measuring their peak memory
+MEMORY_STAGE_SPANS = {
+    "running totals of topt, ktmp and kmax days and precipitation": [
+        "topt_total",
+        "tas_total",
+        "ktmp_total",
+        "kmax_total",
+        "precip_total",
+    ],
+    "gtime loop": ["score_gtime"],
+    "combining and saving scores": ["combine_scores", "save_scores", "append_scores"],
+    "post-processing": [
+        "read_scores",
+        "calc_decadal_kprop_changes",
+        "calculate_max_doy",
+        "calc_decadal_doy_changes",
+        "calc_decadal_changes",
+    ],
+}
+# Runtime (seconds) per gridpoint per day of driving data: reading it in,
+# each growing season length, and the post-processing and writing of the
+# outputs. Measured on a single core, except for reading the data which
+# depends on the filesystem and assumes ~200MB/s.
+LOAD_SECONDS = 5.0e-8
+GTIME_SECONDS = 3.0e-8
+POST_SECONDS = 3.0e-7
+# Runtime of each growing season length with each precipitation scoring
+# method, relative to GTIME_SECONDS (measured with precmethod 2). It grows
+# with the number of pieces of the precipitation score, see
+# score_prec_pieces.
+PRECMETHOD_GTIME_FACTOR = {1: 1.05, 2: 1.0, 3: 1.2}
+
+
+def memory_plan(shape, method, GMIN=None, GMAX=None, append=False):
+    """
+    Predicted peak memory of each stage of running a crop on driving data of
+    a given size, and the arrays that dominate it.
+
+    Parameters
+    ----------
+    shape : tuple
+        (time, y, x) size of the driving data
+    method : string
+        Temperature scoring method, 'annual' or 'perennial'
+    GMIN : int, optional
+        Minimum length of the growing season (days)
+    GMAX : int, optional
+        Maximum length of the growing season (days). The arrays that only
+        cover the starting days of the growing seasons (see
+        MEMORY_ARRAY_DAYS) are taken to cover every day if GMIN and GMAX
+        aren't given
+    append : bool, optional
+        Whether the run appends new days to existing daily outputs (see
+        run_crop), in which case shape is the size of the driving data read
+        in to score the new days, and the stages of MEMORY_APPEND_GRID don't
+        depend on the length of the existing outputs
+
+    Returns
+    -------
+    plan : list of tuples
+        (stage, peak memory, {array: memory}) for each stage, in bytes,
+        including the driving data and the python environment.
+
+    """
+    ncells = float(np.prod(shape))
+    ngrid = float(np.prod(shape[1:]))
+    days = {"all": shape[0], "GMIN": shape[0], "GMAX": shape[0]}
+    if GMIN is not None and GMAX is not None:
+        allgtimes = growing_season_lengths(GMIN, GMAX)
+        days["GMIN"] = max(0, shape[0] - int(allgtimes[0]) + 1)
+        days["GMAX"] = max(0, shape[0] - int(allgtimes[-1]) + 1)
+    plan = []
+    for stage, arrays in MEMORY_STAGES.items():
+        grid = MEMORY_STAGE_GRID.get(stage, {})
+        if append and stage in MEMORY_APPEND_GRID:
+            arrays, grid = {}, MEMORY_APPEND_GRID[stage]
+        arrays = {
+            array: ngrid * days[MEMORY_ARRAY_DAYS.get(array, "all")] * nbytes
+            for array, nbytes in arrays.items()
+        }
+        if method == "perennial":
+            arrays = {
+                array.replace("topt and", "temperature and"): memory
+                for array, memory in arrays.items()
+            }
+        for array, nbytes in grid.items():
+            arrays[array] = ngrid * nbytes
+        arrays["driving data"] = ncells * MET_BYTES
+        arrays["python environment and masks"] = BASE_BYTES
+        plan.append((stage, sum(arrays.values()), arrays))
+    return plan
+
+
+def measured_memory_plan(tracefile, start):
+    """
+    Measured peak memory of each stage of MEMORY_STAGES of a crop run traced
+    with memory "rss" (see start_trace), on top of the resident memory
+    before the run, to compare with memory_plan.
+
+    Parameters
+    ----------
+    tracefile : string
+        Trace of the run
+    start : int
+        Resident memory of the process before the run, with the driving data
+        read in (bytes), see process_rss
+
+    Returns
+    -------
+    growth : dict
+        {stage: peak memory - start} in bytes, for each stage of
+        MEMORY_STAGES with spans in the trace
+
+    """
+    stages = {
+        name: stage for stage, names in MEMORY_STAGE_SPANS.items() for name in names
+    }
+    growth = {}
+    with open(tracefile) as f:
+        for line in f:
+            span = json.loads(line)
+            stage = stages.get(span["name"])
+            if stage is None or "rss_peak" not in span:
+                continue
+            growth[stage] = max(growth.get(stage, 0), span["rss_peak"] - start)
+    return growth
+
+
+def recommend_blocks(shape, GMIN, GMAX, method, mem_limit, append=False):
+    """
+    Largest spatial tile and time block of the driving data that could be
+    run within a memory limit. Memory is proportional to the number of
+    gridpoints, so tiles can split the y dimension. Time blocks must overlap
+    by the longest growing season length and can only be used for the
+    daily scores, not the decadal post-processing, which needs the whole
+    time series.
+
+    Parameters
+    ----------
+    shape : tuple
+        (time, y, x) size of the driving data
+    GMIN : int
+        Minimum length of the growing season (days)
+    GMAX : int
+        Maximum length of the growing season (days)
+    method : string
+        Temperature scoring method, 'annual' or 'perennial'
+    mem_limit : float
+        Memory limit (bytes)
+    append : bool, optional
+        Whether the run appends to existing daily outputs, see memory_plan
+
+    Returns
+    -------
+    blocks : dict or None
+        {"y": number of y rows per tile, "time": number of days per block,
+        excluding the overlap}, 0 if no tile/block fits. None if the whole
+        domain fits within mem_limit.
+
+    """
+    peak = max(stage[1] for stage in memory_plan(shape, method, GMIN, GMAX, append))
+    if peak <= mem_limit:
+        return None
+    fraction = max(0.0, (mem_limit - BASE_BYTES) / (peak - BASE_BYTES))
+    overlap = int(growing_season_lengths(GMIN, GMAX)[-1])
+    return {
+        "y": int(np.floor(shape[1] * fraction)),
+        "time": max(0, int(np.floor(shape[0] * fraction)) - overlap),
+    }
+
+
+def estimate_crop_resources(shape, GMIN, GMAX, method, precmethod=2):
+    """
+    Estimate the peak memory and the runtime of running a crop, from the size
+    of the driving data, the crop's growing season lengths and the
+    precipitation scoring method.
+
+    Parameters
+    ----------
+    shape : tuple
+        (time, y, x) size of the driving data
+    GMIN : int
+        Minimum length of the growing season (days)
+    GMAX : int
+        Maximum length of the growing season (days)
+    method : string
+        Temperature scoring method, 'annual' or 'perennial'
+    precmethod : int
+        Precipitation scoring method, 1, 2 or 3
+
+    Returns
+    -------
+    resources : dict
+        met_memory: memory of the driving data and the python environment,
+        shared by all the crops run on the same data (bytes), work_memory:
+        peak memory on top of that while running the crop (bytes),
+        load_runtime: time to read the driving data (seconds), crop_runtime:
+        time to run the crop once the data is read (seconds), post_runtime:
+        the part of crop_runtime after the daily scores are calculated
+        (seconds), and ngtimes.
+
+    """
+    ncells = float(np.prod(shape))
+    ngtimes = len(growing_season_lengths(GMIN, GMAX))
+    if precmethod not in PRECMETHOD_GTIME_FACTOR:
+        raise ValueError(
+            "precmethod must be 1, 2 or 3. Currently set as " + str(precmethod)
+        )
+    gtime_seconds = GTIME_SECONDS * PRECMETHOD_GTIME_FACTOR[precmethod]
+    met_memory = BASE_BYTES + ncells * MET_BYTES
+    peak = max(stage[1] for stage in memory_plan(shape, method, GMIN, GMAX))
+    return {
+        "met_memory": met_memory,
+        "work_memory": peak - met_memory,
+        "load_runtime": ncells * LOAD_SECONDS,
+        "crop_runtime": ncells * (POST_SECONDS + ngtimes * gtime_seconds),
+        "post_runtime": ncells * POST_SECONDS,
+        "ngtimes": ngtimes,
+    }
+
+
+def work_buffer(buffers, name, shape, dtype):
+    """
+    Zeroed work array, reused between runs on the same grid (e.g. for
+    different crops or ensemble members) instead of being reallocated.
+
+    Parameters
+    ----------
+    buffers : dict or None
+        {name: numpy array} of the work arrays kept between runs. A new
+        array is allocated (and not kept) if None.
+    name : string
+        Name of the work array
+    shape : tuple
+    dtype : string or numpy dtype
+
+    Returns
+    -------
+    buffer : numpy array
+        Array of shape and dtype, filled with zeros. Only valid until the
+        next call for the same name.
+
+    """
+    if buffers is None:
+        return np.zeros(shape, dtype=dtype)
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+        buffer = np.zeros(shape, dtype=dtype)
+        buffers[name] = buffer
+    else:
+        buffer[...] = 0
+    return buffer
+
+
+def new_memo(max_bytes):
+    """
+    Empty memo (see memoised) holding at most max_bytes of arrays.
+    """
+    return {
+        "max_bytes": max_bytes,
+        "nbytes": 0,
+        "items": collections.OrderedDict(),
+        "hits": collections.Counter(),
+        "misses": collections.Counter(),
+    }
+
+
+def memoised(memo, key, compute):
+    """
+    Intermediate array for key, calculated by compute() the first time it
+    is asked for and then reused, e.g. by other crops run on the same
+    driving data. The least recently used arrays are dropped to keep the
+    memo within its max_bytes.
+
+    Parameters
+    ----------
+    memo : dict or None
+        Memo from new_memo. compute() is always called if None. Must only
+        be used with one set of driving data.
+    key : tuple
+        Everything the array depends on apart from the driving data. The
+        first element names the kind of array, for memo_report, and the
+        span of the trace it is calculated in (see trace_span).
+    compute : function
+        Calculates the array
+
+    Returns
+    -------
+    value : numpy array
+        Read-only if it is kept in the memo
+
+    """
+    if memo is None:
+        with trace_span(key[0]):
+            return compute()
+    items = memo["items"]
+    if key in items:
+        items.move_to_end(key)
+        memo["hits"][key[0]] += 1
+        return items[key]
+    memo["misses"][key[0]] += 1
+    with trace_span(key[0]):
+        value = compute()
+    if value.nbytes <= memo["max_bytes"]:
+        while memo["nbytes"] + value.nbytes > memo["max_bytes"]:
+            memo["nbytes"] -= items.popitem(last=False)[1].nbytes
+        value.flags.writeable = False
+        items[key] = value
+        memo["nbytes"] += value.nbytes
+    return value
+
+
+def memo_report(memo):
+    """
+    Hits, misses and hit rate of each kind of array in memo, and the memory
+    it holds.
+    """
+    lines = []
+    for kind in sorted(set(memo["hits"]) | set(memo["misses"])):
+        hits = memo["hits"][kind]
+        total = hits + memo["misses"][kind]
+        lines.append(
+            kind
+            + ": "
+            + str(hits)
+            + " of "
+            + str(total)
+            + " reused ("
+            + str(round(100.0 * hits / total))
+            + "%)"
+        )
+    lines.append(
+        "holding "
+        + "%.3g" % (memo["nbytes"] / 1.0e9)
+        + " of "
+        + "%.3g" % (memo["max_bytes"] / 1.0e9)
+        + "GB in "
+        + str(len(memo["items"]))
+        + " arrays"
+    )
+    return "\n".join(lines)
+
+
+def save_checkpoint(checkpointfile, state, arrays=None):
+    """
+    Write a checkpoint of a run, replacing any previous one. The file is
+    written under a temporary name and then renamed, so a job killed while
+    writing it leaves the previous checkpoint intact.
+
+    Parameters
+    ----------
+    checkpointfile : string
+        Path of the checkpoint (.npz) file
+    state : dict
+        JSON-serialisable description of how far the run has got and which
+        run it belongs to
+    arrays : dict or None
+        {name: numpy array} of the arrays needed to continue the run
+
+    """
+    arrays = arrays or {}
+    tmpfile = checkpointfile + ".tmp"
+    with open(tmpfile, "wb") as f:
+        np.savez(f, _state=np.array(json.dumps(state)), **arrays)
+    os.replace(tmpfile, checkpointfile)
+
+
+def load_checkpoint(checkpointfile, key):
+    """
+    Read a checkpoint written by save_checkpoint.
+
+    Parameters
+    ----------
+    checkpointfile : string
+        Path of the checkpoint (.npz) file
+    key : dict
+        Entries the checkpoint's state must match for it to belong to this
+        run, e.g. the crop name and the shape of the driving data
+
+    Returns
+    -------
+    state : dict
+        The checkpoint's state, or an empty dict if there is no checkpoint
+        or it belongs to a different run
+    arrays : dict
+        {name: numpy array} of the checkpointed arrays, or an empty dict
+
+    """
+    if not os.path.exists(checkpointfile):
+        print("No checkpoint found at " + checkpointfile + ", starting from scratch")
+        return {}, {}
+    with np.load(checkpointfile) as f:
+        state = json.loads(str(f["_state"]))
+        arrays = {name: f[name] for name in f.files if name != "_state"}
+    for name, value in key.items():
+        if state.get(name) != value:
+            print(
+                "Checkpoint "
+                + checkpointfile
+                + " is for a different run ("
+                + name
+                + " "
+                + str(state.get(name))
+                + " != "
+                + str(value)
+                + "), starting from scratch"
+            )
+            return {}, {}
+    return state, arrays
+
+
+def input_manifest(paths):
+    """
+    Fingerprint of the input files: the name, size and modification time of
+    each file matching the (glob) paths, sorted by name.
+    """
+    manifest = []
+    for path in paths:
+        for filename in sorted(glob.glob(path)):
+            stat = os.stat(filename)
+            manifest.append([os.path.abspath(filename), stat.st_size, stat.st_mtime_ns])
+    return manifest
+
+
+def _hashable(obj):
+    """
+    JSON-serialisable version of obj for content_hash
+    """
+    if callable(obj):
+        return inspect.getsource(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def content_hash(*parts):
+    """
+    SHA-256 hash (hex) of parts, e.g. crop parameters, input manifests (see
+    input_manifest) and the functions used to calculate a result. Functions
+    are hashed by their source code, so the hash changes when they do.
+    """
+    content = json.dumps(parts, default=_hashable, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _chunk_labels(raw, times, dim, tile):
+    """
+    (label, slice) of each chunk along dim of a file opened by file_checksums:
+    calendar years for time, tiles of tile gridpoints for y and x, and each
+    value otherwise, e.g. each year or decade
+    """
+    size = raw.sizes[dim]
+    if dim in ["y", "x"]:
+        return [
+            (dim + "=" + str(i) + ":" + str(min(i + tile, size)), slice(i, i + tile))
+            for i in range(0, size, tile)
+        ]
+    if dim == "time" and times is not None:
+        years = times.dt.year.values
+        starts = [0] + [i for i in range(1, size) if years[i] != years[i - 1]]
+        ends = starts[1:] + [size]
+        return [
+            ("time=" + str(years[start]), slice(start, end))
+            for start, end in zip(starts, ends)
+        ]
+    if dim in raw.coords:
+        values = raw[dim].values
+        return [(dim + "=" + str(values[i]), slice(i, i + 1)) for i in range(size)]
+    return [(dim + "=" + str(i), slice(i, i + 1)) for i in range(size)]
+
+
+def _array_hash(values):
+    return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+def file_checksums(filename, tile=100):
+    """
+    SHA-256 hashes of the chunks of each variable of a netcdf file, as
+    stored (before any scaling or masking): one chunk per calendar year of
+    time (or per value of any other dimension, e.g. each year or decade) and
+    per tile of tile x tile gridpoints. The file is read one year (or other
+    value) at a time, so only that much of it is ever in memory.
+
+    Returns
+    -------
+    checksums : dict
+        {"coords": {name: hash}, "variables": {name: {"dims", "shape",
+        "dtype", "chunks": {label: hash}}}}, where labels are like
+        "time=2020,y=0:100,x=100:200"
+
+    """
+    checksums = {"coords": {}, "variables": {}}
+    with xr.open_dataset(filename, decode_cf=False) as raw:
+        times = None
+        if "time" in raw.dims:
+            times = xr.open_dataset(filename)["time"]
+        for name in raw.coords:
+            checksums["coords"][name] = _array_hash(raw[name].values)
+        for name, var in raw.data_vars.items():
+            spatial = [dim for dim in var.dims if dim in ["y", "x"]]
+            others = [dim for dim in var.dims if dim not in spatial]
+            chunks = {}
+            for outer in itertools.product(
+                *[_chunk_labels(raw, times, dim, tile) for dim in others]
+            ):
+                # one year (or other value) of the whole grid at a time
+                slab = var.isel(
+                    {dim: index for dim, (label, index) in zip(others, outer)}
+                )
+                slab = slab.transpose(*others, *spatial).values
+                for inner in itertools.product(
+                    *[_chunk_labels(raw, times, dim, tile) for dim in spatial]
+                ):
+                    index = (Ellipsis,) + tuple(index for label, index in inner)
+                    label = ",".join(label for label, index in outer + inner)
+                    chunks[label] = _array_hash(slab[index])
+            checksums["variables"][name] = {
+                "dims": list(var.dims),
+                "shape": list(var.shape),
+                "dtype": str(var.dtype),
+                "chunks": chunks,
+            }
+    return checksums
+
+
+def write_checksum_manifest(manifestfile, filenames, tile=100):
+    """
+    Write the chunk checksums (see file_checksums) of each of filenames to a
+    json manifest, for verify_checksum_manifest to check them against. Files
+    are recorded by name, without their folder.
+    """
+    manifest = {"tile": tile, "files": {}}
+    for filename in filenames:
+        manifest["files"][os.path.basename(filename)] = file_checksums(filename, tile)
+    with open(manifestfile, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def verify_checksum_manifest(manifestfile, outdir, max_chunks=10):
+    """
+    Check the files in outdir against the chunk checksums in a manifest
+    written by write_checksum_manifest, one file and one year (or other
+    value) at a time.
+
+    Returns
+    -------
+    differences : list of str
+        Lines describing each file that is missing or differs: the
+        variables or coordinates that differ, or the years (or other
+        values) and tiles of the chunks that differ, with up to max_chunks
+        of those chunks listed. Empty if all the files are the same.
+
+    """
+    with open(manifestfile) as f:
+        manifest = json.load(f)
+    differences = []
+    for name, expected in manifest["files"].items():
+        filename = os.path.join(outdir, name)
+        if not os.path.exists(filename):
+            differences.append(name + ": missing")
+            continue
+        found = file_checksums(filename, manifest["tile"])
+        for coord, digest in expected["coords"].items():
+            if found["coords"].get(coord) != digest:
+                differences.append(name + ": coordinate " + coord + " differs")
+        for var, exp in expected["variables"].items():
+            got = found["variables"].get(var)
+            if got is None:
+                differences.append(name + ": variable " + var + " is missing")
+                continue
+            layout = ["dims", "shape", "dtype"]
+            if any(got[key] != exp[key] for key in layout):
+                differences.append(
+                    name
+                    + ": "
+                    + var
+                    + " is "
+                    + " ".join(str(got[key]) for key in layout)
+                    + ", expected "
+                    + " ".join(str(exp[key]) for key in layout)
+                )
+                continue
+            differ = [
+                label
+                for label, digest in exp["chunks"].items()
+                if got["chunks"].get(label) != digest
+            ]
+            if not differ:
+                continue
+            parts = [label.split(",") for label in differ]
+            where = sorted(
+                set(
+                    ",".join(p for p in part if p[:2] not in ["y=", "x="])
+                    for part in parts
+                )
+            )
+            tiles = sorted(
+                set(
+                    ",".join(p for p in part if p[:2] in ["y=", "x="]) for part in parts
+                )
+            )
+            differences.append(
+                name
+                + ": "
+                + var
+                + " differs in "
+                + str(len(differ))
+                + " of "
+                + str(len(exp["chunks"]))
+                + " chunks, in "
+                + (" ".join(filter(None, where)) or "all of it")
+                + " and tiles "
+                + " ".join(filter(None, tiles))
+            )
+            for label in differ[:max_chunks]:
+                differences.append("    " + label)
+            if len(differ) > max_chunks:
+                differences.append(
+                    "    and " + str(len(differ) - max_chunks) + " more chunks"
+                )
+    return differences
+
+
+def check_crop(testcrop, flags=None):
+    """
+    Check that a crop from the ecocrop database can be run.
 
-    return maxdoys_avg
+    Parameters
+    ----------
+    testcrop : pandas series
+        Row of the ecocrop database
+    flags : dict or None
+        {texture: bit} of the soil texture mask, e.g. from
+        soil_texture_flags. The soil textures are not checked if None.
 
+    Returns
+    -------
+    problems : list of strings
+        Reasons the crop can't be run. Empty if it can.
+    warnings : list of strings
+        Assumptions that will be made to run the crop.
 
-def lcm_mask(lcm, data):
     """
-    Mask out non-growing regions using a version of the land-
-    cover map
+    problems = []
+    warnings = []
+    for param in CROP_PARAMS:
+        if np.isnan(testcrop[param]):
+            problems.append("Missing " + param)
+
+    if not problems:
+        # assume missing data if GMIN=GMAX
+        if testcrop["GMAX"] - testcrop["GMIN"] <= 10:
+            problems.append(
+                "GMIN and GMAX too close, not enough info to calculate suitability"
+            )
+        elif 0 in growing_season_lengths(testcrop["GMIN"], testcrop["GMAX"]):
+            problems.append("GMIN too short, growing season length of 0 days")
+        if not (
+            testcrop["TMIN"]
+            <= testcrop["TOPMN"]
+            <= testcrop["TOPMX"]
+            <= testcrop["TMAX"]
+        ):
+            warnings.append("TMIN, TOPMN, TOPMX, TMAX not in increasing order")
+        if not (
+            testcrop["RMIN"]
+            <= testcrop["ROPMN"]
+            <= testcrop["ROPMX"]
+            <= testcrop["RMAX"]
+        ):
+            warnings.append("RMIN, ROPMN, ROPMX, RMAX not in increasing order")
+
+    if np.isnan(testcrop["KTMPR"]):
+        warnings.append("Missing KTMPR, assuming " + str(KTMP_DEFAULT) + "C")
+
+    if flags is not None:
+        SOIL = testcrop["TEXT"]
+        textures = [t.strip().lower() for t in str(SOIL).split(",")]
+        unmasked = [t for t in textures if t not in flags]
+        if not isinstance(SOIL, str) or len(unmasked) == len(textures):
+            warnings.append("No soil texture mask for TEXT " + str(SOIL))
+        elif unmasked:
+            warnings.append("No soil texture mask for " + ", ".join(unmasked))
+
+    return problems, warnings
+
+
+def validate_crops(ecocrop, sgmloc=None):
+    """
+    Check every crop in the ecocrop database before any met data is loaded,
+    using check_crop, and check that the crop names used in the output
+    filenames are unique. The first crop with each name is kept.
 
     Parameters
     ----------
-    lcm : string or xarray dataarray
-        path to land cover map file or xarray dataarray of it.
-    data : xarray dataarray or dataset
-        Data to mask.
+    ecocrop : pandas dataframe
+        The ecocrop database
+    sgmloc : string or None
+        Soil texture bit-field raster, or the folder containing it. The soil
+        textures are not checked if None.
 
     Returns
     -------
-    data_masked : xarray dataarray or dataset
-        Masked version of data
+    crops : pandas dataframe
+        Indexed by cropind (the row of ecocrop), with columns
+        cropname, runnable, ngtimes (the number of growing season lengths
+        that will be calculated, which the runtime is proportional to),
+        problems and warnings.
 
     """
-    if type(lcm) == str:
-        if lcm[-3:] == "tif":
-            lcm = xr.open_dataset(lcm, engine="rasterio")
-            lcm = lcm["band_data"]
-            lcm = lcm.drop("band").squeeze()
+    flags = None
+    maskproblem = None
+    if sgmloc is not None:
+        maskfile = soil_texture_file(sgmloc)
+        if os.path.exists(maskfile):
+            flags = soil_texture_flags(maskfile)
         else:
-            lcm = xr.open_dataarray(lcm)
-
-    dataxlims = [data["x"].values[0], data["x"].values[-1]]
-    dataylims = [data["y"].values[0], data["y"].values[-1]]
-    lcmylims = [lcm["y"].values[0], lcm["y"].values[-1]]
-    if dataylims[0] < dataylims[1]:
-        if lcmylims[0] > lcmylims[1]:
-            lcm = lcm[::-1, :]
-    elif dataylims[0] > dataylims[1]:
-        if lcmylims[0] < lcmylims[1]:
-            lcm = lcm[::-1, :]
-
-    lcm_cropped = lcm.sel(
-        x=slice(dataxlims[0], dataxlims[1]),
-        y=slice(dataylims[0], dataylims[1]),
-    )
+            maskproblem = "Soil texture mask " + maskfile + " not found"
+
+    rows = []
+    firstind = {}
+    for cropind in range(len(ecocrop)):
+        testcrop = ecocrop.iloc[cropind, :]
+        cropname = crop_name(testcrop)
+        problems, warnings = check_crop(testcrop, flags)
+        if maskproblem and isinstance(testcrop["TEXT"], str):
+            problems.append(maskproblem)
+        if cropname in firstind:
+            problems.append(
+                "Crop name "
+                + cropname
+                + " already used by cropind "
+                + str(firstind[cropname])
+            )
+        else:
+            firstind[cropname] = cropind
+        if problems:
+            ngtimes = 0
+        else:
+            ngtimes = len(growing_season_lengths(testcrop["GMIN"], testcrop["GMAX"]))
+        rows.append(
+            {
+                "cropname": cropname,
+                "runnable": not problems,
+                "ngtimes": ngtimes,
+                "problems": "; ".join(problems),
+                "warnings": "; ".join(warnings),
+            }
+        )
+
+    crops = pd.DataFrame(rows)
+    crops.index.name = "cropind"
+    return crops
 
-    data_masked_npy = np.where(lcm_cropped.values > 0, data.values, 0)
-    data_masked = data.copy()
-    data_masked.values = data_masked_npy
-    return data_masked
 
+# Compiled crop stores, keyed on absolute path, and their
+# {"cropname": {name: cropind}, "EcoPortCode": {code: cropind}} indexes
+_CROP_STORES = {}
+_CROP_INDEXES = {}
 
-def soil_type_mask(mask, data):
+
+def crop_param_arrays(ecocrop, sgmloc=None):
     """
-    Mask based on soil type, using a soil type mask in netcdf format
+    Compile the ecocrop database into typed arrays of the crop parameters,
+    one element per crop, with the thresholds converted to the units of the
+    met data.
 
     Parameters
     ----------
-    mask : string
-        path to netcdf mask file with values <=0 indicating locations to be
-        masked out in data.
-    data : xarray dataarray or dataset
-        data to be masked.
+    ecocrop : pandas dataframe
+        The ecocrop database
+    sgmloc : string or None
+        Soil texture bit-field raster, or the folder containing it, passed to
+        validate_crops.
 
     Returns
     -------
-    data_masked : xarray dataarray or dataset
-        masked version of data.
+    store : dict
+        {field: numpy array}. Fields are cropind, EcoPortCode, cropname,
+        runnable, problems and warnings (see validate_crops), TOPMIN,
+        TOPMAX, TMIN, TMAX, KTMP and KMAX (K, with KTMP_DEFAULT where KTMPR
+        is missing), PMIN, PMAX, POPMIN and POPMAX (kg/m^2/s), GMIN and GMAX
+        (days, 0 where missing) and SOIL ('' where missing).
 
     """
-    dataxlims = [data["x"].values[0], data["x"].values[-1]]
-    dataylims = [data["y"].values[0], data["y"].values[-1]]
+    crops = validate_crops(ecocrop, sgmloc)
+    KTMPR = ecocrop["KTMPR"].values.astype("float64")
+    store = {
+        "cropind": np.arange(len(ecocrop), dtype="int32"),
+        "EcoPortCode": ecocrop["EcoPortCode"].values.astype("int64"),
+        "cropname": crops["cropname"].values.astype("U"),
+        "runnable": crops["runnable"].values.astype("bool"),
+        "problems": crops["problems"].values.astype("U"),
+        "warnings": crops["warnings"].values.astype("U"),
+        "TOPMIN": ecocrop["TOPMN"].values + 273.15,  # C-->K
+        "TOPMAX": ecocrop["TOPMX"].values + 273.15,  # C-->K
+        "TMIN": ecocrop["TMIN"].values + 273.15,  # C-->K
+        "TMAX": ecocrop["TMAX"].values + 273.15,  # C-->K
+        "KTMP": np.where(np.isnan(KTMPR), KTMP_DEFAULT, KTMPR) + 273.15,  # C-->K
+        "KMAX": ecocrop["TMAX"].values + 273.15,  # C-->K
+        "PMIN": ecocrop["RMIN"].values / 86400.0,  # mm-->kg/m^2/s
+        "PMAX": ecocrop["RMAX"].values / 86400.0,  # mm-->kg/m^2/s
+        "POPMIN": ecocrop["ROPMN"].values / 86400.0,  # mm-->kg/m^2/s
+        "POPMAX": ecocrop["ROPMX"].values / 86400.0,  # mm-->kg/m^2/s
+        "GMIN": np.nan_to_num(ecocrop["GMIN"].values).astype("int16"),
+        "GMAX": np.nan_to_num(ecocrop["GMAX"].values).astype("int16"),
+        "SOIL": ecocrop["TEXT"].fillna("").values.astype("U"),
+    }
+    return store
+
+
+def compile_crop_store(ecocroploc, storefile, sgmloc=None):
+    """
+    Compile the ecocrop csv database into a crop store (see
+    crop_param_arrays), saved as an uncompressed npz file so that it can be
+    read without parsing the database.
 
-    if type(mask) == str:
-        mask = xr.open_dataarray(mask)
-        # this dtype conversion is to get around the case where the coordinates might
-        # be in different dtypes to the datalims, sometimes causing an error
-        xdtype = mask.x.dtype
-        ydtype = mask.y.dtype
-    mask_cropped = mask.sel(
-        x=slice(dataxlims[0].astype(xdtype), dataxlims[1].astype(xdtype)),
-        y=slice(dataylims[0].astype(ydtype), dataylims[1].astype(ydtype)),
-    )
+    Parameters
+    ----------
+    ecocroploc : string
+        Path to the ecocrop csv database
+    storefile : string
+        Path to write the crop store to, ending .npz
+    sgmloc : string or None
+        Soil texture bit-field raster, or the folder containing it, passed to
+        validate_crops.
 
-    data_masked_npy = np.where(mask_cropped.values > 0, data.values, 0)
-    data_masked = data.copy()
-    data_masked.values = data_masked_npy
-    return data_masked
+    Returns
+    -------
+    None.
+
+    """
+    ecocropall = pd.read_csv(ecocroploc, engine="python")
+    ecocrop = ecocropall.drop(["level_0"], axis=1)
+    np.savez(storefile, **crop_param_arrays(ecocrop, sgmloc))
 
 
-def soil_type_mask_all(data, SOIL, maskloc):
+def load_crop_store(storeloc):
     """
-    apply the masking function for all the soil types
-    dependent on which the crop grows in (SOIL)
+    Read a crop store, indexing it by crop name and EcoPortCode. The store
+    is cached so it is only read once.
 
     Parameters
     ----------
-    data : xarray dataarray or dataset
-        data to be masked.
-    SOIL : string
-        'heavy', 'medium' or 'light', describing the soil type suitable for
-        the crop
-    maskloc : string
-        path to netcdf mask file with values <=0 indicating locations to be
-        masked out in data.
+    storeloc : string
+        Path to a crop store written by compile_crop_store, or to the
+        ecocrop csv database, which is compiled in memory.
 
     Returns
     -------
-    data_masked : xarray dataarray or dataset
-        masked version of data.
+    store : dict
+        {field: numpy array}, see crop_param_arrays.
 
     """
-    if "heavy" in SOIL and "medium" in SOIL and "light" in SOIL:
-        print("Doing masking for all soil groups")
-        maskfile = os.path.join(maskloc, "all_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "heavy" in SOIL and "medium" in SOIL:
-        print("Doing masking for heavy and medium soil groups")
-        maskfile = os.path.join(maskloc, "heavy_med_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "heavy" in SOIL and "light" in SOIL:
-        print("Doing masking for light and heavy soil groups")
-        maskfile = os.path.join(maskloc, "heavy_light_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "medium" in SOIL and "light" in SOIL:
-        print("Doing masking for light and medium soil groups")
-        maskfile = os.path.join(maskloc, "med_light_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "light" in SOIL:
-        print("Doing masking for light soil group")
-        maskfile = os.path.join(maskloc, "light_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "medium" in SOIL:
-        print("Doing masking for medium soil group")
-        maskfile = os.path.join(maskloc, "medium_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
-    elif "heavy" in SOIL:
-        print("Doing masking for heavy soil group")
-        maskfile = os.path.join(maskloc, "heavy_soil_mask.nc")
-        data = soil_type_mask(maskfile, data)
+    key = os.path.abspath(storeloc)
+    if key not in _CROP_STORES:
+        if storeloc.endswith(".npz"):
+            with np.load(storeloc, allow_pickle=False) as npz:
+                store = {field: npz[field] for field in npz.files}
+        else:
+            ecocropall = pd.read_csv(storeloc, engine="python")
+            store = crop_param_arrays(ecocropall.drop(["level_0"], axis=1))
+
+        # the first crop with each name, as kept by validate_crops
+        byname = {}
+        for cropind, cropname in zip(store["cropind"], store["cropname"]):
+            byname.setdefault(str(cropname), int(cropind))
+        bycode = {
+            int(code): int(cropind)
+            for cropind, code in zip(store["cropind"], store["EcoPortCode"])
+        }
+        _CROP_STORES[key] = store
+        _CROP_INDEXES[key] = {"cropname": byname, "EcoPortCode": bycode}
+    return _CROP_STORES[key]
+
+
+def crop_params(storeloc, cropind=None, cropname=None, EcoPortCode=None):
+    """
+    Look up the parameters of one crop in a crop store, by its row in the
+    ecocrop database (cropind), its name or its EcoPortCode.
 
-    return data
+    Parameters
+    ----------
+    storeloc : string
+        Path to a crop store or the ecocrop csv database, see
+        load_crop_store.
+    cropind : int
+    cropname : string
+        As returned by crop_name
+    EcoPortCode : int
+
+    Returns
+    -------
+    crop : dict
+        {field: value} for the crop, see crop_param_arrays.
+
+    """
+    store = load_crop_store(storeloc)
+    index = _CROP_INDEXES[os.path.abspath(storeloc)]
+    if cropname is not None:
+        if cropname not in index["cropname"]:
+            raise ValueError("Crop " + str(cropname) + " not in " + storeloc)
+        cropind = index["cropname"][cropname]
+    elif EcoPortCode is not None:
+        if int(EcoPortCode) not in index["EcoPortCode"]:
+            raise ValueError("EcoPortCode " + str(EcoPortCode) + " not in " + storeloc)
+        cropind = index["EcoPortCode"][int(EcoPortCode)]
+    elif cropind is None:
+        raise ValueError("One of cropind, cropname or EcoPortCode is required")
+
+    return {field: values[cropind] for field, values in store.items()}
+
+
+def scoring_key(crop):
+    """
+    The crop's SCORE_PARAMS, exactly as stored (after the conversion to the
+    units of the met data, which gives the same values from the same
+    database or crop store). Crops with the same key have identical daily
+    scores.
+    """
+    return tuple(float(crop[param]) for param in SCORE_PARAMS)
+
+
+def scoring_groups(store, runnable_only=True):
+    """
+    Group the crops of a crop store by their scoring_key.
+
+    Parameters
+    ----------
+    store : dict
+        Crop store, see load_crop_store
+    runnable_only : bool
+        Only group the crops that can be run
+
+    Returns
+    -------
+    groups : list of lists
+        The cropinds of each group of crops with the same scoring_key, in
+        order of their first cropind.
+
+    """
+    groups = {}
+    for cropind in store["cropind"]:
+        if runnable_only and not store["runnable"][cropind]:
+            continue
+        crop = {param: store[param][cropind] for param in SCORE_PARAMS}
+        groups.setdefault(scoring_key(crop), []).append(int(cropind))
+    return list(groups.values())
 
 
+@traced
 def calculate_max_doy(allscore, tempscore, precscore):
     """
     Return the day of year of the maximum score for allscore, tempscore,
@@ -235,8 +2217,17 @@ def calculate_max_doy(allscore, tempscore, precscore):
     return maxdoys, maxdoys_temp, maxdoys_prec
 
 
+@traced
 def calc_yearly_scores_only(
-    tempscore, precscore, SOIL, LCMloc, sgmloc, cropname, outdir, yearaggmethod
+    tempscore,
+    precscore,
+    SOIL,
+    LCMloc,
+    sgmloc,
+    cropname,
+    outdir,
+    yearaggmethod,
+    dtype=None,
 ):
     """
     Calculate aggregated yearly crop suitability scores from the
@@ -250,12 +2241,14 @@ def calc_yearly_scores_only(
     or xarray dataarrays.
     SOIL: Soil group suitability string from the ecocrop database
     LCMloc: Land cover mask. Path to tif
-    sgmloc: Soil group mask netcdfs folder as string
+    sgmloc: Soil texture bit-field raster, or the folder containing it
     outdir: Where to store output netcdf files
     cropname: For output filenames
     yearaggmethod: What metric to use to aggregate the scores to yearly values,
                    can be 'max', 'median', 'mean' or 'percentile'.
                    'percentile' is recommended and uses the 95th percentile.
+    dtype: dtype to hold the yearly scores in before they are saved as
+           uint8. As aggregated (float64, or uint8 for 'max') if None
 
     Outputs
     -------
@@ -268,6 +2261,7 @@ def calc_yearly_scores_only(
     """
 
     print("Calculating yearly score")
+    trace_note(cells_days=int(tempscore.size))
     # crop suitability score for a given year is the max
     # over all days in the year
     if yearaggmethod == "max":
@@ -286,22 +2280,19 @@ def calc_yearly_scores_only(
         raise SyntaxError(
             "yearaggmethod must be one of max, median, mean or percentile"
         )
+    if dtype is not None and tempscore_years.dtype != dtype:
+        tempscore_years = tempscore_years.astype(dtype)
+        precscore_years = precscore_years.astype(dtype)
     allscore_years = xr.where(
         precscore_years < tempscore_years, precscore_years, tempscore_years
     )
 
     print("Doing masking")
     # mask at this stage to avoid memory issues
-    lcm = xr.open_dataset(LCMloc, engine="rasterio")
-    lcm = lcm["band_data"]
-    lcm = lcm.drop("band").squeeze()
-    lcm = lcm[::-1, :]
-    allscore_years = lcm_mask(lcm, allscore_years)
-    tempscore_years = lcm_mask(lcm, tempscore_years)
-    precscore_years = lcm_mask(lcm, precscore_years)
-    allscore_years = soil_type_mask_all(allscore_years, SOIL, sgmloc)
-    tempscore_years = soil_type_mask_all(tempscore_years, SOIL, sgmloc)
-    precscore_years = soil_type_mask_all(precscore_years, SOIL, sgmloc)
+    mask = crop_mask(allscore_years, SOIL, LCMloc, sgmloc)
+    apply_mask(mask, allscore_years)
+    apply_mask(mask, tempscore_years)
+    apply_mask(mask, precscore_years)
 
     # compress and save to disk
     allscore_years.name = "crop_suitability_score"
@@ -343,8 +2334,18 @@ def calc_yearly_scores_only(
     return allscore_years, tempscore_years, precscore_years
 
 
+@traced
 def calc_decadal_changes(
-    tempscore, precscore, SOIL, LCMloc, sgmloc, cropname, outdir, yearaggmethod
+    tempscore,
+    precscore,
+    SOIL,
+    LCMloc,
+    sgmloc,
+    cropname,
+    outdir,
+    yearaggmethod,
+    baseline="first",
+    dtype=None,
 ):
     """
     Calculate decadal changes of crop suitability scores from the
@@ -358,13 +2359,16 @@ def calc_decadal_changes(
     ------
     SOIL: Soil group suitability string from the ecocrop database
     LCMloc: Land cover mask. Path to tif
-    sgmloc: Soil group mask netcdfs folder as string
+    sgmloc: Soil texture bit-field raster, or the folder containing it
     outdir: Where to store output netcdf files
     cropname: For output filenames
     yearaggmethod: What metric to use to aggregate the scores to yearly values,
                    can be 'max', 'median', 'mean' or 'percentile'.
                    'percentile' is recommended and uses the 95th percentile.
-
+    baseline: The baseline to calculate the decadal changes from. 'first'
+              (the default) for the first decade, a decade label (e.g. 2020)
+              or a (start, end) tuple of decade labels. See decadal_changes.
+    dtype: dtype to hold the yearly scores in, see calc_yearly_scores_only
 
     Outputs
     -------
@@ -378,109 +2382,30 @@ def calc_decadal_changes(
     precscore_decades: as tempscore_decades but for precscore
     allscore_decadal_changes: xarray dataset/dataarray
         allscore_decades but the grid elementwise differences between each
-        decade and the first (which is dropped)
+        decade and the baseline (by default the first, which is dropped)
     tempscore_decadal_changes: as allscore_decadal_changes but for tempscore
     precscore_decadal_changes: as allscore_decadal_changes but for precscore
 
     """
 
-    print("Calculating yearly score")
-    # crop suitability score for a given year is the max
-    # over all days in the year
-    if yearaggmethod == "max":
-        tempscore_years = tempscore.groupby("time.year").max()
-        precscore_years = precscore.groupby("time.year").max()
-    elif yearaggmethod == "median":
-        tempscore_years = tempscore.groupby("time.year").median()
-        precscore_years = precscore.groupby("time.year").median()
-    elif yearaggmethod == "mean":
-        tempscore_years = tempscore.groupby("time.year").mean()
-        precscore_years = precscore.groupby("time.year").mean()
-    elif yearaggmethod == "percentile":
-        tempscore_years = tempscore.groupby("time.year").quantile(0.95)
-        precscore_years = precscore.groupby("time.year").quantile(0.95)
-    else:
-        raise SyntaxError(
-            "yearaggmethod must be one of max, median, mean or percentile"
-        )
-    allscore_years = xr.where(
-        precscore_years < tempscore_years, precscore_years, tempscore_years
-    )
-
-    print("Doing masking")
-    # mask at this stage to avoid memory issues
-    lcm = xr.open_dataset(LCMloc, engine="rasterio")
-    lcm = lcm["band_data"]
-    lcm = lcm.drop("band").squeeze()
-    lcm = lcm[::-1, :]
-    allscore_years = lcm_mask(lcm, allscore_years)
-    tempscore_years = lcm_mask(lcm, tempscore_years)
-    precscore_years = lcm_mask(lcm, precscore_years)
-    allscore_years = soil_type_mask_all(allscore_years, SOIL, sgmloc)
-    tempscore_years = soil_type_mask_all(tempscore_years, SOIL, sgmloc)
-    precscore_years = soil_type_mask_all(precscore_years, SOIL, sgmloc)
-
-    # compress and save to disk
-    allscore_years.name = "crop_suitability_score"
-    allscore_years.encoding["zlib"] = True
-    allscore_years.encoding["complevel"] = 1
-    allscore_years.encoding["shuffle"] = False
-    allscore_years.encoding["contiguous"] = False
-    allscore_years.encoding["dtype"] = np.dtype("uint8")
-    encoding = {}
-    encoding["crop_suitability_score"] = allscore_years.encoding
-    allscore_years.to_netcdf(
-        os.path.join(outdir, cropname + "_years.nc"), encoding=encoding
-    )
-
-    tempscore_years.encoding["zlib"] = True
-    tempscore_years.encoding["complevel"] = 1
-    tempscore_years.encoding["shuffle"] = False
-    tempscore_years.encoding["contiguous"] = False
-    tempscore_years.encoding["dtype"] = np.dtype("uint8")
-    encoding = {}
-    encoding["temperature_suitability_score"] = tempscore_years.encoding
-    tempscore_years.to_netcdf(
-        os.path.join(outdir, cropname + "_tempscore_years.nc"),
-        encoding=encoding,
-    )
-
-    precscore_years.encoding["zlib"] = True
-    precscore_years.encoding["complevel"] = 1
-    precscore_years.encoding["shuffle"] = False
-    precscore_years.encoding["contiguous"] = False
-    precscore_years.encoding["dtype"] = np.dtype("uint8")
-    encoding = {}
-    encoding["precip_suitability_score"] = precscore_years.encoding
-    precscore_years.to_netcdf(
-        os.path.join(outdir, cropname + "_precscore_years.nc"),
-        encoding=encoding,
+    allscore_years, tempscore_years, precscore_years = calc_yearly_scores_only(
+        tempscore,
+        precscore,
+        SOIL,
+        LCMloc,
+        sgmloc,
+        cropname,
+        outdir,
+        yearaggmethod,
+        dtype,
     )
 
     print("Calculating decadal score")
     # crop suitability score for a given decade is the mean
     # over all years in the decade
-    allscore_decades = []
-    tempscore_decades = []
-    precscore_decades = []
-    syear = allscore_years["year"][0].values
-    nyears = allscore_years.shape[0]
-    nyears_u = int(np.floor(nyears / 10) * 10)
-    for idx in range(0, nyears_u, 10):
-        allscore_decade = allscore_years[idx : idx + 10, :, :].mean(dim="year")
-        tempscore_decade = tempscore_years[idx : idx + 10, :, :].mean(dim="year")
-        precscore_decade = precscore_years[idx : idx + 10, :, :].mean(dim="year")
-
-        allscore_decade = allscore_decade.expand_dims({"decade": [syear + idx]})
-        tempscore_decade = tempscore_decade.expand_dims({"decade": [syear + idx]})
-        precscore_decade = precscore_decade.expand_dims({"decade": [syear + idx]})
-
-        allscore_decades.append(allscore_decade)
-        tempscore_decades.append(tempscore_decade)
-        precscore_decades.append(precscore_decade)
-    allscore_decades = xr.merge(allscore_decades)["crop_suitability_score"]
-    tempscore_decades = xr.merge(tempscore_decades)["temperature_suitability_score"]
-    precscore_decades = xr.merge(precscore_decades)["precip_suitability_score"]
+    allscore_decades = decadal_means(allscore_years, "year")
+    tempscore_decades = decadal_means(tempscore_years, "year")
+    precscore_decades = decadal_means(precscore_years, "year")
 
     # compress and save to disk
     allscore_decades.name = "crop_suitability_score"
@@ -520,20 +2445,9 @@ def calc_decadal_changes(
     )
 
     # decadal changes
-    allscore_decadal_changes = allscore_decades.copy()[1:, :, :]
-    tempscore_decadal_changes = tempscore_decades.copy()[1:, :, :]
-    precscore_decadal_changes = precscore_decades.copy()[1:, :, :]
-    decs = allscore_decades.shape[0]
-    for dec in range(1, decs):
-        allscore_decadal_changes[dec - 1, :, :] = (
-            allscore_decades[dec, :, :] - allscore_decades[0, :, :]
-        )
-        tempscore_decadal_changes[dec - 1, :, :] = (
-            tempscore_decades[dec, :, :] - tempscore_decades[0, :, :]
-        )
-        precscore_decadal_changes[dec - 1, :, :] = (
-            precscore_decades[dec, :, :] - precscore_decades[0, :, :]
-        )
+    allscore_decadal_changes = decadal_changes(allscore_decades, baseline)
+    tempscore_decadal_changes = decadal_changes(tempscore_decades, baseline)
+    precscore_decadal_changes = decadal_changes(precscore_decades, baseline)
     allscore_decadal_changes.to_netcdf(
         os.path.join(outdir, cropname + "_decadal_changes.nc")
     )
@@ -554,8 +2468,17 @@ def calc_decadal_changes(
     )
 
 
+@traced
 def calc_decadal_doy_changes(
-    maxdoys, maxdoys_temp, maxdoys_prec, SOIL, LCMloc, sgmloc, cropname, outdir
+    maxdoys,
+    maxdoys_temp,
+    maxdoys_prec,
+    SOIL,
+    LCMloc,
+    sgmloc,
+    cropname,
+    outdir,
+    baseline="first",
 ):
     """
     Calculate decadal changes in the 'day of year of the maximum score' metric,
@@ -565,20 +2488,24 @@ def calc_decadal_doy_changes(
     ------
     maxdoys: Xarray dataarray from calc_maximum_doy containing the day of year
              on which the maximum crop suitability score occured for each
-             gridcell for each year.
+             gridcell for each year. Masked in place.
     maxdoys_temp: As maxdoys but for the temperature crop suitability score
     maxdoys_prec: As maxdoys but for the precipitation crop suitability score
     SOIL: Soil group suitability string from the ecocrop database
     LCMloc: Land cover mask. Path to tif
-    sgmloc: Soil group mask netcdfs folder as string
+    sgmloc: Soil texture bit-field raster, or the folder containing it
     outdir: Where to store output netcdf files
     cropname: For output filenames
+    baseline: The baseline to calculate the decadal changes from. 'first'
+              (the default) for the first decade, a decade label (e.g. 2020)
+              or a (start, end) tuple of decade labels, which are circularly
+              averaged. See decadal_changes.
 
     Outputs
     -------
     maxdoys_decadal_changes: xarray dataarray
-        The grid elementwise difference between each decade and the first
-        decade of the modulo average day of year denoting the day of year of
+        The grid elementwise difference between each decade and the baseline
+        decade(s) of the modulo average day of year denoting the day of year of
         the maximum score for the combined temperature and precipitation crop
         suitability score.
     maxdoys_temp_decadal_changes: As maxdoys_decadal_changes but for the
@@ -588,16 +2515,10 @@ def calc_decadal_doy_changes(
     """
 
     # mask land-cover and soil
-    lcm = xr.open_dataset(LCMloc, engine="rasterio")
-    lcm = lcm["band_data"]
-    lcm = lcm.drop("band").squeeze()
-    lcm = lcm[::-1, :]
-    maxdoys = lcm_mask(lcm, maxdoys)
-    maxdoys_temp = lcm_mask(lcm, maxdoys_temp)
-    maxdoys_prec = lcm_mask(lcm, maxdoys_prec)
-    maxdoys = soil_type_mask_all(maxdoys, SOIL, sgmloc)
-    maxdoys_temp = soil_type_mask_all(maxdoys_temp, SOIL, sgmloc)
-    maxdoys_prec = soil_type_mask_all(maxdoys_prec, SOIL, sgmloc)
+    mask = crop_mask(maxdoys, SOIL, LCMloc, sgmloc)
+    apply_mask(mask, maxdoys)
+    apply_mask(mask, maxdoys_temp)
+    apply_mask(mask, maxdoys_prec)
     # compress and save to disk
     maxdoys.encoding["zlib"] = True
     maxdoys.encoding["complevel"] = 1
@@ -637,28 +2558,13 @@ def calc_decadal_doy_changes(
     )
 
     # calculate the decadal averages, using circular averaging
-    maxdoys_decades = []
-    maxdoys_temp_decades = []
-    maxdoys_prec_decades = []
-    syear = maxdoys["year"][0].values
-    nyears = maxdoys.shape[0]
-    nyears_u = int(np.floor(nyears / 10) * 10)
-    for idx in range(0, nyears_u, 10):
-        maxdoys_decade = maxdoys[idx : idx + 10, :, :]
-        maxdoys_temp_decade = maxdoys_temp[idx : idx + 10, :, :]
-        maxdoys_prec_decade = maxdoys_prec[idx : idx + 10, :, :]
-        maxdoys_decade = circular_avg(maxdoys_decade, "year")
-        maxdoys_temp_decade = circular_avg(maxdoys_temp_decade, "year")
-        maxdoys_prec_decade = circular_avg(maxdoys_prec_decade, "year")
-        maxdoys_decade = maxdoys_decade.expand_dims({"decade": [syear + idx]})
-        maxdoys_temp_decade = maxdoys_temp_decade.expand_dims({"decade": [syear + idx]})
-        maxdoys_prec_decade = maxdoys_prec_decade.expand_dims({"decade": [syear + idx]})
-        maxdoys_decades.append(maxdoys_decade)
-        maxdoys_temp_decades.append(maxdoys_temp_decade)
-        maxdoys_prec_decades.append(maxdoys_prec_decade)
-    maxdoys_decades = xr.merge(maxdoys_decades)["dayofyear"]
-    maxdoys_temp_decades = xr.merge(maxdoys_temp_decades)["dayofyear"]
-    maxdoys_prec_decades = xr.merge(maxdoys_prec_decades)["dayofyear"]
+    maxdoys_decades, maxdoys_rlen = circular_decadal_stats(maxdoys, "year")
+    maxdoys_temp_decades, maxdoys_temp_rlen = circular_decadal_stats(
+        maxdoys_temp, "year"
+    )
+    maxdoys_prec_decades, maxdoys_prec_rlen = circular_decadal_stats(
+        maxdoys_prec, "year"
+    )
     # save to disk
     maxdoys_decades.to_netcdf(
         os.path.join(outdir, cropname + "_max_score_doys_decades.nc")
@@ -669,23 +2575,27 @@ def calc_decadal_doy_changes(
     maxdoys_prec_decades.to_netcdf(
         os.path.join(outdir, cropname + "_max_precscore_doys_decades.nc")
     )
+    maxdoys_rlen.to_netcdf(
+        os.path.join(outdir, cropname + "_max_score_doys_decades_rlength.nc")
+    )
+    maxdoys_temp_rlen.to_netcdf(
+        os.path.join(outdir, cropname + "_max_tempscore_doys_decades_rlength.nc")
+    )
+    maxdoys_prec_rlen.to_netcdf(
+        os.path.join(outdir, cropname + "_max_precscore_doys_decades_rlength.nc")
+    )
 
     # calculate the decadal changes from the first decade,
     # using modulo (circular) arithmetic
-    maxdoys_decadal_changes = maxdoys_decades.copy()[1:, :, :]
-    maxdoys_temp_decadal_changes = maxdoys_temp_decades.copy()[1:, :, :]
-    maxdoys_prec_decadal_changes = maxdoys_prec_decades.copy()[1:, :, :]
-    decs = maxdoys_decades.shape[0]
-    for dec in range(1, decs):
-        maxdoys_decadal_changes[dec - 1, :, :] = (
-            maxdoys_decades[dec, :, :] - maxdoys_decades[0, :, :]
-        )
-        maxdoys_temp_decadal_changes[dec - 1, :, :] = (
-            maxdoys_temp_decades[dec, :, :] - maxdoys_temp_decades[0, :, :]
-        )
-        maxdoys_prec_decadal_changes[dec - 1, :, :] = (
-            maxdoys_prec_decades[dec, :, :] - maxdoys_prec_decades[0, :, :]
-        )
+    maxdoys_decadal_changes = decadal_changes(
+        maxdoys_decades, baseline, refavg=circular_avg
+    )
+    maxdoys_temp_decadal_changes = decadal_changes(
+        maxdoys_temp_decades, baseline, refavg=circular_avg
+    )
+    maxdoys_prec_decadal_changes = decadal_changes(
+        maxdoys_prec_decades, baseline, refavg=circular_avg
+    )
     maxdoys_decadal_changes = xr.where(
         maxdoys_decadal_changes > 180,
         maxdoys_decadal_changes % -180,
@@ -729,7 +2639,10 @@ def calc_decadal_doy_changes(
     )
 
 
-def calc_decadal_kprop_changes(ktmpap, kmaxap, SOIL, LCMloc, sgmloc, cropname, outdir):
+@traced
+def calc_decadal_kprop_changes(
+    ktmpap, kmaxap, SOIL, LCMloc, sgmloc, cropname, outdir, baseline="first"
+):
     """
     Calculate decadal changes in the gtime-average proportion of
     ktmp & kmax days for each month
@@ -743,74 +2656,33 @@ def calc_decadal_kprop_changes(ktmpap, kmaxap, SOIL, LCMloc, sgmloc, cropname, o
     kmaxap: As ktmpap but for above the crop KMAX (TMAX)
     SOIL: Soil group suitability string from the ecocrop database
     LCMloc: Land cover mask. Path to tif
-    sgmloc: Soil group mask netcdfs folder as string
+    sgmloc: Soil texture bit-field raster, or the folder containing it
     outdir: Where to store output netcdf files
     cropname: For output filenames
+    baseline: The baseline to calculate the decadal changes from. 'first'
+              (the default) for the first decade, a decade label (e.g. 2020)
+              or a (start, end) tuple of decade labels. See decadal_changes.
 
     Outputs
     -------
     ktmpap_monavg_climo_diffs: An xarray dataarray containing the
                                difference between the decadally averaged
-                               monthly averaged ktmpap and the first decade
+                               monthly averaged ktmpap and the baseline
+                               (by default the first decade)
     kmaxap_monavg_climo_diffs: As ktmpap_monavg_climo_diffs but for kmaxap
     """
 
-    # Calculate monthly average
-    ktmpap_monavg = ktmpap.resample(time="1MS").mean(dim="time")
-    kmaxap_monavg = kmaxap.resample(time="1MS").mean(dim="time")
-
-    # mask
-    lcm = xr.open_dataset(LCMloc, engine="rasterio")
-    lcm = lcm["band_data"]
-    lcm = lcm.drop("band").squeeze()
-    lcm = lcm[::-1, :]
-    ktmpap_monavg = lcm_mask(lcm, ktmpap_monavg)
-    kmaxap_monavg = lcm_mask(lcm, kmaxap_monavg)
-    ktmpap_monavg = soil_type_mask_all(ktmpap_monavg, SOIL, sgmloc)
-    kmaxap_monavg = soil_type_mask_all(kmaxap_monavg, SOIL, sgmloc)
-
-    # calculate monthly climatologies for each decade
-    ktmpap_monavg_climos = []
-    kmaxap_monavg_climos = []
-    nyears = ktmpap_monavg.shape[0] // 12
-    ndecs = int(np.round(nyears, -1) / 10)
-    for d in range(0, ndecs):
-        sind = d * 120
-        eind = (d + 1) * 120
-        year = ktmpap_monavg["time"][sind].dt.year
-        if eind >= ktmpap_monavg.shape[0]:
-            ktmpap_monavg_climo = (
-                ktmpap_monavg[sind:, :, :]
-                .groupby("time.month")
-                .mean()
-                .expand_dims({"decade": [year]})
-            )
-            kmaxap_monavg_climo = (
-                kmaxap_monavg[sind:, :, :]
-                .groupby("time.month")
-                .mean()
-                .expand_dims({"decade": [year]})
-            )
-            ktmpap_monavg_climos.append(ktmpap_monavg_climo)
-            kmaxap_monavg_climos.append(kmaxap_monavg_climo)
-        else:
-            ktmpap_monavg_climo = (
-                ktmpap_monavg[sind:eind, :, :]
-                .groupby("time.month")
-                .mean()
-                .expand_dims({"decade": [year]})
-            )
-            kmaxap_monavg_climo = (
-                kmaxap_monavg[sind:eind, :, :]
-                .groupby("time.month")
-                .mean()
-                .expand_dims({"decade": [year]})
-            )
-            ktmpap_monavg_climos.append(ktmpap_monavg_climo)
-            kmaxap_monavg_climos.append(kmaxap_monavg_climo)
+    # calculate monthly climatologies for each decade, straight from the
+    # daily data and for both variables at once
+    ktmpap_monavg_climos2, kmaxap_monavg_climos2 = monthly_decadal_climatology(
+        [ktmpap, kmaxap]
+    )
+
+    # mask, after the reduction as it is much smaller than the daily data
+    mask = crop_mask(ktmpap_monavg_climos2, SOIL, LCMloc, sgmloc)
+    apply_mask(mask, ktmpap_monavg_climos2)
+    apply_mask(mask, kmaxap_monavg_climos2)
 
-    ktmpap_monavg_climos2 = xr.concat(ktmpap_monavg_climos, dim="decade")
-    kmaxap_monavg_climos2 = xr.concat(kmaxap_monavg_climos, dim="decade")
     # compress and save to disk
     ktmpap_monavg_climos2.encoding["zlib"] = True
     ktmpap_monavg_climos2.encoding["complevel"] = 1
@@ -841,16 +2713,8 @@ def calc_decadal_kprop_changes(ktmpap, kmaxap, SOIL, LCMloc, sgmloc, cropname, o
     )
 
     # difference the climatologies
-    ktmpap_monavg_climo_diffs = ktmpap_monavg_climos2.copy()[1:]
-    kmaxap_monavg_climo_diffs = kmaxap_monavg_climos2.copy()[1:]
-    decs = kmaxap_monavg_climos2.shape[0]
-    for dec in range(1, decs):
-        ktmpap_monavg_climo_diffs[dec - 1] = (
-            ktmpap_monavg_climos2[dec] - ktmpap_monavg_climos2[0]
-        )
-        kmaxap_monavg_climo_diffs[dec - 1] = (
-            kmaxap_monavg_climos2[dec] - kmaxap_monavg_climos2[0]
-        )
+    ktmpap_monavg_climo_diffs = decadal_changes(ktmpap_monavg_climos2, baseline)
+    kmaxap_monavg_climo_diffs = decadal_changes(kmaxap_monavg_climos2, baseline)
 
     # compress and save to disk
     ktmpap_monavg_climo_diffs.encoding["zlib"] = True
@@ -884,6 +2748,7 @@ def calc_decadal_kprop_changes(ktmpap, kmaxap, SOIL, LCMloc, sgmloc, cropname, o
     return ktmpap_monavg_climo_diffs, kmaxap_monavg_climo_diffs
 
 
+@traced
 def plot_year(allscore, tempscore, precscore, save=None):
     """
     Plot a given year's allscore, tempscore and precscore.
@@ -937,6 +2802,7 @@ def plot_year(allscore, tempscore, precscore, save=None):
         plt.close()
 
 
+@traced
 def plot_decade(allscore, tempscore, precscore, save=None):
     """
     Plot a given decade's allscore, tempscore and precscore
@@ -1175,7 +3041,7 @@ def plot_degC_changes(dcdata, savedir=None, cmin=None, cmax=None, revcolbar=None
         plt.close()
 
 
-def frs3D(ind, window, dtype):
+def frs3D(ind, window, dtype, carry=None):
     """
     Clever function that does a forward rolling sum without loops
     see https://stackoverflow.com/questions/14313510/how-to-calculate-rolling-moving-average-using-numpy-scipy
@@ -1190,6 +3056,11 @@ def frs3D(ind, window, dtype):
         The window size to use for the rolling sum.
     dtype : np.dtype
         The dtype to output the result as.
+    carry : array-like, optional
+        2-dimensional array of the running total before the start of ind,
+        when continuing a rolling sum over an earlier part of the record.
+        The running total is then accumulated exactly as it would have been
+        over the whole record.
 
     Returns
     -------
@@ -1197,6 +3068,13 @@ def frs3D(ind, window, dtype):
         3-dimensional array, the result of the forward rolling sum over ind.
 
     """
+    if carry is not None:
+        inds = np.cumsum(
+            np.concatenate([np.asarray(carry, dtype=dtype)[None, ...], ind]),
+            axis=0,
+            dtype=dtype,
+        )
+        return inds[window:, ...] - inds[:-window, ...]
     inds = np.cumsum(ind, axis=0, dtype=dtype)
     tmp = inds[window:, ...] - inds[:-window, ...]
     tmp2 = inds[window - 1, ...]
@@ -1204,6 +3082,129 @@ def frs3D(ind, window, dtype):
     return ret
 
 
+@traced
+def running_total(ind, dtype, carry=None, chunk=360, func=None, out=None):
+    """
+    Running total of ind along its first (time) dimension, with a leading
+    row of zeros (or carry), so that the rolling sum over any window can be
+    read off it with one subtraction (see window_sums) instead of
+    recalculated for each window.
+
+    The running total is accumulated in dtype in the same order as frs3D,
+    so the window sums read from it are identical to those from frs3D.
+
+    Parameters
+    ----------
+    ind : array-like
+        3-dimensional (time, y, x), read chunk days at a time, so it can be
+        an xarray dataarray opened lazily
+    dtype : np.dtype
+        The dtype to accumulate and output the result as.
+    carry : array-like, optional
+        2-dimensional array of the running total before the start of ind,
+        as for frs3D.
+    chunk : int
+        Number of days read at a time
+    func : function, optional
+        Applied to each chunk of ind before it is added up, so that e.g. the
+        days within a temperature range can be totalled without holding
+        them for the whole record.
+    out : array-like, optional
+        Array of shape (time + 1, y, x) and dtype to write the result to,
+        e.g. a memory-mapped file. Allocated if not given.
+
+    Returns
+    -------
+    out : array-like
+        The running total
+
+    """
+    ntime = ind.shape[0]
+    trace_note(cells_days=int(np.prod(ind.shape)))
+    if out is None:
+        out = np.empty((ntime + 1,) + ind.shape[1:], dtype=dtype)
+    out[0] = 0 if carry is None else carry
+    for start in range(0, ntime, chunk):
+        block = ind[start : start + chunk]
+        if func is not None:
+            block = func(block)
+        block = np.asarray(block)
+        end = start + block.shape[0] + 1
+        np.cumsum(
+            np.concatenate([out[start][None, ...], block]),
+            axis=0,
+            dtype=dtype,
+            out=out[start:end],
+        )
+    return out
+
+
+@traced
+def write_prefix_sums(data, filename, chunk=360):
+    """
+    Write the running total of data along its first (time) dimension to a
+    .npy file that can be memory-mapped (see running_total).
+
+    Parameters
+    ----------
+    data : xarray dataarray
+        3-dimensional (time, y, x), read chunk days at a time, so it can be
+        opened lazily
+    filename : string
+        Path of the .npy file to write. Written under a temporary name and
+        then renamed, so it is only there once complete.
+    chunk : int
+        Number of days read at a time
+
+    Returns
+    -------
+    None.
+
+    """
+    tmpfile = filename + ".tmp"
+    prefix = np.lib.format.open_memmap(
+        tmpfile,
+        mode="w+",
+        dtype="float32",
+        shape=(data.shape[0] + 1,) + data.shape[1:],
+    )
+    running_total(data, "float32", chunk=chunk, out=prefix)
+    prefix.flush()
+    del prefix
+    os.replace(tmpfile, filename)
+
+
+def window_sums(prefix, window, out=None):
+    """
+    Forward rolling sum over window, as frs3D, read off a running total
+    from running_total or write_prefix_sums.
+
+    Parameters
+    ----------
+    prefix : array-like
+        The running total, e.g. memory-mapped with np.load(mmap_mode="r")
+    window : int
+        The window size to use for the rolling sum.
+    out : array-like, optional
+        Array to write the result to, with at least as many rows (time) as
+        the result, e.g. one allocated for the shortest window. Its first
+        rows are written to and returned. A float32 array is allocated if
+        not given.
+
+    Returns
+    -------
+    ret : numpy array
+        3-dimensional array, the result of the forward rolling sum.
+
+    """
+    ntime = prefix.shape[0] - window
+    if out is None:
+        out = np.empty((ntime,) + prefix.shape[1:], dtype="float32")
+    ret = out[:ntime]
+    np.subtract(prefix[window:], prefix[:-window], out=ret)
+    return ret
+
+
 def frs3Dwcs(ind, window):
     """
     As frs3D, but without the initial step
@@ -1247,7 +3248,7 @@ def score_temp(gtime, gmin, gmax):
 #    return score.round()
 
 
-def score_temp2(temp, tmin, tmax, topmin, topmax):
+def score_temp2(temp, tmin, tmax, topmin, topmax, dtype="float16"):
     """
     Calculate the temperature suitability of a given day in the driving dataset
     for a given crop, between 0 and 1.
@@ -1264,10 +3265,12 @@ def score_temp2(temp, tmin, tmax, topmin, topmax):
         The minimum optimum temperature for the crop.
     topmax : int
         The maximum optimum temperature for the crop.
+    dtype : string or numpy dtype
+        The dtype to return the suitability as. Default float16.
 
     Returns
     -------
-    array-like, float16
+    array-like, dtype
         The temperature suitability for each day and grid cell between 0 and 1.
 
     """
@@ -1288,7 +3291,7 @@ def score_temp2(temp, tmin, tmax, topmin, topmax):
             ),
         ),
     )
-    return score.astype("float16")
+    return score.astype(dtype)
 
 
 # Not used currently
@@ -1499,3 +3502,287 @@ def score_prec3(total, pmin, pmax, popmin, popmax):
         ),
     )
     return score.round().astype("uint8")
+
+
+def piecewise_score(x, pieces, out, scratch, mask):
+    """
+    Score x as the nested xr.where of the score_temp4 and score_prec
+    functions do, writing into preallocated arrays instead of creating
+    temporaries. The scores are identical.
+
+    Parameters
+    ----------
+    x : array-like
+        The average temperatures or precipitation totals to score
+    pieces : list of tuples
+        (threshold, value) from the innermost xr.where out, see
+        score_temp4_pieces and score_prec_pieces. Where x is above the
+        threshold the score is value, unless x is above a later threshold.
+        value is a number, or a function(x, out) writing the (float32)
+        value of the piece into out.
+    out : array-like
+        uint8 array, the same shape as x, to write the scores to
+    scratch : array-like
+        float32 work array, the same shape as x
+    mask : array-like
+        bool work array, the same shape as x
+
+    Returns
+    -------
+    out : array-like
+
+    """
+    out[...] = 0
+    for threshold, value in pieces:
+        np.greater(x, threshold, out=mask)
+        if callable(value):
+            value(x, scratch)
+            np.round(scratch, out=scratch)
+            np.copyto(out, scratch, where=mask, casting="unsafe")
+        else:
+            np.copyto(out, value, where=mask)
+    return out
+
+
+def score_temp4_pieces(tmin, tmax, topmin, topmax):
+    """
+    score_temp4 as pieces for piecewise_score.
+    """
+    tmin = tmin.astype("float32")
+    tmax = tmax.astype("float32")
+    topmin = topmin.astype("float32")
+    topmax = topmax.astype("float32")
+    topmid = 0.5 * (topmax + topmin)
+
+    def below_opt(avgt, out):
+        np.subtract(avgt, tmin, out=out)
+        np.multiply(100 / (topmid - tmin), out, out=out)
+
+    def above_opt(avgt, out):
+        np.subtract(tmax, avgt, out=out)
+        np.multiply(100 / (tmax - topmid), out, out=out)
+
+    return [(tmin, below_opt), (topmid, above_opt), (tmax, 0)]
+
+
+def score_prec_pieces(precmethod, pmin, pmax, popmin, popmax):
+    """
+    score_prec1, score_prec2 or score_prec3 (precmethod 1, 2 or 3) as
+    pieces for piecewise_score.
+    """
+    pmin = pmin.astype("float32")
+    pmax = pmax.astype("float32")
+    popmin = popmin.astype("float32")
+    popmax = popmax.astype("float32")
+    popmid = 0.5 * (popmax + popmin)
+
+    if precmethod == 1:
+
+        def below_opt(total, out):
+            np.subtract(total, pmin, out=out)
+            np.multiply(100 / (popmin - pmin), out, out=out)
+
+        def above_opt(total, out):
+            np.subtract(pmax, total, out=out)
+            np.multiply(100 / (pmax - popmax), out, out=out)
+
+        return [(pmin, below_opt), (popmin, 100), (popmax, above_opt), (pmax, 0)]
+    elif precmethod == 2:
+
+        def below_opt(total, out):
+            np.subtract(total, pmin, out=out)
+            np.multiply(200 / (popmin + popmax - 2 * pmin), out, out=out)
+
+        def above_opt(total, out):
+            np.subtract(pmax, total, out=out)
+            np.multiply(200 / (2 * pmax - popmin - popmax), out, out=out)
+
+        return [(pmin, below_opt), (popmid, above_opt), (pmax, 0)]
+    elif precmethod == 3:
+
+        def scaled(out, denominator):
+            np.divide(out, denominator, out=out)
+            np.add(out, 1, out=out)
+            np.multiply(50, out, out=out)
+
+        def below_opt(total, out):
+            np.subtract(total, popmin, out=out)
+            scaled(out, popmin - pmin)
+
+        def lower_opt(total, out):
+            np.subtract(total, popmin, out=out)
+            np.multiply(2, out, out=out)
+            scaled(out, popmax - popmin)
+
+        def upper_opt(total, out):
+            np.subtract(popmax, total, out=out)
+            np.multiply(2, out, out=out)
+            scaled(out, popmax - popmin)
+
+        def above_opt(total, out):
+            np.subtract(popmax, total, out=out)
+            scaled(out, pmax - popmax)
+
+        return [
+            (pmin, below_opt),
+            (popmin, lower_opt),
+            (popmid, upper_opt),
+            (popmax, above_opt),
+            (pmax, 0),
+        ]
+    raise ValueError(
+        "precmethod must be 1, 2 or 3. Currently set as " + str(precmethod)
+    )
+
+
+def gtime_arena(shape, dtypes=None, nprop=64):
+    """
+    Work arrays for score_gtime, allocated once for the longest rolling
+    sums (the shortest growing season length) and reused for every growing
+    season length.
+
+    Parameters
+    ----------
+    shape : tuple
+        (time, y, x) size of the rolling sums for the shortest growing
+        season length
+    dtypes : string, dict or None
+        dtype policy (see dtype_policy) of the rolling sums
+    nprop : int
+        Number of days at a time to add to the ktmp_ and kmax_days
+        proportion totals
+
+    Returns
+    -------
+    arena : dict
+        {name: numpy array}, filled with zeros. tempscore and precscore hold
+        the running maximum scores over the growing season lengths.
+
+    """
+    dtypes = dtype_policy(dtypes)
+    arrays = {
+        "total": dtypes["totals"],
+        "scratch": dtypes["totals"],
+        "days": dtypes["counts"],
+        "mask": "bool",
+        "tscore": "uint8",
+        "pscore": "uint8",
+        "kmax_int8": "int8",
+        "penalty": "int16",
+        "tempscore": "uint8",
+        "precscore": "uint8",
+    }
+    arena = {name: np.zeros(shape, dtype=dtype) for name, dtype in arrays.items()}
+    arena["prop"] = np.zeros((nprop,) + tuple(shape[1:]), dtype="float64")
+    return arena
+
+
+def add_days_prop(days, gtime, prop_total, prop):
+    """
+    Add days / gtime to prop_total (as prop_total += (days / gtime)[:n]),
+    nprop days at a time through the float64 work array prop.
+    """
+    nprop = prop.shape[0]
+    for start in range(0, prop_total.shape[0], nprop):
+        end = min(start + nprop, prop_total.shape[0])
+        block = prop[: end - start]
+        np.divide(days[start:end], gtime, out=block)
+        np.add(prop_total[start:end], block, out=prop_total[start:end])
+
+
+@traced
+def score_gtime(
+    gtime, GMIN, GMAX, totals, temp_pieces, prec_pieces, arena, ktmp_prop, kmax_prop
+):
+    """
+    Temperature and precipitation suitability scores of one growing season
+    length, from the running totals of the driving data, folded into the
+    running maximum scores over the growing season lengths. Works only on
+    numpy arrays, writing into the preallocated work arrays of arena, so
+    nothing is allocated per growing season length. The scores are
+    identical to those calculated with xarray.
+
+    Parameters
+    ----------
+    gtime : int
+        The growing season length
+    GMIN : np.uint16
+        The minimum growing season length of the crop
+    GMAX : np.uint16
+        The maximum growing season length of the crop
+    totals : dict
+        Running totals (see running_total) of "temp": the days within the
+        crop temperature range (annual method, see score_temp2) or the
+        daily mean temperature (perennial method), "ktmp": the days below
+        the killing temperature, "kmax": the days above the maximum
+        temperature and "pre": the precipitation
+    temp_pieces : list or None
+        score_temp4_pieces for the perennial method, None for the annual
+        method (see score_temp)
+    prec_pieces : list
+        score_prec_pieces
+    arena : dict
+        Work arrays from gtime_arena. Its tempscore and precscore are
+        updated with the scores of this growing season length.
+    ktmp_prop, kmax_prop : numpy arrays
+        float32 totals of the ktmp_ and kmax_days proportions of the growing
+        season lengths, added to
+
+    Returns
+    -------
+    ntime : int
+        Number of days (starting days of the growing season) scored, the
+        length of the valid part of arena's tempscore and precscore
+
+    """
+    ntime = totals["pre"].shape[0] - gtime
+    trace_note(
+        gtime=int(gtime), cells_days=int(ntime * np.prod(totals["pre"].shape[1:]))
+    )
+    total = arena["total"][:ntime]
+    scratch = arena["scratch"][:ntime]
+    days = arena["days"][:ntime]
+    mask = arena["mask"][:ntime]
+    tscore = arena["tscore"][:ntime]
+    pscore = arena["pscore"][:ntime]
+    kmax_int8 = arena["kmax_int8"][:ntime]
+    penalty = arena["penalty"][:ntime]
+    tempscore = arena["tempscore"][:ntime]
+    precscore = arena["precscore"][:ntime]
+
+    # days in the optimal/suitable temperature range within gtime
+    window_sums(totals["temp"], gtime, out=total)
+    if temp_pieces is None:
+        np.round(total, out=total)
+        np.copyto(days, total, casting="unsafe")
+        np.greater_equal(days, GMIN, out=mask)
+        tscore[...] = 0
+        np.copyto(tscore, score_temp(gtime, GMIN, GMAX).astype("uint8"), where=mask)
+    else:
+        np.divide(total, gtime, out=total)
+        np.round(total, out=total)
+        np.copyto(days, total, casting="unsafe")
+        piecewise_score(days, temp_pieces, tscore, scratch, mask)
+
+    # no score if there is a frost/killing temperature within gtime
+    window_sums(totals["ktmp"], gtime, out=days)
+    add_days_prop(days, gtime, ktmp_prop, arena["prop"])
+    np.greater(days, np.uint8(0), out=mask)
+    np.copyto(tscore, 0, where=mask)
+
+    # penalty of one per heat-stress day within gtime
+    window_sums(totals["kmax"], gtime, out=days)
+    add_days_prop(days, gtime, kmax_prop, arena["prop"])
+    np.copyto(kmax_int8, days, casting="unsafe")
+    np.subtract(tscore, kmax_int8, out=penalty)
+    np.maximum(penalty, 0, out=penalty)
+    np.copyto(tscore, penalty, casting="unsafe")
+
+    # precipitation score from the total precipitation in gtime
+    window_sums(totals["pre"], gtime, out=total)
+    piecewise_score(total, prec_pieces, pscore, scratch, mask)
+
+    # keep the highest of the growing season scores
+    np.maximum(tempscore, tscore, out=tempscore)
+    np.maximum(precscore, pscore, out=precscore)
+    return ntime
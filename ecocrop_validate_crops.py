@@ -0,0 +1,59 @@
+import sys
+from ecocrop_utils import validate_crops
+import pandas as pd
+
+#######################################################
+# Setup
+#######################################################
+"""
+Check every crop in the EcoCrop database can be run before
+submitting any jobs, without loading any met data, and
+write out the list of runnable crops.
+
+Inputs:
+
+ecocroploc: --- string
+                Path to EcoCrop csv database containing the crop
+                indices
+bgsloc: ------- string
+                Path to the soil texture mask for masking, or the
+                folder containing it
+outfile: ------ string (optional)
+                Path to write the runnable crops csv to. Has
+                columns cropind, cropname, ngtimes and warnings.
+                ngtimes is the number of growing season lengths
+                calculated for the crop, which the runtime and the
+                cost of the job are proportional to.
+                Defaults to runnable_crops.csv
+"""
+
+ecocroploc = sys.argv[1]
+bgsloc = sys.argv[2]
+if len(sys.argv) > 3:
+    outfile = sys.argv[3]
+else:
+    outfile = "runnable_crops.csv"
+
+#######################################################
+# Main script
+#######################################################
+
+ecocropall = pd.read_csv(ecocroploc, engine="python")
+ecocrop = ecocropall.drop(["level_0"], axis=1)
+crops = validate_crops(ecocrop, bgsloc)
+
+runnable = crops[crops["runnable"]]
+failed = crops[~crops["runnable"]]
+for cropind, crop in failed.iterrows():
+    print(str(cropind) + " " + crop["cropname"] + ": " + crop["problems"])
+
+print(
+    str(len(runnable))
+    + " of "
+    + str(len(crops))
+    + " crops can be run, "
+    + str(runnable["ngtimes"].sum())
+    + " growing season lengths in total"
+)
+runnable[["cropname", "ngtimes", "warnings"]].to_csv(outfile)
+print("Written " + outfile)